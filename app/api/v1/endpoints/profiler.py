@@ -0,0 +1,120 @@
+from fastapi import APIRouter, HTTPException, Depends, Query
+from fastapi.responses import JSONResponse, PlainTextResponse
+from typing import Dict, Any, List
+from pydantic import BaseModel, Field
+import asyncio
+import time
+import uuid
+
+from app.core.config import settings
+from app.core.security import get_admin_user
+from app.core.profiler import profiler
+
+async def profiler_habilitado():
+    if not settings.PROFILER_ENABLED:
+        raise HTTPException(status_code=404, detail="Profiler desabilitado")
+
+router = APIRouter(dependencies=[Depends(profiler_habilitado), Depends(get_admin_user)])
+
+FORMATOS = "^(collapsed|speedscope)$"
+
+class SlowRequestConfig(BaseModel):
+    threshold_ms: float = Field(..., gt=0, description="Latência a partir da qual o perfil é guardado")
+
+def _renderizar(amostras, formato: str, nome: str):
+    if formato == "speedscope":
+        return JSONResponse(profiler.to_speedscope(amostras, nome))
+    return PlainTextResponse(profiler.to_collapsed(amostras))
+
+@router.get("/status")
+async def status() -> Dict[str, Any]:
+    """
+    Estado do profiler neste worker
+    """
+    return {
+        "running": profiler.running,
+        "interval_ms": profiler.interval * 1000,
+        "slow_threshold_ms": profiler.slow_threshold * 1000 if profiler.slow_threshold is not None else None,
+        "slow_profiles": len(profiler.slow_profiles)
+    }
+
+@router.post("/start")
+async def start() -> Dict[str, Any]:
+    """
+    Liga a amostragem contínua neste worker (as últimas PROFILER_RING_SECONDS
+    ficam disponíveis em /recent)
+    """
+    profiler.enable("manual")
+    return await status()
+
+@router.post("/stop")
+async def stop() -> Dict[str, Any]:
+    # disable() espera a thread de amostragem terminar: fora do event loop
+    await asyncio.to_thread(profiler.disable, "manual")
+    return await status()
+
+@router.get("/capture")
+async def capture(
+    seconds: float = Query(10, gt=0),
+    format: str = Query("collapsed", regex=FORMATOS)
+):
+    """
+    Amostra o worker por N segundos e retorna o perfil (pilhas colapsadas ou speedscope)
+    """
+    if seconds > profiler.ring_seconds:
+        raise HTTPException(status_code=400, detail=f"Máximo de {profiler.ring_seconds}s por captura")
+    consumidor = f"capture-{uuid.uuid4().hex}"
+    inicio = time.perf_counter()
+    profiler.enable(consumidor)
+    try:
+        await asyncio.sleep(seconds)
+        amostras = profiler.samples_since(inicio)
+    finally:
+        await asyncio.to_thread(profiler.disable, consumidor)
+    return _renderizar(amostras, format, f"capture {seconds}s")
+
+@router.get("/recent")
+async def recent(
+    seconds: float = Query(10, gt=0),
+    format: str = Query("collapsed", regex=FORMATOS)
+):
+    """
+    Perfil dos últimos N segundos já amostrados, sem esperar
+    """
+    if not profiler.running:
+        raise HTTPException(status_code=409, detail="Profiler parado")
+    amostras = profiler.samples_since(time.perf_counter() - seconds)
+    return _renderizar(amostras, format, f"recent {seconds}s")
+
+@router.put("/slow-requests")
+async def enable_slow_requests(config: SlowRequestConfig) -> Dict[str, Any]:
+    """
+    Guarda o perfil de toda requisição acima do limiar
+    """
+    profiler.enable_slow_requests(config.threshold_ms)
+    return await status()
+
+@router.delete("/slow-requests")
+async def disable_slow_requests() -> Dict[str, Any]:
+    await asyncio.to_thread(profiler.disable_slow_requests)
+    return await status()
+
+@router.get("/slow-requests")
+async def list_slow_requests() -> List[Dict[str, Any]]:
+    """
+    Requisições lentas capturadas, da mais recente para a mais antiga
+    """
+    return [
+        {**perfil, "samples": len(perfil["samples"])}
+        for perfil in reversed(profiler.slow_profiles)
+    ]
+
+@router.get("/slow-requests/{profile_id}")
+async def get_slow_request(
+    profile_id: str,
+    format: str = Query("speedscope", regex=FORMATOS)
+):
+    for perfil in profiler.slow_profiles:
+        if perfil["id"] == profile_id:
+            return _renderizar(perfil["samples"], format, f"{perfil['method']} {perfil['endpoint']}")
+    raise HTTPException(status_code=404, detail="Perfil não encontrado")
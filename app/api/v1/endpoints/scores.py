@@ -1,27 +1,40 @@
-from fastapi import APIRouter, HTTPException, Depends, Request
-from typing import Dict, Any, List
-from pydantic import BaseModel, Field
+from fastapi import APIRouter, HTTPException, Depends, Request, Query
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from typing import Dict, Any, List, Optional, AsyncIterator, Tuple
+from pydantic import BaseModel, Field, ValidationError
+from starlette.requests import ClientDisconnect
 from datetime import datetime
+import asyncio
+import orjson
 
 from app.core.config import settings
 from app.services.score_service import ScoreService
-from app.services.feature_service import FeatureService
+from app.services.feature_service import FeatureService, CAMPOS_HISTORICO
 from app.core.security import get_current_user
-from app.core.cache import cache_score
 from app.core.logger import ScoreLogger
+from app.core.metrics import medir_etapa, SCORE_BATCH_SIZE
+from app.core.concurrency import AdaptiveConcurrencyLimiter
+from app.core.resilience import CircuitOpenError, DeadlineExceeded, start_deadline
+from app.ml.drift import drift_monitor
 from app.ml.model_manager import ModelManager
+from app.ml.shadow import ShadowScorer
 
 router = APIRouter()
 score_service = ScoreService()
 feature_service = FeatureService()
 model_manager = ModelManager()
 score_logger = ScoreLogger()
+limiter = AdaptiveConcurrencyLimiter()
+if settings.SHADOW_MODEL_VERSION:
+    model_manager.load_shadow_model(settings.SHADOW_MODEL_VERSION)
+shadow_scorer = ShadowScorer(model_manager, feature_service.redis_client, limiter)
 
 class ScoreRequest(BaseModel):
     user_id: str = Field(..., description="ID único do usuário")
     features: Dict[str, Any] = Field(..., description="Features comportamentais do usuário")
     source_app: str = Field(..., description="Aplicação de origem da requisição")
     model_version: str = Field(None, description="Versão específica do modelo (opcional)")
+    explanation_top_k: Optional[int] = Field(None, ge=1, description="Retorna só as K features de maior impacto (opcional)")
 
 class ScoreResponse(BaseModel):
     user_id: str
@@ -32,13 +45,24 @@ class ScoreResponse(BaseModel):
     model_version: str
     timestamp: str
 
-@router.post("/calculate", response_model=ScoreResponse)
-@cache_score(expire=3600)  # Cache por 1 hora
+def _risk(score: float) -> str:
+    return "alto" if score < 40 else "médio" if score < 70 else "baixo"
+
+def _features_used(features: Dict[str, Any]) -> List[str]:
+    """
+    Features informadas na resposta, sem os históricos internos
+    """
+    return [nome for nome in features if nome not in CAMPOS_HISTORICO]
+
+# A resposta é montada já tipada e serializada direto com orjson: retornar um
+# ORJSONResponse dispensa a revalidação pelo response_model e o jsonable_encoder
+# (o response_model continua documentando o contrato no OpenAPI)
+@router.post("/calculate", response_model=ScoreResponse, response_class=ORJSONResponse)
 async def calculate_score(
     request: ScoreRequest,
     current_user: Dict = Depends(get_current_user),
     fastapi_request: Request = None
-) -> ScoreResponse:
+) -> ORJSONResponse:
     """
     Calcula o score de reputação para um usuário
     
@@ -46,69 +70,251 @@ async def calculate_score(
     - **features**: Features comportamentais (ex: pagou_pix, entregas_atrasadas)
     - **source_app**: Aplicação de origem
     - **model_version**: Versão específica do modelo (opcional)
+    - **explanation_top_k**: Quantidade de features na explicação (opcional)
     """
+    # Admissão antes de qualquer trabalho: sob sobrecarga a requisição é
+    # rejeitada na hora (503/429 com Retry-After), sem fila nem fallback
+    async with limiter.slot(request.source_app):
+        return await _calculate(request, fastapi_request)
+
+async def _calculate(request: ScoreRequest, fastapi_request: Optional[Request]) -> ORJSONResponse:
+    top_k = request.explanation_top_k or settings.SCORE_EXPLANATION_TOP_K or None
     try:
         # Carrega versão específica do modelo se solicitado
         if request.model_version:
             model_manager.load_model_version(request.model_version)
         
-        # Obtém features do usuário
-        user_features = await feature_service.get_user_features(request.user_id)
+        versao = model_manager.current_version
+        SCORE_BATCH_SIZE.labels(model_version=versao or "desconhecido").observe(1)
         
-        # Combina features
-        combined_features = {**user_features, **request.features}
+        # Sem overrides na requisição, o vetor pronto do modelo vem direto do
+        # Redis (np.frombuffer), sem decodificar o dicionário de features
+        esquema = model_manager.schema_version if settings.FEATURE_VECTOR_CACHE_ENABLED and not request.features else None
+        vetor = None
+        if esquema:
+            nomes = model_manager.feature_names
+            feature_service.register_vector_schema(esquema, nomes)
+            with medir_etapa("feature_fetch", versao, cache="vector"):
+                vetor = feature_service.get_feature_vector(request.user_id, esquema, nomes)
         
-        # Calcula o score
-        prediction = model_manager.predict(combined_features)
+        if vetor is not None:
+            combined_features = dict(zip(nomes, vetor.tolist()))
+            with medir_etapa("model_inference", versao):
+                prediction = model_manager.predict_vector(vetor)
+        else:
+            # Obtém features do usuário
+            with medir_etapa("feature_fetch", versao) as etapa:
+                user_features, cache = await feature_service.get_user_features_with_status(request.user_id)
+                etapa["cache"] = cache
+            if esquema:
+                feature_service.store_feature_vector(request.user_id, esquema, nomes, user_features)
+            
+            # Combina features
+            with medir_etapa("feature_assembly", versao):
+                combined_features = {**user_features, **request.features}
+            
+            # Calcula o score
+            with medir_etapa("model_inference", versao):
+                prediction = model_manager.predict(combined_features)
+        drift_monitor.observe(prediction["version"], combined_features, prediction["score"])
         
         # Gera explicação
-        explanation = await score_service.generate_explanation(
-            features=combined_features,
-            score=prediction["score"]
-        )
+        with medir_etapa("shap", versao):
+            explanation = await score_service.generate_explanation(
+                features=combined_features,
+                score=prediction["score"],
+                top_k=top_k
+            )
         
         # Determina nível de risco
-        risk = "alto" if prediction["score"] < 40 else "médio" if prediction["score"] < 70 else "baixo"
+        risk = _risk(prediction["score"])
         
         # Registra log LGPD
-        trace_id = fastapi_request.state.trace_id if fastapi_request else None
-        score_logger.log_score_calculation(
-            user_id=request.user_id,
-            score=prediction["score"],
-            features=combined_features,
-            model_version=prediction["version"],
-            source_app=request.source_app,
-            explanation=explanation,
-            trace_id=trace_id
-        )
+        with medir_etapa("logging", versao):
+            trace_id = fastapi_request.state.trace_id if fastapi_request else None
+            score_logger.log_score_calculation(
+                user_id=request.user_id,
+                score=prediction["score"],
+                features=combined_features,
+                model_version=prediction["version"],
+                source_app=request.source_app,
+                explanation=explanation,
+                trace_id=trace_id
+            )
         
-        return ScoreResponse(
-            user_id=request.user_id,
-            score=prediction["score"],
-            risk=risk,
-            explanation=explanation,
-            features_used=list(combined_features.keys()),
-            model_version=prediction["version"],
-            timestamp=prediction["timestamp"]
-        )
+        # Agendada só com a resposta pronta: roda no executor de shadow
+        shadow_scorer.submit(combined_features, prediction["score"], prediction["version"])
+        
+        return ORJSONResponse({
+            "user_id": request.user_id,
+            "score": prediction["score"],
+            "risk": risk,
+            "explanation": explanation,
+            "features_used": _features_used(combined_features),
+            "model_version": prediction["version"],
+            "timestamp": prediction["timestamp"]
+        })
     
     except Exception as e:
-        # Fallback: buscar último score salvo
-        last_scores = await score_service.get_score_history(request.user_id)
+        # Fallback: buscar último score salvo; com o banco indisponível ou sem
+        # orçamento restante, responde 503 na hora
+        try:
+            last_scores = await score_service.get_score_history(request.user_id)
+        except (CircuitOpenError, DeadlineExceeded) as indisponivel:
+            raise HTTPException(status_code=503, detail=str(indisponivel))
         if last_scores:
             last_score = last_scores[0]
-            return ScoreResponse(
-                user_id=request.user_id,
-                score=last_score["score"],
-                risk="desconhecido",
-                explanation=last_score["explanation"],
-                features_used=list(last_score["features"].keys()),
-                model_version="desconhecido",
-                timestamp=last_score["timestamp"]
-            )
+            return ORJSONResponse({
+                "user_id": request.user_id,
+                "score": last_score["score"],
+                "risk": "desconhecido",
+                "explanation": sorted(
+                    last_score["explanation"], key=lambda e: abs(e["impact"]), reverse=True
+                )[:top_k] if top_k else last_score["explanation"],
+                "features_used": _features_used(last_score["features"]),
+                "model_version": "desconhecido",
+                "timestamp": last_score["timestamp"]
+            })
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.get("/history/{user_id}")
+class _BodyStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse cujo gerador lê o próprio corpo da requisição: sem a
+    tarefa que escuta a desconexão, que disputaria as mensagens de receive.
+    A desconexão é detectada pelo gerador (ClientDisconnect/is_disconnected).
+    """
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+async def _ndjson_lines(fastapi_request: Request) -> AsyncIterator[Tuple[int, bytes]]:
+    """
+    Linhas do corpo NDJSON, lidas incrementalmente com tamanho máximo por linha
+    """
+    resto = b""
+    numero = 0
+    async for pedaco in fastapi_request.stream():
+        resto += pedaco
+        *linhas, resto = resto.split(b"\n")
+        if len(resto) > settings.SCORE_STREAM_MAX_LINE_BYTES:
+            raise ValueError(f"Linha {numero + len(linhas) + 1} excede {settings.SCORE_STREAM_MAX_LINE_BYTES} bytes")
+        for linha in linhas:
+            numero += 1
+            if linha.strip():
+                yield numero, linha
+    if resto.strip():
+        yield numero + 1, resto
+
+async def _score_chunk(
+    registros: List[Tuple[int, ScoreRequest]],
+    trace_id: Optional[str],
+    top_k: Optional[int]
+) -> List[Dict[str, Any]]:
+    """
+    Pontua um lote pelo mesmo caminho de /calculate, com leitura de features,
+    inferência e SHAP em lote
+    """
+    versao = model_manager.current_version
+    SCORE_BATCH_SIZE.labels(model_version=versao or "desconhecido").observe(len(registros))
+    
+    with medir_etapa("feature_fetch", versao, cache="bulk"):
+        user_features = await feature_service.get_many_user_features([r.user_id for _, r in registros])
+    
+    with medir_etapa("feature_assembly", versao):
+        combinadas = [{**uf, **r.features} for uf, (_, r) in zip(user_features, registros)]
+    
+    with medir_etapa("model_inference", versao):
+        predicoes = model_manager.predict_many(combinadas)
+    for features, predicao in zip(combinadas, predicoes):
+        drift_monitor.observe(predicao["version"], features, predicao["score"])
+    
+    with medir_etapa("shap", versao):
+        explicacoes = await score_service.generate_explanations(combinadas, top_k=top_k)
+    
+    resultados = []
+    with medir_etapa("logging", versao):
+        for (_, registro), features, predicao, explicacao in zip(registros, combinadas, predicoes, explicacoes):
+            score_logger.log_score_calculation(
+                user_id=registro.user_id,
+                score=predicao["score"],
+                features=features,
+                model_version=predicao["version"],
+                source_app=registro.source_app,
+                explanation=explicacao,
+                trace_id=trace_id
+            )
+            resultados.append({
+                "user_id": registro.user_id,
+                "score": predicao["score"],
+                "risk": _risk(predicao["score"]),
+                "explanation": explicacao,
+                "features_used": _features_used(features),
+                "model_version": predicao["version"],
+                "timestamp": predicao["timestamp"]
+            })
+    return resultados
+
+@router.post("/calculate/stream")
+async def calculate_score_stream(
+    fastapi_request: Request,
+    model_version: Optional[str] = Query(None, description="Versão do modelo para todo o lote (opcional)"),
+    explanation_top_k: Optional[int] = Query(None, ge=1, description="Features na explicação (opcional)"),
+    current_user: Dict = Depends(get_current_user)
+) -> StreamingResponse:
+    """
+    Pontua em massa: recebe NDJSON (um ScoreRequest por linha) e devolve NDJSON
+    (um ScoreResponse por linha, ou {"line", "error"} para linhas inválidas)
+    à medida que cada lote interno termina. A memória fica limitada a um lote,
+    e a desconexão do cliente interrompe o processamento.
+    """
+    # O lote inteiro não cabe no orçamento de uma requisição comum; cada
+    # dependência ainda tem os seus próprios timeouts
+    start_deadline(None)
+    if model_version:
+        model_manager.load_model_version(model_version)
+    top_k = explanation_top_k or settings.SCORE_EXPLANATION_TOP_K or None
+    trace_id = getattr(fastapi_request.state, "trace_id", None)
+    
+    async def processar(lote: List[Tuple[int, ScoreRequest]]) -> bytes:
+        # Lotes ocupam uma vaga de prioridade "batch" do limitador, cedendo
+        # espaço ao tráfego interativo, sem alimentar o gradiente de latência
+        try:
+            await limiter.acquire("batch", timeout=settings.SCORE_STREAM_ACQUIRE_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError as e:
+            resultados = [{"line": numero, "user_id": r.user_id, "error": str(e)} for numero, r in lote]
+        else:
+            try:
+                resultados = await _score_chunk(lote, trace_id, top_k)
+            except Exception as e:
+                resultados = [{"line": numero, "user_id": r.user_id, "error": str(e)} for numero, r in lote]
+            finally:
+                limiter.release(None)
+        return b"".join(orjson.dumps(resultado) + b"\n" for resultado in resultados)
+    
+    async def gerar() -> AsyncIterator[bytes]:
+        lote: List[Tuple[int, ScoreRequest]] = []
+        try:
+            async for numero, linha in _ndjson_lines(fastapi_request):
+                try:
+                    lote.append((numero, ScoreRequest.parse_obj(orjson.loads(linha))))
+                except (orjson.JSONDecodeError, ValidationError) as e:
+                    yield orjson.dumps({"line": numero, "error": str(e)}) + b"\n"
+                    continue
+                if len(lote) >= settings.SCORE_STREAM_CHUNK_SIZE:
+                    yield await processar(lote)
+                    lote = []
+        except ClientDisconnect:
+            return
+        except ValueError as e:
+            yield orjson.dumps({"error": str(e)}) + b"\n"
+            return
+        if lote and not await fastapi_request.is_disconnected():
+            yield await processar(lote)
+    
+    return _BodyStreamingResponse(gerar(), media_type="application/x-ndjson")
+
+@router.get("/history/{user_id}", response_class=ORJSONResponse)
 async def get_score_history(
     user_id: str,
     current_user: Dict = Depends(get_current_user)
@@ -117,7 +323,7 @@ async def get_score_history(
     Retorna o histórico de scores de um usuário
     """
     try:
-        return await score_service.get_score_history(user_id)
+        return ORJSONResponse(await score_service.get_score_history(user_id))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -155,4 +361,20 @@ async def get_model_info(
     try:
         return model_manager.get_model_info()
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e)) 
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/model/shadow")
+async def get_shadow_comparison(
+    current_user: Dict = Depends(get_current_user)
+) -> Dict[str, Any]:
+    """
+    Retorna o modelo candidato em shadow e a comparação agregada com produção
+    """
+    try:
+        return {
+            "shadow_version": model_manager.shadow_version,
+            "sample_rate": shadow_scorer.sample_rate,
+            "comparisons": shadow_scorer.summary()
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
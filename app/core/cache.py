@@ -9,7 +9,7 @@ async def init_cache():
     Inicializa o cache Redis
     """
     redis = aioredis.from_url(
-        f"redis://{settings.REDIS_HOST}:{settings.REDIS_PORT}",
+        settings.REDIS_URL,
         encoding="utf8",
         decode_responses=True
     )
@@ -0,0 +1,169 @@
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict, Optional
+import asyncio
+import math
+import time
+
+from fastapi import HTTPException
+from prometheus_client import Counter, Gauge
+
+from app.core.config import settings
+
+ADMISSION_EVENTS = Counter(
+    'score_admission_total',
+    'Requisições de score admitidas ou descartadas pelo limitador',
+    ['priority', 'result']  # admitted, shed
+)
+
+CONCURRENCY_LIMIT = Gauge(
+    'score_concurrency_limit',
+    'Limite de concorrência atual do limitador adaptativo',
+    multiprocess_mode='livesum'
+)
+
+INFLIGHT = Gauge(
+    'score_inflight_requests',
+    'Requisições de score em andamento',
+    multiprocess_mode='livesum'
+)
+
+# Fração do limite disponível para cada classe de prioridade: sob carga, as
+# classes menos prioritárias são descartadas primeiro
+PRIORITY_SHARES = {
+    "critical": 1.0,
+    "normal": 0.9,
+    "batch": 0.5,
+}
+
+class AdaptiveConcurrencyLimiter:
+    """
+    Limitador de concorrência adaptativo baseado no gradiente de latência: o
+    limite cresce enquanto a latência observada fica perto da latência sem
+    carga (média longa) e encolhe quando ela sobe, o que indica fila. Quem
+    passa do limite é rejeitado na hora, sem esperar.
+    """
+    def __init__(
+        self,
+        initial_limit: int = None,
+        min_limit: int = None,
+        max_limit: int = None,
+        tolerance: float = None,
+        smoothing: float = 0.2
+    ):
+        self.limit = float(initial_limit or settings.SCORE_CONCURRENCY_INITIAL_LIMIT)
+        self.min_limit = min_limit or settings.SCORE_CONCURRENCY_MIN_LIMIT
+        self.max_limit = max_limit or settings.SCORE_CONCURRENCY_MAX_LIMIT
+        self.tolerance = tolerance or settings.SCORE_CONCURRENCY_TOLERANCE
+        self.smoothing = smoothing
+        self.inflight = 0
+        self._esperando: Deque[asyncio.Future] = deque()  # acquire() aguardando uma vaga
+        self._rtt_longo: Optional[float] = None
+        self._rtt_curto: Optional[float] = None
+        CONCURRENCY_LIMIT.set(self.limit)
+
+    def saturated(self, prioridade: str) -> bool:
+        """
+        Se a classe de prioridade já esgotou a sua fração do limite
+        """
+        return self.inflight >= self.limit * PRIORITY_SHARES.get(prioridade, PRIORITY_SHARES["normal"])
+
+    def try_acquire(self, prioridade: str) -> bool:
+        if self.saturated(prioridade):
+            return False
+        self.inflight += 1
+        INFLIGHT.inc()
+        return True
+
+    async def acquire(self, prioridade: str, timeout: float) -> None:
+        """
+        Espera por uma vaga, para trabalho em lote que pode ceder a vez. Cada
+        release() acorda o próximo da fila; sem vaga em timeout segundos,
+        levanta asyncio.TimeoutError.
+        """
+        prazo = time.monotonic() + timeout
+        while not self.try_acquire(prioridade):
+            restante = prazo - time.monotonic()
+            if restante <= 0:
+                raise asyncio.TimeoutError(f"Sem vaga de prioridade {prioridade} em {timeout}s")
+            vez = asyncio.get_running_loop().create_future()
+            self._esperando.append(vez)
+            try:
+                await asyncio.wait_for(vez, restante)
+            except asyncio.TimeoutError:
+                pass
+            except asyncio.CancelledError:
+                if vez.done() and not vez.cancelled():
+                    # Foi acordado mas não vai usar a vaga: repassa a vez
+                    self._acordar()
+                raise
+            finally:
+                if vez in self._esperando:
+                    self._esperando.remove(vez)
+
+    def _acordar(self) -> None:
+        while self._esperando:
+            vez = self._esperando.popleft()
+            if not vez.done():
+                vez.set_result(None)
+                return
+
+    def release(self, latencia: Optional[float]) -> None:
+        """
+        Libera a vaga e acorda o próximo acquire(); latencia None (erro) não
+        alimenta o gradiente
+        """
+        self.inflight -= 1
+        INFLIGHT.dec()
+        if latencia is not None:
+            self._on_sample(latencia)
+        self._acordar()
+
+    def _on_sample(self, rtt: float) -> None:
+        if self._rtt_longo is None:
+            self._rtt_longo = self._rtt_curto = rtt
+            return
+        # Média curta: latência atual; média longa: latência sem carga
+        self._rtt_curto += 0.1 * (rtt - self._rtt_curto)
+        self._rtt_longo += (rtt - self._rtt_longo) / 600
+        if self._rtt_longo > self._rtt_curto * 2:
+            # Carga caiu muito: a média longa se reaproxima mais rápido
+            self._rtt_longo *= 0.95
+
+        gradiente = max(0.5, min(1.0, self.tolerance * self._rtt_longo / self._rtt_curto))
+        fila = math.sqrt(self.limit)
+        novo = self.limit * gradiente + fila
+        novo = self.limit * (1 - self.smoothing) + novo * self.smoothing
+        self.limit = max(self.min_limit, min(self.max_limit, novo))
+        CONCURRENCY_LIMIT.set(self.limit)
+
+    def retry_after(self) -> int:
+        """
+        Segundos sugeridos ao cliente: o tempo de escoar a fila atual
+        """
+        rtt = self._rtt_curto or 1.0
+        return max(1, math.ceil(rtt * self.inflight / max(self.limit, 1)))
+
+    @asynccontextmanager
+    async def slot(self, source_app: str):
+        """
+        Admite a requisição ou levanta 503 (limite geral atingido) ou 429 (a
+        classe de prioridade de source_app esgotou a sua fração do limite)
+        """
+        prioridade = settings.SCORE_PRIORITY_CLASSES.get(source_app, "normal")
+        if not self.try_acquire(prioridade):
+            ADMISSION_EVENTS.labels(priority=prioridade, result="shed").inc()
+            saturado = self.inflight >= self.limit
+            raise HTTPException(
+                status_code=503 if saturado else 429,
+                detail="Servidor sobrecarregado" if saturado else "Limite da classe de prioridade atingido",
+                headers={"Retry-After": str(self.retry_after())}
+            )
+        ADMISSION_EVENTS.labels(priority=prioridade, result="admitted").inc()
+        inicio = time.perf_counter()
+        latencia = None
+        try:
+            yield
+            latencia = time.perf_counter() - inicio
+        finally:
+            self.release(latencia)
@@ -1,5 +1,5 @@
 from pydantic import BaseSettings
-from typing import Optional
+from typing import Dict, List, Optional
 import os
 from dotenv import load_dotenv
 
@@ -16,11 +16,68 @@ class Settings(BaseSettings):
     SECRET_KEY: str
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
+    JWT_BACKEND: str = "jose"  # "jose" ou "pyjwt" (mais rápido; requer o pacote PyJWT)
+    AUTH_TOKEN_CACHE_SIZE: int = 10000  # Tokens verificados em cache por worker (0 desativa)
+    AUTH_TOKEN_CACHE_MAX_TTL_SECONDS: int = 300  # Limite mesmo para tokens com exp distante
+    # Serviços internos confiáveis: {"nome_do_servico": "<sha256 hex do token>"}
+    INTERNAL_SERVICE_TOKENS: Dict[str, str] = {}
     
     # Redis
     REDIS_HOST: str = "localhost"
     REDIS_PORT: int = 6379
     REDIS_URL: str = "redis://localhost:6379/0"
+    # Nós do cache de features, distribuídos por hash consistente (vazio usa só REDIS_URL).
+    # No modo FEATURE_STORE_MODE=redis a lista fica registrada nos nós e uma lista
+    # diferente impede a partida: antes de trocá-la, pare consumers e API e rode
+    # python -m app.workers.feature_snapshotter --rebalance '<nova lista>'
+    REDIS_NODES: List[str] = []
+    REDIS_SHARD_VNODES: int = 160  # Pontos de cada nó no anel de hash
+    FEATURE_BATCH_SIZE: int = 1000  # Ids por MGET/consulta IN nas leituras em massa
+    
+    # Cache de features
+    FEATURE_CACHE_TTL_SECONDS: int = 3600
+    FEATURE_CACHE_TTL_JITTER: float = 0.1  # Variação relativa do TTL (±10%)
+    FEATURE_CACHE_STALE_SECONDS: int = 300  # Janela stale-while-revalidate (0 desativa)
+    FEATURE_CACHE_XFETCH_BETA: float = 1.0  # Agressividade da expiração antecipada
+    FEATURE_CACHE_LOCK_TIMEOUT_MS: int = 5000
+    FEATURE_CACHE_LOCK_WAIT_MS: int = 200
+    
+    # Feature store: "postgres" (PostgreSQL é a fonte da verdade) ou "redis"
+    # (Redis com AOF guarda o estado vivo e o PostgreSQL recebe snapshots)
+    FEATURE_STORE_MODE: str = "postgres"
+    FEATURE_SNAPSHOT_INTERVAL_SECONDS: int = 30
+    FEATURE_SNAPSHOT_BATCH_SIZE: int = 500
+    FEATURE_WINDOWS_ENABLED: bool = True  # Janelas de tempo de evento (1h/24h/30d) no Redis
+    FEATURE_VECTOR_CACHE_ENABLED: bool = True  # Vetor float32 pronto para o modelo, por usuário e esquema
+    FEATURE_VECTOR_SCHEMA_REFRESH_SECONDS: int = 30  # Releitura dos esquemas em uso no caminho de escrita
+    FEATURE_VECTOR_SCHEMA_IDLE_SECONDS: int = 86400  # Esquemas sem uso por esse tempo deixam de ser materializados
+    
+    # Profiler por amostragem (rotas admin em /api/v1/admin/profiler)
+    PROFILER_ENABLED: bool = False  # Libera as rotas do profiler
+    PROFILER_INTERVAL_MS: int = 10
+    PROFILER_RING_SECONDS: int = 60  # Janela de amostras mantida em memória
+    PROFILER_MAX_SLOW_PROFILES: int = 20
+    PROFILER_SLOW_REQUEST_MS: int = 0  # Liga a captura de requisições lentas na partida (0 desativa)
+    
+    # Scoring
+    SCORE_EXPLANATION_TOP_K: int = 0  # Features na explicação por padrão (0 = todas)
+    # Limitador de concorrência adaptativo de /calculate (por worker)
+    SCORE_CONCURRENCY_INITIAL_LIMIT: int = 20
+    SCORE_CONCURRENCY_MIN_LIMIT: int = 4
+    SCORE_CONCURRENCY_MAX_LIMIT: int = 200
+    SCORE_CONCURRENCY_TOLERANCE: float = 1.5  # Aumento de latência aceito antes de reduzir o limite
+    # Classe de prioridade por source_app: "critical", "normal" (padrão) ou "batch"
+    SCORE_PRIORITY_CLASSES: Dict[str, str] = {}
+    # Endpoint NDJSON /calculate/stream
+    SCORE_STREAM_CHUNK_SIZE: int = 200  # Registros pontuados por lote interno
+    SCORE_STREAM_MAX_LINE_BYTES: int = 65536
+    SCORE_STREAM_ACQUIRE_TIMEOUT_SECONDS: float = 30  # Espera máxima de um lote por vaga no limitador
+    # Pontuação em shadow de um modelo candidato (app/ml/shadow.py)
+    SHADOW_MODEL_VERSION: str = ""  # Vazio desativa
+    SHADOW_SAMPLE_RATE: float = 0.0  # Fração das requisições pontuadas também pelo candidato
+    SHADOW_MAX_CONCURRENCY: int = 2  # Threads do executor de shadow
+    SHADOW_MAX_PENDING: int = 50  # Acima disso o trabalho de shadow é descartado
+    SHADOW_COMPARISON_TTL_SECONDS: int = 604800
     
     # PostgreSQL
     POSTGRES_HOST: str = "localhost"
@@ -29,7 +86,13 @@ class Settings(BaseSettings):
     POSTGRES_PASSWORD: str
     POSTGRES_DB: str
     MLFLOW_EXPERIMENT_NAME: str = "default"
-    
+    # Réplicas de leitura (app/db/routing.py); vazio lê tudo do primário
+    DATABASE_REPLICA_URLS: List[str] = []
+    DATABASE_REPLICA_MAX_LAG_SECONDS: float = 2.0  # Réplicas mais atrasadas não recebem leituras
+    DATABASE_REPLICA_CHECK_SECONDS: float = 1.0  # Intervalo entre medições do atraso, por processo
+    DATABASE_READ_YOUR_WRITES_SECONDS: int = 30  # Após uma escrita, leituras do usuário exigem o LSN dela
+    DATABASE_REPLICA_CLOCK_SKEW_SECONDS: float = 0.1  # Folga entre os relógios dos processos no read-your-writes
+
     @property
     def DATABASE_URL(self) -> str:
         return (
@@ -46,6 +109,36 @@ class Settings(BaseSettings):
     # Configurações do Kafka
     KAFKA_BOOTSTRAP_SERVERS: str = os.getenv("KAFKA_BOOTSTRAP_SERVERS", "localhost:9092")
     KAFKA_CONSUMER_GROUP: str = os.getenv("KAFKA_CONSUMER_GROUP", "score_engine_group")
+    # Frota de consumers (app/workers/consumer_fleet.py)
+    CONSUMER_PROCESSES: int = 0  # 0 = um processo por núcleo
+    CONSUMER_POLL_MAX_RECORDS: int = 500
+    CONSUMER_METRICS_INTERVAL_SECONDS: int = 10  # Lag e eventos/s por partição
+    CONSUMER_METRICS_PORT: int = 9101
+    CONSUMER_SHUTDOWN_TIMEOUT_SECONDS: int = 30
+    CONSUMER_MAX_ATTEMPTS: int = 5  # Tentativas de um evento antes do tópico de dead letter
+    CONSUMER_RETRY_BACKOFF_MS: int = 500  # Pausa antes de reentregar um evento que falhou
+    CONSUMER_DLQ_TOPIC: str = "user_events_dlq"
+    
+    # Monitor de drift (app/ml/drift.py)
+    DRIFT_MONITOR_ENABLED: bool = True
+    DRIFT_INTERVAL_SECONDS: int = 60  # Comparação com a referência e exportação de PSI/KS
+    DRIFT_WINDOW_SECONDS: int = 3600  # Janela deslizante comparada com a referência
+    DRIFT_WINDOW_BUCKETS: int = 12
+    DRIFT_BUFFER_SIZE: int = 100000  # Observações pendentes por processo (as mais antigas são descartadas)
+    DRIFT_REFERENCE_DIR: str = "models"  # reference_<versão>.json ou reference_profile.json
+    
+    # Deadlines, timeouts e circuit breakers (app/core/resilience.py)
+    REQUEST_DEADLINE_MS: int = 1000  # Orçamento por requisição (X-Request-Timeout-Ms pode reduzir; 0 desativa)
+    REDIS_SOCKET_TIMEOUT_MS: int = 100  # Clientes do caminho das requisições
+    REDIS_BATCH_SOCKET_TIMEOUT_MS: int = 5000  # Workers, scripts e tarefas em lote (pipelines de milhares de chaves)
+    REDIS_CONNECT_TIMEOUT_MS: int = 100
+    POSTGRES_CONNECT_TIMEOUT_SECONDS: int = 2
+    POSTGRES_STATEMENT_TIMEOUT_MS: int = 500  # Só nas requisições com deadline (SET LOCAL), reduzido ao orçamento restante
+    POSTGRES_POOL_TIMEOUT_SECONDS: float = 0.5  # Espera máxima por uma conexão livre do pool da API
+    MLFLOW_HTTP_TIMEOUT_SECONDS: int = 10
+    MLFLOW_HTTP_MAX_RETRIES: int = 2
+    CIRCUIT_FAILURE_THRESHOLD: int = 5  # Falhas seguidas que abrem o circuito
+    CIRCUIT_RESET_TIMEOUT_SECONDS: float = 10  # Tempo aberto antes da chamada de teste
     
     # Configurações do Prometheus
     PROMETHEUS_MULTIPROC_DIR: str = os.getenv("PROMETHEUS_MULTIPROC_DIR", "/tmp/prometheus_multiproc")
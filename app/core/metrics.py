@@ -0,0 +1,69 @@
+from contextlib import contextmanager
+import os
+import time
+
+from fastapi import Response
+from prometheus_client import (
+    CollectorRegistry,
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    Histogram,
+    generate_latest,
+    multiprocess
+)
+
+from app.core.config import settings
+
+# Métricas do pipeline de score
+SCORE_STAGE_LATENCY = Histogram(
+    'score_stage_duration_seconds',
+    'Latência de cada etapa do cálculo de score',
+    ['stage', 'model_version', 'cache'],
+    buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5)
+)
+
+SCORE_BATCH_SIZE = Histogram(
+    'score_batch_size',
+    'Usuários pontuados por chamada',
+    ['model_version'],
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 5000)
+)
+
+@contextmanager
+def medir_etapa(stage: str, model_version: str = None, cache: str = "n/a"):
+    """
+    Mede a duração de uma etapa do cálculo de score. O dicionário entregue ao
+    bloco permite ajustar labels conhecidos só depois (ex: etapa["cache"] = "hit").
+    """
+    labels = {"model_version": model_version or "desconhecido", "cache": cache}
+    inicio = time.perf_counter()
+    try:
+        yield labels
+    finally:
+        SCORE_STAGE_LATENCY.labels(stage=stage, **labels).observe(time.perf_counter() - inicio)
+
+def multiprocess_enabled() -> bool:
+    """
+    O modo multiprocesso do prometheus_client é ativado pela variável de
+    ambiente PROMETHEUS_MULTIPROC_DIR, lida no import da biblioteca
+    """
+    return "PROMETHEUS_MULTIPROC_DIR" in os.environ or "prometheus_multiproc_dir" in os.environ
+
+def metrics_response() -> Response:
+    """
+    Exposição das métricas no formato do Prometheus. Com vários workers, agrega
+    os arquivos de todos os processos em settings.PROMETHEUS_MULTIPROC_DIR.
+    """
+    if multiprocess_enabled():
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry, path=settings.PROMETHEUS_MULTIPROC_DIR)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+
+def mark_process_dead(pid: int = None) -> None:
+    """
+    Remove os arquivos de gauges de um processo encerrado (por padrão, o atual)
+    """
+    if multiprocess_enabled():
+        multiprocess.mark_process_dead(pid or os.getpid(), path=os.environ.get("PROMETHEUS_MULTIPROC_DIR", settings.PROMETHEUS_MULTIPROC_DIR))
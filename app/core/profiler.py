@@ -0,0 +1,157 @@
+from collections import Counter, deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+import os
+import sys
+import threading
+import time
+import uuid
+
+from app.core.config import settings
+
+Stack = Tuple[str, ...]
+
+class SamplingProfiler:
+    """
+    Profiler por amostragem do próprio processo (worker). Uma thread lê a pilha
+    da thread do event loop a cada intervalo e guarda as amostras numa janela
+    circular de PROFILER_RING_SECONDS. A thread só existe enquanto há algum
+    consumidor ativo (modo contínuo, captura sob demanda ou captura de
+    requisições lentas); desligado, o custo é zero.
+    """
+    def __init__(self):
+        self.interval = settings.PROFILER_INTERVAL_MS / 1000
+        self.ring_seconds = settings.PROFILER_RING_SECONDS
+        self.slow_threshold: Optional[float] = None
+        self.slow_profiles: Deque[Dict[str, Any]] = deque(maxlen=settings.PROFILER_MAX_SLOW_PROFILES)
+        self._amostras: Deque[Tuple[float, Stack]] = deque()
+        self._consumidores = set()
+        self._alvo: Optional[int] = None
+        self._thread: Optional[threading.Thread] = None
+        self._parar = threading.Event()  # Um por thread: uma que ainda para não volta a rodar
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def enable(self, consumidor: str) -> None:
+        """
+        Registra um consumidor e inicia a amostragem da thread atual (a do event loop)
+        """
+        with self._lock:
+            self._consumidores.add(consumidor)
+            if self._thread is None:
+                self._alvo = threading.get_ident()
+                self._parar = threading.Event()
+                self._thread = threading.Thread(
+                    target=self._loop, args=(self._parar,), name="sampling-profiler", daemon=True
+                )
+                self._thread.start()
+
+    def disable(self, consumidor: str) -> None:
+        """
+        Remove um consumidor; a thread para quando não resta nenhum. Espera a
+        thread por até um intervalo de amostragem: nas rotas async, chame via
+        asyncio.to_thread para não bloquear o event loop.
+        """
+        with self._lock:
+            self._consumidores.discard(consumidor)
+            if self._consumidores or self._thread is None:
+                return
+            self._parar.set()
+            thread, self._thread = self._thread, None
+        thread.join(timeout=self.interval * 2)
+        self._amostras.clear()
+
+    def _loop(self, parar: threading.Event) -> None:
+        while not parar.wait(self.interval):
+            frame = sys._current_frames().get(self._alvo)
+            if frame is None:
+                continue
+            agora = time.perf_counter()
+            self._amostras.append((agora, _stack(frame)))
+            limite = agora - self.ring_seconds
+            while self._amostras and self._amostras[0][0] < limite:
+                self._amostras.popleft()
+
+    def samples_since(self, inicio: float, fim: float = None) -> List[Stack]:
+        fim = fim or time.perf_counter()
+        return [stack for instante, stack in list(self._amostras) if inicio <= instante <= fim]
+
+    # Captura de requisições lentas
+    def enable_slow_requests(self, threshold_ms: float) -> None:
+        self.slow_threshold = threshold_ms / 1000
+        self.enable("slow_requests")
+
+    def disable_slow_requests(self) -> None:
+        self.slow_threshold = None
+        self.disable("slow_requests")
+
+    def record_request(self, inicio: float, fim: float, metadata: Dict[str, Any]) -> None:
+        """
+        Guarda o perfil de uma requisição acima do limiar, a partir dos
+        instantes de time.perf_counter() de início e fim. Com requisições
+        concorrentes no mesmo loop, o perfil inclui as amostras de todas as que
+        rodaram no intervalo.
+        """
+        if self.slow_threshold is None or fim - inicio < self.slow_threshold:
+            return
+        self.slow_profiles.append({
+            "id": uuid.uuid4().hex,
+            "duration_ms": round((fim - inicio) * 1000, 2),
+            "timestamp": time.time(),
+            "samples": self.samples_since(inicio, fim),
+            **metadata
+        })
+
+    # Formatos de saída
+    def to_collapsed(self, amostras: List[Stack]) -> str:
+        """
+        Formato de pilhas colapsadas (flamegraph.pl, speedscope, inferno)
+        """
+        contagem = Counter(amostras)
+        return "\n".join(f"{';'.join(stack)} {n}" for stack, n in contagem.most_common())
+
+    def to_speedscope(self, amostras: List[Stack], nome: str = "score_engine") -> Dict[str, Any]:
+        """
+        Formato de arquivo do speedscope (perfil amostrado)
+        """
+        indices: Dict[str, int] = {}
+        frames = []
+        samples = []
+        for stack in amostras:
+            linha = []
+            for quadro in stack:
+                if quadro not in indices:
+                    indices[quadro] = len(frames)
+                    frames.append({"name": quadro})
+                linha.append(indices[quadro])
+            samples.append(linha)
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "shared": {"frames": frames},
+            "profiles": [{
+                "type": "sampled",
+                "name": nome,
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": len(samples) * self.interval,
+                "samples": samples,
+                "weights": [self.interval] * len(samples)
+            }],
+            "exporter": "score_engine.sampling_profiler"
+        }
+
+def _stack(frame) -> Stack:
+    """
+    Pilha da raiz até o frame atual
+    """
+    quadros = []
+    while frame is not None:
+        code = frame.f_code
+        quadros.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return tuple(reversed(quadros))
+
+# Um profiler por processo (worker)
+profiler = SamplingProfiler()
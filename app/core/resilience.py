@@ -0,0 +1,150 @@
+from contextlib import contextmanager
+from contextvars import ContextVar, Token
+from typing import Optional, Tuple, Type
+import threading
+import time
+
+from prometheus_client import Counter, Gauge
+
+from app.core.config import settings
+
+CIRCUIT_STATE = Gauge(
+    'circuit_breaker_state',
+    'Estado do circuit breaker de cada dependência (0 fechado, 1 meio-aberto, 2 aberto)',
+    ['dependency'],
+    multiprocess_mode='livemax'
+)
+
+CIRCUIT_EVENTS = Counter(
+    'circuit_breaker_events_total',
+    'Chamadas às dependências vistas pelos circuit breakers',
+    ['dependency', 'result']  # success, failure, rejected, deadline
+)
+
+FECHADO, MEIO_ABERTO, ABERTO = 0, 1, 2
+
+class CircuitOpenError(Exception):
+    """
+    Dependência marcada como indisponível: a chamada nem é tentada
+    """
+
+class DeadlineExceeded(Exception):
+    """
+    O orçamento de tempo da requisição acabou antes da chamada à dependência
+    """
+
+# Instante (time.monotonic) em que a requisição atual deixa de valer a pena.
+# Definido por requisição no ObservabilityMiddleware; None fora de requisições.
+_deadline: ContextVar[Optional[float]] = ContextVar("deadline", default=None)
+
+def start_deadline(segundos: Optional[float]) -> Token:
+    """
+    Define o orçamento da requisição atual (None remove o deadline, ex: para
+    rotas de streaming de longa duração)
+    """
+    return _deadline.set(None if segundos is None else time.monotonic() + segundos)
+
+def reset_deadline(token: Token) -> None:
+    _deadline.reset(token)
+
+def remaining() -> Optional[float]:
+    """
+    Segundos restantes do orçamento da requisição (None sem deadline)
+    """
+    prazo = _deadline.get()
+    return None if prazo is None else prazo - time.monotonic()
+
+def timeout_for(limite: float) -> float:
+    """
+    Timeout de uma chamada: o limite da dependência, reduzido ao que resta do
+    orçamento da requisição
+    """
+    restante = remaining()
+    return limite if restante is None else max(min(limite, restante), 0.001)
+
+class CircuitBreaker:
+    """
+    Circuit breaker por dependência: após failure_threshold falhas seguidas o
+    circuito abre e as chamadas falham na hora (CircuitOpenError) por
+    reset_timeout segundos; depois, uma única chamada de teste (meio-aberto)
+    decide se ele fecha ou volta a abrir. Só as exceções em falhas contam
+    como indisponibilidade; erros de aplicação passam direto.
+    """
+    def __init__(
+        self,
+        nome: str,
+        falhas: Tuple[Type[BaseException], ...] = (Exception,),
+        failure_threshold: int = None,
+        reset_timeout: float = None
+    ):
+        self.nome = nome
+        self.falhas = falhas
+        self.failure_threshold = failure_threshold or settings.CIRCUIT_FAILURE_THRESHOLD
+        self.reset_timeout = reset_timeout or settings.CIRCUIT_RESET_TIMEOUT_SECONDS
+        self.estado = FECHADO
+        self._falhas_seguidas = 0
+        self._aberto_em = 0.0
+        self._teste_em_andamento = False
+        self._lock = threading.Lock()
+        CIRCUIT_STATE.labels(dependency=nome).set(FECHADO)
+
+    def _mudar(self, estado: int) -> None:
+        self.estado = estado
+        CIRCUIT_STATE.labels(dependency=self.nome).set(estado)
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.estado == FECHADO:
+                return True
+            if self.estado == ABERTO and time.monotonic() - self._aberto_em >= self.reset_timeout:
+                self._mudar(MEIO_ABERTO)
+            if self.estado == MEIO_ABERTO and not self._teste_em_andamento:
+                self._teste_em_andamento = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._falhas_seguidas = 0
+            self._teste_em_andamento = False
+            if self.estado != FECHADO:
+                self._mudar(FECHADO)
+        CIRCUIT_EVENTS.labels(dependency=self.nome, result="success").inc()
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._falhas_seguidas += 1
+            self._teste_em_andamento = False
+            if self.estado == MEIO_ABERTO or self._falhas_seguidas >= self.failure_threshold:
+                self._aberto_em = time.monotonic()
+                self._mudar(ABERTO)
+        CIRCUIT_EVENTS.labels(dependency=self.nome, result="failure").inc()
+
+    @contextmanager
+    def guard(self):
+        """
+        Protege uma chamada à dependência: falha na hora com o circuito aberto
+        ou sem orçamento restante, e registra o resultado
+        """
+        restante = remaining()
+        if restante is not None and restante <= 0:
+            CIRCUIT_EVENTS.labels(dependency=self.nome, result="deadline").inc()
+            raise DeadlineExceeded(f"Sem orçamento de tempo para chamar {self.nome}")
+        if not self.allow():
+            CIRCUIT_EVENTS.labels(dependency=self.nome, result="rejected").inc()
+            raise CircuitOpenError(f"Circuito aberto para {self.nome}")
+        try:
+            yield
+        except DeadlineExceeded:
+            # Falta de orçamento não diz nada sobre a saúde da dependência
+            with self._lock:
+                self._teste_em_andamento = False
+            raise
+        except self.falhas:
+            self.record_failure()
+            raise
+        except BaseException:
+            # Erro de aplicação: a dependência respondeu
+            self.record_success()
+            raise
+        self.record_success()
@@ -1,15 +1,97 @@
+from collections import OrderedDict
 from datetime import datetime, timedelta
-from typing import Optional, Dict
+from typing import Optional, Dict, Tuple
+import hashlib
+import time
 from jose import JWTError, jwt
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from passlib.context import CryptContext
+from prometheus_client import Counter
 
 from app.core.config import settings
+from app.core.logger import setup_logger
+
+try:
+    import jwt as pyjwt
+except ImportError:  # PyJWT é opcional (JWT_BACKEND=pyjwt)
+    pyjwt = None
+
+logger = setup_logger('security')
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+AUTH_VERIFICATIONS = Counter(
+    'auth_token_verifications_total',
+    'Verificações de token por resultado',
+    ['result']  # cache_hit, verified, service, invalid
+)
+
+class TokenCache:
+    """
+    Cache LRU limitado de tokens já verificados, indexado pelo digest do token.
+    Cada entrada vale até o exp do token (ou no máximo max_ttl segundos), então
+    um token expirado nunca é aceito a partir do cache.
+    """
+    def __init__(self, max_size: int, max_ttl: float):
+        self.max_size = max_size
+        self.max_ttl = max_ttl
+        self._entradas: "OrderedDict[bytes, Tuple[float, Dict]]" = OrderedDict()
+
+    def get(self, digest: bytes) -> Optional[Dict]:
+        entrada = self._entradas.get(digest)
+        if entrada is None:
+            return None
+        valido_ate, usuario = entrada
+        if valido_ate <= time.time():
+            del self._entradas[digest]
+            return None
+        self._entradas.move_to_end(digest)
+        return usuario
+
+    def set(self, digest: bytes, usuario: Dict, exp: Optional[float]) -> None:
+        if self.max_size <= 0:
+            return
+        valido_ate = time.time() + self.max_ttl
+        if exp is not None:
+            valido_ate = min(valido_ate, float(exp))
+        self._entradas[digest] = (valido_ate, usuario)
+        self._entradas.move_to_end(digest)
+        while len(self._entradas) > self.max_size:
+            self._entradas.popitem(last=False)
+
+    def clear(self) -> None:
+        self._entradas.clear()
+
+token_cache = TokenCache(settings.AUTH_TOKEN_CACHE_SIZE, settings.AUTH_TOKEN_CACHE_MAX_TTL_SECONDS)
+
+def _service_tokens() -> Dict[bytes, Dict]:
+    """
+    Tokens de serviços internos (modo de confiança mútua): sha256 do token ->
+    claims pré-validadas. Dispensa a verificação da assinatura.
+    """
+    return {
+        bytes.fromhex(digest): {"user_id": f"service:{servico}", "roles": ["service"]}
+        for servico, digest in settings.INTERNAL_SERVICE_TOKENS.items()
+    }
+
+service_tokens = _service_tokens()
+
+def _decode_token(token: str) -> Dict:
+    """
+    Verifica assinatura e exp com o backend configurado em JWT_BACKEND
+    """
+    if settings.JWT_BACKEND == "pyjwt" and pyjwt is not None:
+        try:
+            return pyjwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+        except pyjwt.PyJWTError as e:
+            raise JWTError(str(e))
+    return jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+
+if settings.JWT_BACKEND == "pyjwt" and pyjwt is None:
+    logger.warning("JWT_BACKEND=pyjwt, mas o PyJWT não está instalado; usando python-jose")
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
@@ -32,11 +114,39 @@ async def get_current_user(token: str = Depends(oauth2_scheme)) -> Dict:
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    digest = hashlib.sha256(token.encode()).digest()
+
+    servico = service_tokens.get(digest)
+    if servico is not None:
+        AUTH_VERIFICATIONS.labels(result="service").inc()
+        return dict(servico)
+
+    usuario = token_cache.get(digest)
+    if usuario is not None:
+        AUTH_VERIFICATIONS.labels(result="cache_hit").inc()
+        return dict(usuario)
+
     try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+        payload = _decode_token(token)
         user_id: str = payload.get("sub")
         if user_id is None:
             raise credentials_exception
-        return {"user_id": user_id}
     except JWTError:
-        raise credentials_exception 
\ No newline at end of file
+        AUTH_VERIFICATIONS.labels(result="invalid").inc()
+        raise credentials_exception
+
+    usuario = {"user_id": user_id, "roles": payload.get("roles", [])}
+    token_cache.set(digest, usuario, payload.get("exp"))
+    AUTH_VERIFICATIONS.labels(result="verified").inc()
+    return dict(usuario)
+
+async def get_admin_user(current_user: Dict = Depends(get_current_user)) -> Dict:
+    """
+    Exige o papel "admin" na claim roles do token
+    """
+    if "admin" not in current_user["roles"]:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin role required"
+        )
+    return current_user
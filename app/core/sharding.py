@@ -0,0 +1,299 @@
+from bisect import bisect
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Optional
+from urllib.parse import urlparse
+import hashlib
+import json
+
+import redis
+
+from app.core.config import settings
+
+# Lista de nós gravada em cada nó no modo redis (chave local, fora do anel)
+TOPOLOGY_KEY = "redis_topology"
+
+class TopologyError(RuntimeError):
+    """
+    Mudança na lista de nós que deixaria para trás o estado vivo dos usuários
+    que mudam de nó
+    """
+
+def hash_tag(chave: str) -> str:
+    """
+    Parte da chave usada na distribuição: o conteúdo do primeiro {...} não
+    vazio (mesma regra das hash tags do Redis Cluster) ou a chave inteira.
+    Chaves com a mesma tag ficam sempre no mesmo nó.
+    """
+    inicio = chave.find("{")
+    if inicio >= 0:
+        fim = chave.find("}", inicio + 1)
+        if fim > inicio + 1:
+            return chave[inicio + 1:fim]
+    return chave
+
+def _hash(valor: str) -> int:
+    return int.from_bytes(hashlib.md5(valor.encode()).digest()[:8], "big")
+
+class HashRing:
+    """
+    Anel de hash consistente com nós virtuais: cada nó ocupa vnodes pontos do
+    anel e uma chave pertence ao primeiro ponto depois do seu hash. Ao incluir
+    ou remover um nó, só as chaves dos trechos dele mudam de lugar (~1/N).
+    """
+    def __init__(self, nodes: Iterable[str] = (), vnodes: int = None):
+        self.vnodes = vnodes or settings.REDIS_SHARD_VNODES
+        self._pontos: List[int] = []
+        self._donos: List[str] = []
+        for no in nodes:
+            self.add_node(no)
+
+    @property
+    def nodes(self) -> List[str]:
+        return sorted(set(self._donos))
+
+    def add_node(self, no: str) -> None:
+        for i in range(self.vnodes):
+            ponto = _hash(f"{no}#{i}")
+            posicao = bisect(self._pontos, ponto)
+            self._pontos.insert(posicao, ponto)
+            self._donos.insert(posicao, no)
+
+    def remove_node(self, no: str) -> None:
+        restantes = [(p, d) for p, d in zip(self._pontos, self._donos) if d != no]
+        self._pontos = [p for p, _ in restantes]
+        self._donos = [d for _, d in restantes]
+
+    def node_for(self, chave: str) -> str:
+        if not self._pontos:
+            raise ValueError("Anel de hash sem nós")
+        posicao = bisect(self._pontos, _hash(hash_tag(chave))) % len(self._pontos)
+        return self._donos[posicao]
+
+def node_name(url: str) -> str:
+    """
+    Nome estável de um nó no anel (host:porta/db, sem credenciais), para que
+    trocar a senha não redistribua as chaves
+    """
+    partes = urlparse(url)
+    return f"{partes.hostname}:{partes.port or 6379}{partes.path or '/0'}"
+
+class ShardedPipeline:
+    """
+    Pipeline sobre vários nós: cada comando vai para o pipeline do nó da sua
+    primeira chave e execute() roda os pipelines dos nós em paralelo,
+    devolvendo as respostas na ordem em que os comandos foram enfileirados.
+    Com transaction=True todos os comandos precisam cair no mesmo nó (como o
+    CROSSSLOT do Redis Cluster).
+    """
+    def __init__(self, sharded: "ShardedRedis", transaction: bool = True):
+        self._sharded = sharded
+        self._transaction = transaction
+        self._pipes: Dict[str, "redis.client.Pipeline"] = {}
+        self._ordem: List[str] = []
+        self._no_atual: Optional[str] = None
+
+    def _route(self, chave) -> "redis.client.Pipeline":
+        chave = chave.decode() if isinstance(chave, bytes) else chave
+        if chave in self._sharded.local_keys:
+            # Chave local: acompanha o nó do comando anterior
+            if self._no_atual is None:
+                raise ValueError(f"Chave local {chave} sem comando anterior que defina o nó")
+            no = self._no_atual
+        else:
+            no = self._sharded.ring.node_for(chave)
+        if no not in self._pipes:
+            if self._transaction and self._pipes:
+                raise ValueError(f"Transação com chaves em mais de um nó ({chave})")
+            self._pipes[no] = self._sharded.clients[no].pipeline(transaction=self._transaction)
+        self._no_atual = no
+        self._ordem.append(no)
+        return self._pipes[no]
+
+    def __getattr__(self, nome):
+        def comando(chave, *args, **kwargs):
+            getattr(self._route(chave), nome)(chave, *args, **kwargs)
+            return self
+        return comando
+
+    def __len__(self) -> int:
+        return len(self._ordem)
+
+    def execute(self) -> List:
+        nos = list(self._pipes)
+        if len(nos) > 1:
+            respostas = dict(zip(nos, self._sharded._executor.map(lambda no: self._pipes[no].execute(), nos)))
+        else:
+            respostas = {no: self._pipes[no].execute() for no in nos}
+        iteradores = {no: iter(r) for no, r in respostas.items()}
+        resultado = [next(iteradores[no]) for no in self._ordem]
+        self.reset()
+        return resultado
+
+    def reset(self) -> None:
+        for pipe in self._pipes.values():
+            pipe.reset()
+        self._pipes = {}
+        self._ordem = []
+        self._no_atual = None
+
+class ShardedScript:
+    """
+    Script Lua registrado em todos os nós; cada chamada roda no nó de KEYS[1]
+    (as demais chaves precisam da mesma hash tag)
+    """
+    def __init__(self, sharded: "ShardedRedis", script: str):
+        self._sharded = sharded
+        self._script = script
+        self._scripts = {}
+
+    def _no(self, no: str):
+        # Registrado sob demanda, inclusive em nós incluídos depois
+        if no not in self._scripts:
+            self._scripts[no] = self._sharded.clients[no].register_script(self._script)
+        return self._scripts[no]
+
+    def __call__(self, keys=[], args=[], client=None):
+        if isinstance(client, ShardedPipeline):
+            pipe = client._route(keys[0])
+            return self._no(client._no_atual)(keys=keys, args=args, client=pipe)
+        return self._no(self._sharded.ring.node_for(keys[0]))(keys=keys, args=args, client=client)
+
+class ShardedRedis:
+    """
+    Cliente com a interface do redis-py que distribui as chaves entre vários
+    nós Redis por hash consistente. Comandos, pipelines e scripts são roteados
+    pela primeira chave; chaves de um mesmo usuário compartilham a hash tag
+    ({user_id}) e ficam no mesmo nó, então scripts e transações por usuário
+    continuam atômicos.
+
+    local_keys são chaves que existem uma vez em cada nó (ex: o conjunto de
+    usuários sujos): em pipelines seguem o nó do comando anterior e fora deles
+    são acessadas nó a nó, via shards().
+    """
+    def __init__(self, clients: Dict[str, redis.Redis], local_keys: Iterable[str] = (), vnodes: int = None):
+        self.clients = dict(clients)
+        self.ring = HashRing(self.clients, vnodes)
+        self.local_keys = frozenset(local_keys)
+        self._executor = ThreadPoolExecutor(max_workers=len(self.clients), thread_name_prefix="redis-shard")
+
+    @classmethod
+    def from_urls(cls, urls: List[str], local_keys: Iterable[str] = (), vnodes: int = None, **kwargs) -> "ShardedRedis":
+        return cls({node_name(url): redis.from_url(url, **kwargs) for url in urls}, local_keys, vnodes)
+
+    def client_for(self, chave) -> redis.Redis:
+        chave = chave.decode() if isinstance(chave, bytes) else chave
+        if chave in self.local_keys:
+            raise ValueError(f"Chave local {chave}: acesse cada nó via shards()")
+        return self.clients[self.ring.node_for(chave)]
+
+    def __getattr__(self, nome):
+        def comando(chave, *args, **kwargs):
+            return getattr(self.client_for(chave), nome)(chave, *args, **kwargs)
+        return comando
+
+    def pipeline(self, transaction: bool = True) -> ShardedPipeline:
+        return ShardedPipeline(self, transaction)
+
+    def register_script(self, script: str) -> ShardedScript:
+        return ShardedScript(self, script)
+
+    def scan_iter(self, match: str = None, count: int = None, **kwargs) -> Iterator:
+        for cliente in self.clients.values():
+            yield from cliente.scan_iter(match=match, count=count, **kwargs)
+
+    def add_node(self, nome: str, cliente: redis.Redis) -> None:
+        """
+        Inclui um nó: as chaves dos trechos que ele assume passam a ser misses
+        e são reconstruídas a partir do PostgreSQL na próxima leitura. Recusado
+        com a topologia registrada (modo redis), em que o Redis tem o estado
+        vivo: use rebalance() com as escritas paradas.
+        """
+        if any(c.exists(TOPOLOGY_KEY) for c in self.clients.values()):
+            raise TopologyError("Topologia registrada (FEATURE_STORE_MODE=redis): mova as chaves com rebalance()")
+        self.clients[nome] = cliente
+        self.ring.add_node(nome)
+        self._executor.shutdown(wait=False)
+        self._executor = ThreadPoolExecutor(max_workers=len(self.clients), thread_name_prefix="redis-shard")
+
+def shards(cliente) -> List:
+    """
+    Clientes de cada nó (o próprio cliente quando não há sharding)
+    """
+    return list(cliente.clients.values()) if isinstance(cliente, ShardedRedis) else [cliente]
+
+def clients_by_name(cliente) -> Dict[str, redis.Redis]:
+    """
+    Clientes de cada nó pelo nome no anel (um nó só: o de REDIS_URL)
+    """
+    if isinstance(cliente, ShardedRedis):
+        return dict(cliente.clients)
+    return {node_name((settings.REDIS_NODES or [settings.REDIS_URL])[0]): cliente}
+
+def check_topology(cliente) -> None:
+    """
+    Registra a lista de nós em cada nó ou levanta TopologyError se algum
+    deles tem outra registrada: mudar REDIS_NODES com o estado vivo no Redis
+    exige rebalance() antes (python -m app.workers.feature_snapshotter
+    --rebalance '<nova REDIS_NODES>')
+    """
+    clientes = clients_by_name(cliente)
+    atual = json.dumps(sorted(clientes))
+    for nome, no in clientes.items():
+        registrada = no.get(TOPOLOGY_KEY)
+        if registrada is not None and registrada.decode() != atual:
+            raise TopologyError(
+                f"O nó {nome} registrou os nós {registrada.decode()}, mas REDIS_NODES tem {atual}: "
+                "rode o rebalance com a lista antiga antes de trocar a configuração"
+            )
+    for no in clientes.values():
+        no.set(TOPOLOGY_KEY, atual)
+
+def rebalance(cliente, novo: ShardedRedis, lote: int = 500) -> int:
+    """
+    Move para o nó dono na nova topologia as chaves que mudam de nó (DUMP e
+    RESTORE com o TTL restante), registra a nova lista de nós e retorna
+    quantas chaves foram movidas. As escritas precisam estar paradas e os
+    conjuntos locais (usuários sujos), vazios.
+    """
+    movidas = 0
+    locais = set(novo.local_keys) | {TOPOLOGY_KEY}
+    for nome, origem in clients_by_name(cliente).items():
+        chaves = [
+            c for c in origem.scan_iter(count=lote)
+            if (c.decode() if isinstance(c, bytes) else c) not in locais
+        ]
+        for inicio in range(0, len(chaves), lote):
+            pedaco = [
+                c for c in chaves[inicio:inicio + lote]
+                if novo.ring.node_for(c.decode() if isinstance(c, bytes) else c) != nome
+            ]
+            if not pedaco:
+                continue
+            pipe = origem.pipeline(transaction=False)
+            for chave in pedaco:
+                pipe.dump(chave)
+                pipe.pttl(chave)
+            respostas = pipe.execute()
+            destino = novo.pipeline(transaction=False)
+            for i, chave in enumerate(pedaco):
+                valor, ttl = respostas[2 * i], respostas[2 * i + 1]
+                if valor is None:
+                    continue
+                destino.restore(chave, max(ttl, 0), valor, replace=True)
+            destino.execute()
+            origem.delete(*pedaco)
+            movidas += len(pedaco)
+    atual = json.dumps(sorted(novo.clients))
+    for no in novo.clients.values():
+        no.set(TOPOLOGY_KEY, atual)
+    return movidas
+
+def redis_from_settings(local_keys: Iterable[str] = (), **kwargs):
+    """
+    Cliente do cache de features: um redis.Redis comum com um único nó
+    (REDIS_NODES vazio usa REDIS_URL) ou ShardedRedis com vários
+    """
+    urls = settings.REDIS_NODES or [settings.REDIS_URL]
+    if len(urls) == 1:
+        return redis.from_url(urls[0], **kwargs)
+    return ShardedRedis.from_urls(urls, local_keys, **kwargs)
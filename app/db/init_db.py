@@ -1,12 +1,14 @@
 from sqlalchemy.orm import Session
 
 from app.db.base_class import Base
-from app.db.session import engine
+from app.db.session import batch_engine
 from app.core.config import settings
+# Registra os modelos no metadata antes do create_all
+from app.models import score, score_contest, user_feature, user_feature_columns  # noqa: F401
 
 def init_db() -> None:
     # Cria todas as tabelas
-    Base.metadata.create_all(bind=engine)
+    Base.metadata.create_all(bind=batch_engine)
 
 if __name__ == "__main__":
     print("Criando tabelas do banco de dados...")
@@ -0,0 +1,251 @@
+from collections import OrderedDict, deque
+from typing import Callable, Iterable, List, Optional, TypeVar
+import math
+import os
+import random
+import threading
+import time
+
+from prometheus_client import Counter, Gauge
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.logger import setup_logger
+from app.core.resilience import ABERTO, CircuitBreaker, CircuitOpenError, DeadlineExceeded
+from app.db.session import SessionLocal, engine, create_db_engine, postgres_breaker, POSTGRES_FALHAS
+
+logger = setup_logger('db_routing')
+
+T = TypeVar("T")
+
+READ_ROUTING = Counter(
+    'db_read_routing_total',
+    'Leituras do banco por destino',
+    ['target', 'reason']  # replica, primary / replica, no_replicas, primary_requested, not_fresh, replica_error
+)
+
+REPLICA_LAG = Gauge(
+    'db_replica_lag_seconds',
+    'Atraso de replicação de cada réplica na última medição',
+    ['replica'],
+    multiprocess_mode='livemax'
+)
+
+# Em uma réplica: último LSN aplicado e idade da última transação aplicada
+REPLICA_STATUS_SQL = """
+SELECT pg_last_wal_replay_lsn()::text,
+       EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+"""
+
+def parse_lsn(valor: str) -> int:
+    """
+    Converte um pg_lsn ("16/B374D848") em inteiro comparável
+    """
+    alto, baixo = valor.split("/")
+    return (int(alto, 16) << 32) | int(baixo, 16)
+
+class Replica:
+    """
+    Réplica de leitura com o estado da última medição: LSN aplicado e atraso
+    em segundos (inf se desconhecido ou inacessível)
+    """
+    def __init__(self, nome: str, engine):
+        self.nome = nome
+        self.engine = engine
+        self.breaker = CircuitBreaker(f"postgres_replica_{nome}", falhas=POSTGRES_FALHAS)
+        self.lsn = 0
+        self.lag = math.inf
+
+class ReadRouter:
+    """
+    Roteia leituras entre o primário e as réplicas. Escritas continuam no
+    primário (get_db); leituras passam por run(), que escolhe ao acaso uma
+    réplica com atraso de até max_lag e cai para o primário quando nenhuma
+    serve ou a réplica escolhida falha. O atraso é medido por uma thread em
+    background a cada check_interval; run() só lê o último estado medido.
+
+    Read-your-writes sem consulta extra ao primário: mark_write() guarda, por
+    usuário, o instante (time.time) da escrita já commitada. Cada medição lê o
+    LSN do primário depois de começar, então esse LSN cobre as escritas
+    commitadas antes do início dela. Leituras com o usuário em user_ids (ou com
+    escrita_em) só vão para réplicas que aplicaram o LSN da primeira medição
+    iniciada depois da escrita (mais a folga de relógio entre processos), até
+    sticky_seconds depois dela; antes dessa medição, vão para o primário.
+    """
+    def __init__(
+        self,
+        primary,
+        replicas: List[Replica],
+        max_lag: float = None,
+        check_interval: float = None,
+        sticky_seconds: float = None,
+        max_clock_skew: float = None,
+        max_sticky_users: int = 100000
+    ):
+        self.primary = primary
+        self.replicas = replicas
+        self.max_lag = settings.DATABASE_REPLICA_MAX_LAG_SECONDS if max_lag is None else max_lag
+        self.check_interval = check_interval or settings.DATABASE_REPLICA_CHECK_SECONDS
+        self.sticky_seconds = sticky_seconds or settings.DATABASE_READ_YOUR_WRITES_SECONDS
+        self.max_clock_skew = settings.DATABASE_REPLICA_CLOCK_SKEW_SECONDS if max_clock_skew is None else max_clock_skew
+        self.max_sticky_users = max_sticky_users
+        self._escritas: "OrderedDict[str, tuple]" = OrderedDict()  # user_id -> (instante, válido até)
+        # (início da medição, LSN do primário lido nela), da mais antiga para a mais nova
+        self._medicoes: deque = deque(maxlen=int(self.sticky_seconds / self.check_interval) + 2)
+        self._lock = threading.Lock()
+        self._medidor_pid = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.replicas)
+
+    def _lsn_atual(self) -> int:
+        with self.primary.connect() as conn:
+            return parse_lsn(conn.exec_driver_sql("SELECT pg_current_wal_lsn()::text").scalar())
+
+    def start(self) -> None:
+        """
+        Inicia a thread de medição deste processo (uma vez por pid: threads não
+        sobrevivem ao fork dos workers)
+        """
+        if not self.replicas or self._medidor_pid == os.getpid():
+            return
+        with self._lock:
+            if self._medidor_pid == os.getpid():
+                return
+            self._medidor_pid = os.getpid()
+        threading.Thread(target=self._medir_em_loop, name="replica_lag", daemon=True).start()
+
+    def _medir_em_loop(self) -> None:
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"Erro ao medir o atraso das réplicas: {str(e)}")
+            time.sleep(self.check_interval)
+
+    def mark_write(self, user_ids: Iterable[str]) -> Optional[float]:
+        """
+        Registra escritas já commitadas dos usuários e retorna o instante delas
+        (None sem réplicas), para compartilhar com outros processos
+        """
+        if not self.replicas:
+            return None
+        instante = time.time()
+        validade = time.monotonic() + self.sticky_seconds
+        with self._lock:
+            for user_id in user_ids:
+                self._escritas[user_id] = (instante, validade)
+                self._escritas.move_to_end(user_id)
+            while len(self._escritas) > self.max_sticky_users:
+                self._escritas.popitem(last=False)
+        return instante
+
+    def _lsn_minimo(self, user_ids: Iterable[str], escrita_em: float) -> Optional[int]:
+        """
+        LSN que a réplica precisa ter aplicado para a leitura (0 sem escritas
+        recentes; None se nenhuma medição cobre ainda a última escrita)
+        """
+        agora = time.monotonic()
+        ultima = escrita_em
+        with self._lock:
+            for user_id in user_ids:
+                escrita = self._escritas.get(user_id)
+                if escrita and escrita[1] > agora:
+                    ultima = max(ultima, escrita[0])
+            medicoes = list(self._medicoes)
+        if not ultima:
+            return 0
+        for inicio, lsn in medicoes:
+            if inicio > ultima + self.max_clock_skew:
+                return lsn
+        return None
+
+    def refresh(self) -> None:
+        """
+        Mede o LSN do primário e o atraso das réplicas. Uma réplica que alcançou
+        o LSN atual do primário tem atraso zero, mesmo sem transações recentes
+        para aplicar.
+        """
+        inicio = time.time()
+        try:
+            lsn_primario = self._lsn_atual()
+        except POSTGRES_FALHAS:
+            lsn_primario = None
+        for replica in self.replicas:
+            try:
+                with replica.breaker.guard(), replica.engine.connect() as conn:
+                    aplicado, idade = conn.exec_driver_sql(REPLICA_STATUS_SQL).one()
+                replica.lsn = parse_lsn(aplicado) if aplicado else 0
+                if lsn_primario is not None and replica.lsn >= lsn_primario:
+                    replica.lag = 0.0
+                else:
+                    replica.lag = math.inf if idade is None else float(idade)
+            except (CircuitOpenError, DeadlineExceeded, *POSTGRES_FALHAS):
+                replica.lag = math.inf
+            REPLICA_LAG.labels(replica=replica.nome).set(replica.lag)
+        if lsn_primario is not None:
+            with self._lock:
+                self._medicoes.append((inicio, lsn_primario))
+
+    def _escolher(self, minimo: Optional[int]) -> Optional[Replica]:
+        if minimo is None:
+            return None
+        candidatas = [
+            r for r in self.replicas
+            if r.lag <= self.max_lag and r.lsn >= minimo and r.breaker.estado != ABERTO
+        ]
+        return random.choice(candidatas) if candidatas else None
+
+    def _executar(self, engine, consulta: Callable[[Session], T]) -> T:
+        # Sem engine, a sessão usa o bind do SessionLocal (o primário)
+        db = SessionLocal() if engine is None else SessionLocal(bind=engine)
+        try:
+            return consulta(db)
+        finally:
+            db.close()
+
+    def run(
+        self,
+        consulta: Callable[[Session], T],
+        user_ids: Iterable[str] = (),
+        escrita_em: float = 0.0,
+        primary: bool = False
+    ) -> T:
+        """
+        Executa consulta(db) em uma sessão de leitura e retorna o resultado.
+        user_ids ativa o read-your-writes dos usuários lidos; escrita_em é o
+        instante da última escrita conhecida por outro processo; primary força
+        o primário (ex: quando a leitura não pode estar atrasada).
+        """
+        if not self.replicas or primary:
+            motivo = "primary_requested" if primary else "no_replicas"
+        else:
+            self.start()
+            replica = self._escolher(self._lsn_minimo(user_ids, escrita_em))
+            if replica is None:
+                motivo = "not_fresh"
+            else:
+                try:
+                    with replica.breaker.guard():
+                        resultado = self._executar(replica.engine, consulta)
+                    READ_ROUTING.labels(target="replica", reason="replica").inc()
+                    return resultado
+                except (CircuitOpenError, *POSTGRES_FALHAS) as e:
+                    logger.warning(f"Leitura na réplica {replica.nome} falhou, usando o primário: {str(e)}")
+                    motivo = "replica_error"
+
+        READ_ROUTING.labels(target="primary", reason=motivo).inc()
+        with postgres_breaker.guard():
+            return self._executar(None, consulta)
+
+def _nome_replica(url: str) -> str:
+    # host:porta, sem credenciais nos labels das métricas
+    partes = make_url(url)
+    return f"{partes.host}:{partes.port or 5432}"
+
+read_router = ReadRouter(
+    engine,
+    [Replica(_nome_replica(url), create_db_engine(url)) for url in settings.DATABASE_REPLICA_URLS]
+)
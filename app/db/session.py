@@ -1,15 +1,53 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import OperationalError, TimeoutError as PoolTimeoutError
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 
 from app.core.config import settings
+from app.core.resilience import CircuitBreaker, remaining, timeout_for
 
-engine = create_engine(settings.DATABASE_URL)
+def create_db_engine(url: str):
+    """
+    Engine da API (primário e réplicas) com os timeouts de conexão e de pool.
+    O statement_timeout fica com o padrão do servidor: só as transações de uma
+    requisição com deadline o reduzem (SET LOCAL em after_begin).
+    """
+    return create_engine(
+        url,
+        pool_timeout=settings.POSTGRES_POOL_TIMEOUT_SECONDS,
+        connect_args={"connect_timeout": settings.POSTGRES_CONNECT_TIMEOUT_SECONDS}
+    )
+
+engine = create_db_engine(settings.DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Jobs em lote (treino, rescore, backfill, init_db, snapshotter): consultas
+# longas e sem deadline, com a espera padrão do pool
+batch_engine = create_engine(
+    settings.DATABASE_URL,
+    connect_args={"connect_timeout": settings.POSTGRES_CONNECT_TIMEOUT_SECONDS}
+)
+BatchSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=batch_engine)
+
+# Falhas que indicam PostgreSQL indisponível ou lento (conexão, statement
+# cancelado pelo timeout, pool esgotado)
+POSTGRES_FALHAS = (OperationalError, PoolTimeoutError)
+postgres_breaker = CircuitBreaker("postgres", falhas=POSTGRES_FALHAS)
+
+@event.listens_for(SessionLocal, "after_begin")
+def _statement_timeout_da_requisicao(session, transaction, conn):
+    """
+    Dentro de uma requisição, o statement_timeout da transação é reduzido ao
+    orçamento que resta
+    """
+    if remaining() is None:
+        return
+    limite = timeout_for(settings.POSTGRES_STATEMENT_TIMEOUT_MS / 1000)
+    conn.exec_driver_sql(f"SET LOCAL statement_timeout = {max(int(limite * 1000), 1)}")
+
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close() 
\ No newline at end of file
+        db.close()
@@ -1,12 +1,16 @@
 from fastapi import FastAPI, HTTPException, Depends
 from fastapi.middleware.cors import CORSMiddleware
 from prometheus_client import Counter, Histogram
+import asyncio
 import time
 from typing import Dict, Any
 
 from app.core.config import settings
-from app.api.v1.endpoints import scores, features, models
-from app.core.middleware import PrometheusMiddleware, TraceIDMiddleware
+from app.api.v1.endpoints import scores, features, models, profiler as profiler_endpoints
+from app.core.middleware import ObservabilityMiddleware
+from app.core.metrics import metrics_response, mark_process_dead
+from app.core.profiler import profiler
+from app.ml.drift import drift_monitor
 
 app = FastAPI(
     title="Score Engine N7",
@@ -23,16 +27,14 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Middleware do Prometheus
-app.add_middleware(PrometheusMiddleware)
-
-# Middleware do TraceID
-app.add_middleware(TraceIDMiddleware)
+# Métricas do Prometheus e TraceID (ASGI puro, uma única camada)
+app.add_middleware(ObservabilityMiddleware)
 
 # Rotas da API
 app.include_router(scores.router, prefix="/api/v1/scores", tags=["scores"])
 app.include_router(features.router, prefix="/api/v1/features", tags=["features"])
 app.include_router(models.router, prefix="/api/v1/models", tags=["models"])
+app.include_router(profiler_endpoints.router, prefix="/api/v1/admin/profiler", tags=["admin"])
 
 @app.get("/health")
 async def health_check() -> Dict[str, Any]:
@@ -45,6 +47,25 @@ async def health_check() -> Dict[str, Any]:
         "environment": settings.ENVIRONMENT
     }
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """
+    Endpoint de métricas para o Prometheus (agrega todos os workers)
+    """
+    return metrics_response()
+
+@app.on_event("startup")
+async def startup():
+    # Executa na thread do event loop, que é a amostrada pelo profiler
+    if settings.PROFILER_ENABLED and settings.PROFILER_SLOW_REQUEST_MS > 0:
+        profiler.enable_slow_requests(settings.PROFILER_SLOW_REQUEST_MS)
+    if drift_monitor.enabled:
+        app.state.drift_task = asyncio.create_task(drift_monitor.run())
+
+@app.on_event("shutdown")
+async def shutdown():
+    mark_process_dead()
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(
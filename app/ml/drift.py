@@ -0,0 +1,345 @@
+from collections import deque
+from typing import Dict, Any, Iterable, List, Optional, Tuple
+import asyncio
+import json
+import math
+import os
+import socket
+import time
+
+import numpy as np
+import redis
+from prometheus_client import Gauge
+
+from app.core.config import settings
+from app.core.logger import setup_logger
+
+logger = setup_logger('drift')
+
+# Coluna do score nos perfis, ao lado das features
+SCORE = "score"
+# O score vai de 0 a 100: bins fixos, iguais para qualquer modelo
+SCORE_EDGES = np.linspace(0, 100, 21)[1:-1]
+
+DRIFT_PSI = Gauge(
+    'model_drift_psi',
+    'Population Stability Index da janela atual contra a referência do treino',
+    ['model_version', 'feature'],
+    multiprocess_mode='livemax'
+)
+
+DRIFT_KS = Gauge(
+    'model_drift_ks',
+    'Estatística KS (sobre os bins) da janela atual contra a referência do treino',
+    ['model_version', 'feature'],
+    multiprocess_mode='livemax'
+)
+
+DRIFT_MEAN_SHIFT = Gauge(
+    'model_drift_mean_shift',
+    'Diferença de médias em desvios-padrão da referência',
+    ['model_version', 'feature'],
+    multiprocess_mode='livemax'
+)
+
+DRIFT_WINDOW_SIZE = Gauge(
+    'model_drift_window_observations',
+    'Observações na janela comparada com a referência',
+    ['model_version'],
+    multiprocess_mode='livemax'
+)
+
+class FeatureSketch:
+    """
+    Resumo mergeável de uma coluna: histograma sobre bordas fixas (as da
+    referência) e momentos de Welford. Dois sketches com as mesmas bordas se
+    combinam somando as contagens.
+    """
+    def __init__(self, edges: Iterable[float]):
+        self.edges = np.asarray(edges, dtype=np.float64)
+        self.counts = np.zeros(len(self.edges) + 1, dtype=np.int64)
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def update(self, valores: np.ndarray) -> None:
+        valores = np.asarray(valores, dtype=np.float64)
+        valores = valores[~np.isnan(valores)]
+        if not len(valores):
+            return
+        self.counts += np.bincount(
+            np.searchsorted(self.edges, valores, side="right"), minlength=len(self.counts)
+        )
+        self._merge_momentos(len(valores), float(valores.mean()), float(((valores - valores.mean()) ** 2).sum()))
+
+    def _merge_momentos(self, n_b: int, media_b: float, m2_b: float) -> None:
+        n = self.n + n_b
+        if not n:
+            return
+        delta = media_b - self.mean
+        self.mean += delta * n_b / n
+        self.m2 += m2_b + delta * delta * self.n * n_b / n
+        self.n = n
+
+    def merge(self, outro: "FeatureSketch") -> None:
+        if not np.array_equal(self.edges, outro.edges):
+            raise ValueError("Sketches com bordas diferentes")
+        self.counts += outro.counts
+        self._merge_momentos(outro.n, outro.mean, outro.m2)
+
+    @property
+    def std(self) -> float:
+        return math.sqrt(self.m2 / self.n) if self.n else 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"edges": self.edges.tolist(), "counts": self.counts.tolist(), "n": self.n, "mean": self.mean, "m2": self.m2}
+
+    @classmethod
+    def from_dict(cls, dados: Dict[str, Any]) -> "FeatureSketch":
+        sketch = cls(dados["edges"])
+        sketch.counts = np.asarray(dados["counts"], dtype=np.int64)
+        sketch.n, sketch.mean, sketch.m2 = int(dados["n"]), float(dados["mean"]), float(dados["m2"])
+        return sketch
+
+class DriftProfile:
+    """
+    Um sketch por coluna (features do modelo e o score)
+    """
+    def __init__(self, edges: Dict[str, Iterable[float]]):
+        self.sketches = {nome: FeatureSketch(bordas) for nome, bordas in edges.items()}
+
+    @property
+    def columns(self) -> List[str]:
+        return list(self.sketches)
+
+    def empty_like(self) -> "DriftProfile":
+        return DriftProfile({nome: s.edges for nome, s in self.sketches.items()})
+
+    def update(self, matriz: np.ndarray) -> None:
+        """
+        Acumula uma matriz (n, colunas) na ordem de columns (colunas finais
+        podem faltar); NaN é ignorado
+        """
+        for j, sketch in zip(range(matriz.shape[1]), self.sketches.values()):
+            sketch.update(matriz[:, j])
+
+    def merge(self, outro: "DriftProfile") -> None:
+        for nome, sketch in self.sketches.items():
+            if nome in outro.sketches:
+                sketch.merge(outro.sketches[nome])
+
+    @property
+    def n(self) -> int:
+        return self.sketches[SCORE].n if SCORE in self.sketches else 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {nome: sketch.to_dict() for nome, sketch in self.sketches.items()}
+
+    @classmethod
+    def from_dict(cls, dados: Dict[str, Any]) -> "DriftProfile":
+        perfil = cls({})
+        perfil.sketches = {nome: FeatureSketch.from_dict(s) for nome, s in dados.items()}
+        return perfil
+
+def reference_edges(amostra: np.ndarray, feature_names: List[str], n_bins: int = 10) -> Dict[str, np.ndarray]:
+    """
+    Bordas por quantis de uma amostra do treino (bins de mesma população na
+    referência, o que deixa o PSI sensível em toda a distribuição) e as
+    bordas fixas do score
+    """
+    quantis = np.linspace(0, 1, n_bins + 1)[1:-1]
+    bordas = np.nanquantile(np.asarray(amostra, dtype=np.float64), quantis, axis=0)
+    edges = {nome: np.unique(bordas[:, j][~np.isnan(bordas[:, j])]) for j, nome in enumerate(feature_names)}
+    edges[SCORE] = SCORE_EDGES
+    return edges
+
+def psi(referencia: np.ndarray, atual: np.ndarray, eps: float = 1e-4) -> float:
+    p = np.maximum(referencia / max(referencia.sum(), 1), eps)
+    q = np.maximum(atual / max(atual.sum(), 1), eps)
+    return float(((q - p) * np.log(q / p)).sum())
+
+def ks(referencia: np.ndarray, atual: np.ndarray) -> float:
+    p = np.cumsum(referencia) / max(referencia.sum(), 1)
+    q = np.cumsum(atual) / max(atual.sum(), 1)
+    return float(np.abs(p - q).max())
+
+def compare(referencia: DriftProfile, atual: DriftProfile) -> Dict[str, Dict[str, float]]:
+    """
+    PSI, KS e deslocamento da média de cada coluna
+    """
+    resultado = {}
+    for nome, ref in referencia.sketches.items():
+        sketch = atual.sketches.get(nome)
+        if sketch is None or not sketch.n or not ref.n:
+            continue
+        resultado[nome] = {
+            "psi": psi(ref.counts, sketch.counts),
+            "ks": ks(ref.counts, sketch.counts),
+            "mean_shift": (sketch.mean - ref.mean) / ref.std if ref.std else 0.0,
+            "n": sketch.n
+        }
+    return resultado
+
+def _numero(valor: Any) -> float:
+    try:
+        return float(valor)
+    except (TypeError, ValueError):
+        return math.nan
+
+class DriftMonitor:
+    """
+    Monitor de drift em processo. O caminho de score só enfileira a observação
+    (observe, um append); a tarefa periódica agrega a fila em sketches por
+    versão do modelo, num anel de buckets de tempo que forma a janela
+    deslizante, e compara a janela com a referência salva no treino.
+
+    Com redis_client, cada processo publica a sua janela e a comparação usa a
+    combinação das janelas de todos os processos.
+    """
+    def __init__(
+        self,
+        redis_client=None,
+        reference_dir: str = None,
+        window_seconds: int = None,
+        n_buckets: int = None,
+        buffer_size: int = None
+    ):
+        self.redis_client = redis_client
+        self.enabled = settings.DRIFT_MONITOR_ENABLED
+        self.reference_dir = reference_dir or settings.DRIFT_REFERENCE_DIR
+        self.window_seconds = window_seconds or settings.DRIFT_WINDOW_SECONDS
+        self.n_buckets = n_buckets or settings.DRIFT_WINDOW_BUCKETS
+        self._pendentes: deque = deque(maxlen=buffer_size or settings.DRIFT_BUFFER_SIZE)
+        self._referencias: Dict[str, DriftProfile] = {}
+        self._aneis: Dict[str, Dict[int, DriftProfile]] = {}
+        self._id = f"{socket.gethostname()}:{os.getpid()}"
+
+    def observe(self, model_version: Optional[str], features: Dict[str, Any], score: float) -> None:
+        """
+        Chamado no caminho quente: só guarda referências, sem cópia nem cálculo
+        """
+        if self.enabled:
+            self._pendentes.append((model_version, features, score))
+
+    def reference(self, model_version: str) -> Optional[DriftProfile]:
+        """
+        Perfil de referência da versão (reference_<versão>.json) ou, na falta
+        dele, o do último treino (reference_profile.json)
+        """
+        if model_version not in self._referencias:
+            for nome in (f"reference_{model_version}.json", "reference_profile.json"):
+                caminho = os.path.join(self.reference_dir, nome)
+                if os.path.exists(caminho):
+                    with open(caminho) as f:
+                        self._referencias[model_version] = DriftProfile.from_dict(json.load(f))
+                    break
+        return self._referencias.get(model_version)
+
+    def flush(self, agora: float = None) -> int:
+        """
+        Agrega as observações pendentes no bucket atual de cada versão
+        """
+        agora = agora or time.time()
+        pendentes, self._pendentes = self._pendentes, deque(maxlen=self._pendentes.maxlen)
+        por_versao: Dict[str, List[Tuple[Dict[str, Any], float]]] = {}
+        for versao, features, score in pendentes:
+            por_versao.setdefault(versao or "desconhecido", []).append((features, score))
+
+        tamanho = self.window_seconds / self.n_buckets
+        epoca = int(agora // tamanho)
+        for versao, observacoes in por_versao.items():
+            referencia = self.reference(versao)
+            if referencia is None:
+                continue
+            colunas = [c for c in referencia.columns if c != SCORE]
+            matriz = np.array(
+                [[_numero(features.get(c)) for c in colunas] + [_numero(score)] for features, score in observacoes],
+                dtype=np.float64
+            )
+            # A ordem das colunas da matriz segue a do perfil, com o score por último
+            perfil = DriftProfile({c: referencia.sketches[c].edges for c in colunas + [SCORE]})
+            perfil.update(matriz)
+            anel = self._aneis.setdefault(versao, {})
+            if epoca in anel:
+                anel[epoca].merge(perfil)
+            else:
+                anel[epoca] = perfil
+            for antiga in [e for e in anel if e <= epoca - self.n_buckets]:
+                del anel[antiga]
+        return len(pendentes)
+
+    def window(self, model_version: str, agora: float = None) -> Optional[DriftProfile]:
+        """
+        Combinação dos buckets do anel ainda dentro da janela
+        """
+        agora = agora or time.time()
+        epoca = int(agora // (self.window_seconds / self.n_buckets))
+        buckets = [p for e, p in self._aneis.get(model_version, {}).items() if e > epoca - self.n_buckets]
+        if not buckets:
+            return None
+        janela = buckets[0].empty_like()
+        for perfil in buckets:
+            janela.merge(perfil)
+        return janela
+
+    def _combinar_processos(self, model_version: str, janela: Optional[DriftProfile], agora: float) -> Optional[DriftProfile]:
+        """
+        Publica a janela deste processo e combina com as dos demais; janelas
+        de processos que pararam de publicar são ignoradas
+        """
+        chave = f"drift_window:{model_version}"
+        validade = 3 * settings.DRIFT_INTERVAL_SECONDS
+        if janela is not None:
+            self.redis_client.hset(chave, self._id, json.dumps({"t": agora, "perfil": janela.to_dict()}))
+            self.redis_client.expire(chave, validade)
+        combinada = None
+        for dados in self.redis_client.hvals(chave):
+            publicado = json.loads(dados)
+            if agora - publicado["t"] > validade:
+                continue
+            perfil = DriftProfile.from_dict(publicado["perfil"])
+            if combinada is None:
+                combinada = perfil
+            else:
+                combinada.merge(perfil)
+        return combinada
+
+    def run_once(self, agora: float = None) -> Dict[str, Dict[str, Dict[str, float]]]:
+        """
+        Agrega a fila, compara cada versão com a referência e exporta as métricas
+        """
+        agora = agora or time.time()
+        self.flush(agora)
+        resultados = {}
+        for versao in list(self._aneis):
+            janela = self.window(versao, agora)
+            if self.redis_client is not None:
+                janela = self._combinar_processos(versao, janela, agora)
+            if janela is None:
+                del self._aneis[versao]
+                continue
+            resultados[versao] = compare(self.reference(versao), janela)
+            DRIFT_WINDOW_SIZE.labels(model_version=versao).set(janela.n)
+            for coluna, metricas in resultados[versao].items():
+                DRIFT_PSI.labels(model_version=versao, feature=coluna).set(metricas["psi"])
+                DRIFT_KS.labels(model_version=versao, feature=coluna).set(metricas["ks"])
+                DRIFT_MEAN_SHIFT.labels(model_version=versao, feature=coluna).set(metricas["mean_shift"])
+        return resultados
+
+    async def run(self) -> None:
+        """
+        Tarefa periódica do worker; a agregação roda fora do event loop
+        """
+        while True:
+            await asyncio.sleep(settings.DRIFT_INTERVAL_SECONDS)
+            try:
+                await asyncio.to_thread(self.run_once)
+            except Exception as e:
+                logger.error(f"Erro no monitor de drift: {str(e)}")
+
+# Tarefa em background (lê as janelas publicadas por todos os processos)
+drift_monitor = DriftMonitor(redis.from_url(
+    settings.REDIS_URL,
+    socket_timeout=settings.REDIS_BATCH_SOCKET_TIMEOUT_MS / 1000,
+    socket_connect_timeout=settings.REDIS_CONNECT_TIMEOUT_MS / 1000
+))
@@ -1,12 +1,30 @@
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional, Sequence
+import hashlib
 import mlflow
 import joblib
+import numpy as np
 from datetime import datetime
 from pathlib import Path
 from app.core.logger import setup_logger
 
 logger = setup_logger('model_manager')
 
+def vector_schema_version(feature_names: Sequence[str]) -> str:
+    """
+    Identificador do esquema de entrada de um modelo (nomes e ordem das features)
+    """
+    return hashlib.sha1("\x1f".join(feature_names).encode()).hexdigest()[:12]
+
+def model_scores(model: Any, entrada) -> np.ndarray:
+    """
+    Scores de 0 a 100 de um lote: probabilidade da classe positiva para
+    classificadores (predict_proba) ou a saída de regressores, como o
+    XGBRegressor de app/ml/train_model.py, que já prevê o score nessa escala
+    """
+    if hasattr(model, 'predict_proba'):
+        return np.asarray(model.predict_proba(entrada))[:, 1] * 100
+    return np.clip(np.asarray(model.predict(np.asarray(entrada, dtype=np.float64)), dtype=np.float64), 0, 100)
+
 class ModelManager:
     """
     Gerenciador de modelos ML com versionamento
@@ -16,6 +34,9 @@ class ModelManager:
         self.model_dir.mkdir(exist_ok=True)
         self.current_model = None
         self.current_version = None
+        self.shadow_model = None
+        self.shadow_version = None
+        self._esquema = (None, None)
         self._load_latest_model()
 
     def _load_latest_model(self) -> None:
@@ -40,13 +61,24 @@ class ModelManager:
         """
         Carrega uma versão específica do modelo
         """
+        self.current_model = self._load_version(version)
+        self.current_version = version
+        logger.info(f"Modelo versão {version} carregado")
+
+    def load_shadow_model(self, version: str) -> None:
+        """
+        Carrega uma versão candidata para pontuação em shadow, sem trocar o
+        modelo que responde às requisições
+        """
+        self.shadow_model = self._load_version(version)
+        self.shadow_version = version
+        logger.info(f"Modelo candidato {version} carregado em shadow")
+
+    def _load_version(self, version: str) -> Any:
         model_path = self.model_dir / f"model_{version}.pkl"
         if not model_path.exists():
             raise ValueError(f"Modelo versão {version} não encontrado")
-
-        self.current_model = joblib.load(model_path)
-        self.current_version = version
-        logger.info(f"Modelo versão {version} carregado")
+        return joblib.load(model_path)
 
     def save_model(self, model: Any, version: str) -> None:
         """
@@ -71,9 +103,9 @@ class ModelManager:
             raise ValueError("Nenhum modelo carregado")
 
         try:
-            prediction = self.current_model.predict_proba([list(features.values())])[0]
+            score = model_scores(self.current_model, [self._feature_vector(features)])[0]
             return {
-                "score": float(prediction[1] * 100),
+                "score": float(score),
                 "version": self.current_version,
                 "timestamp": datetime.utcnow().isoformat()
             }
@@ -81,6 +113,72 @@ class ModelManager:
             logger.error(f"Erro na predição: {str(e)}")
             raise
 
+    def predict_many(self, features_list: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Predição em lote com uma única chamada ao modelo
+        """
+        if not self.current_model:
+            raise ValueError("Nenhum modelo carregado")
+
+        try:
+            scores = model_scores(self.current_model, [self._feature_vector(f) for f in features_list])
+            timestamp = datetime.utcnow().isoformat()
+            return [
+                {"score": float(score), "version": self.current_version, "timestamp": timestamp}
+                for score in scores
+            ]
+        except Exception as e:
+            logger.error(f"Erro na predição em lote: {str(e)}")
+            raise
+
+    def predict_vector(self, vetor: np.ndarray) -> Dict[str, Any]:
+        """
+        Predição sobre um vetor já na ordem de feature_names, sem montar a entrada
+        """
+        if not self.current_model:
+            raise ValueError("Nenhum modelo carregado")
+
+        score = model_scores(self.current_model, vetor.reshape(1, -1))[0]
+        return {
+            "score": float(score),
+            "version": self.current_version,
+            "timestamp": datetime.utcnow().isoformat()
+        }
+
+    @property
+    def feature_names(self) -> Optional[List[str]]:
+        nomes = getattr(self.current_model, 'feature_names_in_', None)
+        return None if nomes is None else list(nomes)
+
+    @property
+    def schema_version(self) -> Optional[str]:
+        """
+        Versão do esquema de entrada do modelo atual (calculada uma vez por modelo)
+        """
+        modelo, versao = self._esquema
+        if modelo is not self.current_model:
+            nomes = self.feature_names
+            versao = vector_schema_version(nomes) if nomes else None
+            self._esquema = (self.current_model, versao)
+        return versao
+
+    def predict_shadow(self, features: Dict[str, Any]) -> float:
+        """
+        Score do modelo candidato
+        """
+        if not self.shadow_model:
+            raise ValueError("Nenhum modelo candidato carregado")
+        return float(model_scores(self.shadow_model, [self._feature_vector(features, self.shadow_model)])[0])
+
+    def _feature_vector(self, features: Dict[str, Any], model: Any = None) -> list:
+        """
+        Monta a entrada do modelo na ordem das features com que ele foi treinado
+        """
+        nomes = getattr(model or self.current_model, 'feature_names_in_', None)
+        if nomes is None:
+            return list(features.values())
+        return [features.get(nome, 0.0) for nome in nomes]
+
     def get_model_info(self) -> Dict[str, Any]:
         """
         Retorna informações sobre o modelo atual
@@ -0,0 +1,174 @@
+from typing import Dict, Any, List, Optional
+import numpy as np
+from scipy.stats import t as t_dist
+
+class StreamingCorrelation:
+    """
+    Correlação de Pearson e Spearman de várias features contra um alvo, em uma
+    única passada e memória constante.
+
+    - Pearson: momentos de Welford por feature, combinados lote a lote
+      (fórmula paralela de Chan), totalmente vetorizados.
+    - Spearman: tabela de contingência por feature entre bins de quantis de x
+      e de y. Os ranks são os ranks médios de cada bin, o que aproxima a
+      correlação de ranks com erro da ordem de 1/n_bins. As bordas dos bins
+      saem do primeiro lote, então os lotes devem vir em ordem não
+      correlacionada com as features (ex: por user_id).
+    """
+    def __init__(self, feature_names: List[str], n_bins: int = 256):
+        k = len(feature_names)
+        self.feature_names = list(feature_names)
+        self.n_bins = n_bins
+        self.n = np.zeros(k)
+        self.media_x = np.zeros(k)
+        self.media_y = np.zeros(k)
+        self.m2_x = np.zeros(k)
+        self.m2_y = np.zeros(k)
+        self.c_xy = np.zeros(k)
+        self.bordas_x: Optional[np.ndarray] = None  # (n_bins - 1, k)
+        self.bordas_y: Optional[np.ndarray] = None  # (n_bins - 1,)
+        self.tabela = np.zeros((k, n_bins, n_bins), dtype=np.int64)
+
+    def update(self, X: np.ndarray, y: np.ndarray) -> None:
+        """
+        Acumula um lote: X com shape (n, k) e y com shape (n,). Pares com NaN
+        são ignorados feature a feature.
+        """
+        X = np.asarray(X, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        validos = ~np.isnan(X) & ~np.isnan(y)[:, None]
+        if not validos.any():
+            return
+        self._update_momentos(X, y, validos)
+        self._update_tabela(X, y, validos)
+
+    def _update_momentos(self, X: np.ndarray, y: np.ndarray, validos: np.ndarray) -> None:
+        Y = np.broadcast_to(y[:, None], X.shape)
+        n_b = validos.sum(axis=0).astype(np.float64)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            media_xb = np.where(validos, X, 0.0).sum(axis=0) / n_b
+            media_yb = np.where(validos, Y, 0.0).sum(axis=0) / n_b
+        media_xb = np.nan_to_num(media_xb)
+        media_yb = np.nan_to_num(media_yb)
+        dx = np.where(validos, X - media_xb, 0.0)
+        dy = np.where(validos, Y - media_yb, 0.0)
+        self._merge_momentos(
+            n_b, media_xb, media_yb,
+            (dx * dx).sum(axis=0), (dy * dy).sum(axis=0), (dx * dy).sum(axis=0)
+        )
+
+    def _merge_momentos(self, n_b, media_xb, media_yb, m2_xb, m2_yb, c_xyb) -> None:
+        n_a = self.n
+        n = n_a + n_b
+        with np.errstate(invalid="ignore", divide="ignore"):
+            peso = np.where(n > 0, n_b / n, 0.0)
+            cruzado = np.where(n > 0, n_a * n_b / n, 0.0)
+        d_x = media_xb - self.media_x
+        d_y = media_yb - self.media_y
+        self.media_x = self.media_x + d_x * peso
+        self.media_y = self.media_y + d_y * peso
+        self.m2_x = self.m2_x + m2_xb + d_x * d_x * cruzado
+        self.m2_y = self.m2_y + m2_yb + d_y * d_y * cruzado
+        self.c_xy = self.c_xy + c_xyb + d_x * d_y * cruzado
+        self.n = n
+
+    def _update_tabela(self, X: np.ndarray, y: np.ndarray, validos: np.ndarray) -> None:
+        quantis = np.linspace(0, 1, self.n_bins + 1)[1:-1]
+        if self.bordas_x is None:
+            self.bordas_x = np.nan_to_num(np.nanquantile(X, quantis, axis=0))
+            self.bordas_y = np.nanquantile(y, quantis)
+
+        k = X.shape[1]
+        bins_y = np.searchsorted(self.bordas_y, y, side="right")
+        bins_x = self._bins_x(X, validos)
+        indices = np.arange(k) * self.n_bins * self.n_bins + bins_x * self.n_bins + bins_y[:, None]
+        self.tabela += np.bincount(
+            indices[validos], minlength=self.tabela.size
+        ).reshape(self.tabela.shape)
+
+    def _bins_x(self, X: np.ndarray, validos: np.ndarray) -> np.ndarray:
+        """
+        searchsorted de todas as colunas numa chamada só: cada coluna é
+        deslocada para um intervalo próprio, maior que a faixa dos dados, e as
+        bordas concatenadas viram um único vetor ordenado. O arredondamento do
+        deslocamento só pode criar empates falsos com a borda de cima, que são
+        desfeitos comparando com os valores originais.
+        """
+        n_bordas, k = self.bordas_x.shape
+        finitos = np.isfinite(X)
+        menor = min(self.bordas_x.min(), np.min(X, initial=np.inf, where=finitos))
+        maior = max(self.bordas_x.max(), np.max(X, initial=-np.inf, where=finitos))
+        deslocamento = (maior - menor + 1) * np.arange(k)
+        bordas = (self.bordas_x - menor + deslocamento).T.ravel()
+        valores = np.clip(np.nan_to_num(X, nan=menor), menor, maior) - menor + deslocamento
+        bins = np.searchsorted(bordas, valores, side="right") - np.arange(k) * n_bordas
+
+        colunas = np.broadcast_to(np.arange(k), X.shape)
+        while True:
+            acima = validos & (bins > 0)
+            acima[acima] = X[acima] < self.bordas_x[bins[acima] - 1, colunas[acima]]
+            if not acima.any():
+                return bins
+            bins[acima] -= 1
+
+    def merge(self, outro: "StreamingCorrelation") -> None:
+        """
+        Combina outro acumulador (ex: de outro processo) com as mesmas bordas
+        """
+        if outro.bordas_x is not None:
+            if self.bordas_x is None:
+                self.bordas_x, self.bordas_y = outro.bordas_x, outro.bordas_y
+            elif not (np.array_equal(self.bordas_x, outro.bordas_x) and np.array_equal(self.bordas_y, outro.bordas_y)):
+                raise ValueError("Acumuladores com bordas de bins diferentes")
+        self._merge_momentos(outro.n, outro.media_x, outro.media_y, outro.m2_x, outro.m2_y, outro.c_xy)
+        self.tabela += outro.tabela
+
+    def pearson(self) -> np.ndarray:
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return self.c_xy / np.sqrt(self.m2_x * self.m2_y)
+
+    def spearman(self) -> np.ndarray:
+        rho = np.full(len(self.feature_names), np.nan)
+        for j, tabela in enumerate(self.tabela):
+            total = tabela.sum()
+            if total < 2:
+                continue
+            n_x = tabela.sum(axis=1)
+            n_y = tabela.sum(axis=0)
+            media = (total + 1) / 2
+            rank_x = np.cumsum(n_x) - n_x + (n_x + 1) / 2 - media
+            rank_y = np.cumsum(n_y) - n_y + (n_y + 1) / 2 - media
+            cov = rank_x @ tabela @ rank_y
+            var = (n_x * rank_x ** 2).sum() * (n_y * rank_y ** 2).sum()
+            if var > 0:
+                rho[j] = cov / np.sqrt(var)
+        return rho
+
+    def results(self) -> List[Dict[str, Any]]:
+        """
+        Retorna uma linha por feature no mesmo formato do modo em memória
+        """
+        pearson = self.pearson()
+        spearman = self.spearman()
+        return [
+            {
+                'feature': feature,
+                'pearson_corr': pearson[j],
+                'pearson_p': _p_valor(pearson[j], self.n[j]),
+                'spearman_corr': spearman[j],
+                'spearman_p': _p_valor(spearman[j], self.n[j]),
+                'n': int(self.n[j])
+            }
+            for j, feature in enumerate(self.feature_names)
+        ]
+
+def _p_valor(r: float, n: float) -> float:
+    """
+    p-valor bicaudal de uma correlação pela estatística t com n - 2 graus de liberdade
+    """
+    if np.isnan(r) or n < 3:
+        return np.nan
+    if abs(r) >= 1:
+        return 0.0
+    t = r * np.sqrt((n - 2) / (1 - r * r))
+    return float(2 * t_dist.sf(abs(t), n - 2))
@@ -0,0 +1,129 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional
+import math
+import random
+import threading
+
+from prometheus_client import Counter, Histogram
+
+from app.core.config import settings
+from app.core.logger import setup_logger
+
+logger = setup_logger('shadow')
+
+SHADOW_EVENTS = Counter(
+    'score_shadow_total',
+    'Requisições sorteadas para pontuação em shadow',
+    ['result']  # scored, dropped, error
+)
+
+SHADOW_DELTA = Histogram(
+    'score_shadow_delta',
+    'Score do modelo candidato menos o score de produção',
+    ['model_version', 'shadow_version'],
+    buckets=(-50, -20, -10, -5, -2, -1, 0, 1, 2, 5, 10, 20, 50)
+)
+
+class ShadowScorer:
+    """
+    Pontuação em shadow: uma fração das requisições também é pontuada pelo
+    modelo candidato do ModelManager, em um executor próprio e limitado, depois
+    que a resposta de produção já foi calculada. O trabalho é descartado (nunca
+    enfileirado além de max_pending) quando o executor está cheio ou quando o
+    limitador de concorrência indica carga.
+
+    Os deltas vão para um histograma e, com redis_client, para somas agregadas
+    por par de versões (shadow_comparison:<produção>:<candidato>), comuns a
+    todos os workers.
+    """
+    def __init__(
+        self,
+        model_manager,
+        redis_client=None,
+        limiter=None,
+        sample_rate: float = None,
+        max_concurrency: int = None,
+        max_pending: int = None
+    ):
+        self.model_manager = model_manager
+        self.redis_client = redis_client
+        self.limiter = limiter
+        self.sample_rate = settings.SHADOW_SAMPLE_RATE if sample_rate is None else sample_rate
+        self.max_pending = max_pending or settings.SHADOW_MAX_PENDING
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_concurrency or settings.SHADOW_MAX_CONCURRENCY,
+            thread_name_prefix="shadow"
+        )
+        self._pendentes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def active(self) -> bool:
+        return self.model_manager.shadow_model is not None and self.sample_rate > 0
+
+    def submit(self, features: Dict[str, Any], score: float, model_version: Optional[str]) -> bool:
+        """
+        Sorteia e agenda a pontuação em shadow; retorna na hora, sem esperar
+        """
+        if not self.active or random.random() >= self.sample_rate:
+            return False
+        with self._lock:
+            sob_carga = self.limiter is not None and self.limiter.saturated("batch")
+            if sob_carga or self._pendentes >= self.max_pending:
+                SHADOW_EVENTS.labels(result="dropped").inc()
+                return False
+            self._pendentes += 1
+        self._executor.submit(self._score, features, score, model_version or "desconhecido")
+        return True
+
+    def _score(self, features: Dict[str, Any], score: float, model_version: str) -> None:
+        try:
+            shadow_version = self.model_manager.shadow_version
+            shadow_score = self.model_manager.predict_shadow(features)
+            self.record(model_version, shadow_version, score, shadow_score)
+            SHADOW_EVENTS.labels(result="scored").inc()
+        except Exception as e:
+            SHADOW_EVENTS.labels(result="error").inc()
+            logger.warning(f"Erro na pontuação em shadow: {str(e)}")
+        finally:
+            with self._lock:
+                self._pendentes -= 1
+
+    def record(self, model_version: str, shadow_version: str, score: float, shadow_score: float) -> None:
+        delta = shadow_score - score
+        SHADOW_DELTA.labels(model_version=model_version, shadow_version=shadow_version).observe(delta)
+        if self.redis_client is None:
+            return
+        chave = f"shadow_comparison:{model_version}:{shadow_version}"
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.hincrby(chave, "n", 1)
+        pipe.hincrbyfloat(chave, "soma_delta", delta)
+        pipe.hincrbyfloat(chave, "soma_delta2", delta * delta)
+        pipe.hincrbyfloat(chave, "soma_abs_delta", abs(delta))
+        pipe.expire(chave, settings.SHADOW_COMPARISON_TTL_SECONDS)
+        pipe.execute()
+
+    def summary(self) -> List[Dict[str, Any]]:
+        """
+        Resumo agregado de cada par de versões comparado
+        """
+        if self.redis_client is None:
+            return []
+        resumos = []
+        for chave in self.redis_client.scan_iter(match="shadow_comparison:*"):
+            chave = chave.decode() if isinstance(chave, bytes) else chave
+            _, model_version, shadow_version = chave.split(":", 2)
+            somas = {k.decode(): float(v) for k, v in self.redis_client.hgetall(chave).items()}
+            n = somas.get("n", 0)
+            if not n:
+                continue
+            media = somas["soma_delta"] / n
+            resumos.append({
+                "model_version": model_version,
+                "shadow_version": shadow_version,
+                "n": int(n),
+                "mean_delta": media,
+                "std_delta": math.sqrt(max(somas["soma_delta2"] / n - media * media, 0.0)),
+                "mean_abs_delta": somas["soma_abs_delta"] / n
+            })
+        return resumos
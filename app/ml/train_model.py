@@ -1,14 +1,31 @@
+import argparse
+import json
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+from typing import List, Tuple
+
 import mlflow
 import pandas as pd
 import numpy as np
-from sklearn.model_selection import train_test_split
-from sklearn.preprocessing import StandardScaler
-from xgboost import XGBRegressor
-from sklearn.metrics import mean_squared_error, r2_score
+import xgboost as xgb
+from sqlalchemy import text
 import shap
 import matplotlib.pyplot as plt
 
 from app.core.config import settings
+from app.ml.drift import DriftProfile, SCORE, reference_edges
+from app.ml.online_stats import StreamingCorrelation
+
+SYNTHETIC_FEATURES = [
+    'pix_volume',
+    'avg_transaction_value',
+    'transaction_frequency',
+    'chargeback_rate',
+    'app_connections',
+    'account_age_days'
+]
 
 def generate_synthetic_data(n_samples=1000):
     """
@@ -47,75 +64,244 @@ def generate_synthetic_data(n_samples=1000):
     
     return pd.DataFrame(data)
 
-def train_model():
+@contextmanager
+def _etapa(nome: str):
+    """
+    Mede a duração de uma etapa do pipeline e registra no MLflow
+    """
+    inicio = time.perf_counter()
+    yield
+    duracao = time.perf_counter() - inicio
+    mlflow.log_metric(f"tempo_{nome}_s", duracao)
+    print(f"[{nome}] {duracao:.2f}s")
+
+def _iter_synthetic_chunks(n_samples: int, chunk_size: int):
+    """
+    Gera os dados sintéticos e os entrega em lotes (X, y)
+    """
+    df = generate_synthetic_data(n_samples)
+    X = df[SYNTHETIC_FEATURES].to_numpy(dtype=np.float32)
+    y = df['score'].to_numpy(dtype=np.float32)
+    for inicio in range(0, len(df), chunk_size):
+        yield X[inicio:inicio + chunk_size], y[inicio:inicio + chunk_size]
+
+def _iter_postgres_chunks(feature_names: List[str], chunk_size: int, days: int):
+    """
+    Lê features tipadas e o último score de cada usuário com cursor no servidor
+    """
+    from app.db.session import batch_engine
+
+    query = f"""
+        SELECT {', '.join('f.' + c for c in feature_names)}, s.score
+        FROM user_feature_columns f
+        JOIN (
+            SELECT DISTINCT ON (user_id) user_id, score
+            FROM scores
+            WHERE timestamp > NOW() - interval '{int(days)} days'
+            ORDER BY user_id, timestamp DESC
+        ) s ON s.user_id = f.user_id
+        ORDER BY f.user_id
+    """
+    with batch_engine.connect() as conn:
+        resultado = conn.execution_options(stream_results=True, yield_per=chunk_size).execute(text(query))
+        for lote in resultado.partitions():
+            matriz = np.array(lote, dtype=np.float32)
+            yield matriz[:, :-1], matriz[:, -1]
+
+def _materializar_shards(chunks, data_dir: str, feature_names: List[str], test_size: float):
+    """
+    Grava cada lote em shards .npy (lidos depois com memory-map), separando
+    treino e teste por sorteio linha a linha, e acumula as correlações
+    """
+    rng = np.random.default_rng(42)
+    correlacoes = StreamingCorrelation(feature_names)
+    treino, teste = [], []
+    for i, (X, y) in enumerate(chunks):
+        correlacoes.update(X, y)
+        em_teste = rng.random(len(y)) < test_size
+        for destino, mascara, nome in ((treino, ~em_teste, "train"), (teste, em_teste, "test")):
+            if not mascara.any():
+                continue
+            X_path = os.path.join(data_dir, f"{nome}_{i:05d}_X.npy")
+            y_path = os.path.join(data_dir, f"{nome}_{i:05d}_y.npy")
+            np.save(X_path, X[mascara])
+            np.save(y_path, y[mascara])
+            destino.append((X_path, y_path))
+    return treino, teste, correlacoes
+
+def _load_shard(shard: Tuple[str, str]):
+    X_path, y_path = shard
+    return np.load(X_path, mmap_mode='r'), np.load(y_path, mmap_mode='r')
+
+class _ShardIterator(xgb.DataIter):
+    """
+    Entrega os shards ao XGBoost um de cada vez, para montar a DMatrix sem
+    carregar o dataset inteiro
+    """
+    def __init__(self, shards: List[Tuple[str, str]], feature_names: List[str], cache_prefix: str = None):
+        self._shards = shards
+        self._feature_names = feature_names
+        self._i = 0
+        super().__init__(cache_prefix=cache_prefix)
+
+    def next(self, input_data) -> int:
+        if self._i == len(self._shards):
+            return 0
+        X, y = _load_shard(self._shards[self._i])
+        input_data(data=np.asarray(X), label=np.asarray(y), feature_names=self._feature_names)
+        self._i += 1
+        return 1
+
+    def reset(self) -> None:
+        self._i = 0
+
+def _como_regressor(booster: xgb.Booster) -> xgb.XGBRegressor:
     """
-    Treina o modelo inicial e registra no MLflow
+    Envolve o Booster treinado no XGBRegressor do sklearn, com
+    feature_names_in_ (ModelManager e rescore_users montam a entrada por ele).
+    O regressor prevê o score de 0 a 100 direto: ver model_scores.
+    """
+    model = xgb.XGBRegressor()
+    model.load_model(bytearray(booster.save_raw("json")))
+    return model
+
+def train_model(
+    source: str = "synthetic",
+    n_samples: int = 1000,
+    chunk_size: int = 100000,
+    test_size: float = 0.2,
+    external_memory: bool = False,
+    n_jobs: int = -1,
+    shap_sample: int = 2000,
+    days: int = 30,
+    data_dir: str = None,
+    reference_dir: str = None
+):
+    """
+    Treina o modelo e registra no MLflow. Os dados são materializados em shards
+    memory-mapped e entregues ao XGBoost por um DataIter (QuantileDMatrix ou,
+    com external_memory, DMatrix com cache em disco), então o volume de treino
+    não é limitado pela RAM. As árvores não dependem da escala: o modelo é
+    treinado nas features brutas, como os carregadores as entregam.
     """
     # Configura o MLflow
     mlflow.set_tracking_uri(settings.MLFLOW_TRACKING_URI)
     mlflow.set_experiment(settings.MLFLOW_EXPERIMENT_NAME)
+    n_threads = os.cpu_count() if n_jobs == -1 else n_jobs
+    reference_dir = reference_dir or settings.DRIFT_REFERENCE_DIR
     
-    # Gera dados sintéticos
-    df = generate_synthetic_data()
-
-    # Calcula e exibe correlação de cada feature com o score
-    print("Correlação de cada feature com o score de risco real:")
-    correlacoes = df.corr(numeric_only=True)['score'].sort_values(ascending=False)
-    print(correlacoes)
-    # Também registra no MLflow
-    correlacoes.drop('score').to_csv("feature_score_correlations.csv")
-    mlflow.log_artifact("feature_score_correlations.csv")
-
-    # Separa features e target
-    X = df.drop('score', axis=1)
-    y = df['score']
-    
-    # Divide em treino e teste
-    X_train, X_test, y_train, y_test = train_test_split(
-        X, y, test_size=0.2, random_state=42
-    )
-    
-    # Normaliza as features
-    scaler = StandardScaler()
-    X_train_scaled = scaler.fit_transform(X_train)
-    X_test_scaled = scaler.transform(X_test)
+    if source == "postgres":
+        from app.models.user_feature_columns import FEATURE_COLUMNS
+        feature_names = [c for c in FEATURE_COLUMNS if c != 'last_transaction_date']
+        chunks = _iter_postgres_chunks(feature_names, chunk_size, days)
+    else:
+        feature_names = SYNTHETIC_FEATURES
+        chunks = _iter_synthetic_chunks(n_samples, chunk_size)
     
-    # Inicia o run do MLflow
-    with mlflow.start_run():
-        # Treina o modelo
-        model = XGBRegressor(
-            n_estimators=100,
-            learning_rate=0.1,
-            max_depth=5,
-            random_state=42
-        )
-        model.fit(X_train_scaled, y_train)
+    with tempfile.TemporaryDirectory(dir=data_dir) as tmp_dir, mlflow.start_run():
+        mlflow.log_params({
+            "source": source,
+            "chunk_size": chunk_size,
+            "external_memory": external_memory,
+            "n_jobs": n_threads,
+            "tree_method": "hist"
+        })
+        
+        with _etapa("carga"):
+            treino, teste, correlacoes = _materializar_shards(chunks, tmp_dir, feature_names, test_size)
+        if not treino or not teste:
+            raise ValueError(
+                f"Dados insuficientes em {source}: {len(treino)} shard(s) de treino e {len(teste)} de teste"
+            )
+        
+        # Calcula e exibe correlação de cada feature com o score
+        print("Correlação de cada feature com o score de risco real:")
+        correlacoes_df = pd.DataFrame(correlacoes.results()).set_index('feature')['pearson_corr']
+        print(correlacoes_df.sort_values(ascending=False))
+        # Também registra no MLflow
+        correlacoes_df.to_csv("feature_score_correlations.csv")
+        mlflow.log_artifact("feature_score_correlations.csv")
         
-        # Faz previsões
-        y_pred = model.predict(X_test_scaled)
+        # Perfil de referência do monitor de drift: bordas pelos quantis do
+        # primeiro shard e histogramas/momentos sobre todo o treino
+        with _etapa("referencia"):
+            referencia = DriftProfile(reference_edges(_load_shard(treino[0])[0], feature_names))
+            for shard in treino:
+                referencia.update(np.asarray(_load_shard(shard)[0]))
         
-        # Calcula métricas
-        mse = mean_squared_error(y_test, y_pred)
-        r2 = r2_score(y_test, y_pred)
+        with _etapa("dmatrix"):
+            if external_memory:
+                iterador = _ShardIterator(treino, feature_names, cache_prefix=os.path.join(tmp_dir, "cache"))
+                dtrain = xgb.DMatrix(iterador, nthread=n_threads)
+            else:
+                iterador = _ShardIterator(treino, feature_names)
+                dtrain = xgb.QuantileDMatrix(iterador, nthread=n_threads)
+        
+        # Treina o modelo
+        with _etapa("treino"):
+            booster = xgb.train(
+                {
+                    "objective": "reg:squarederror",
+                    "tree_method": "hist",
+                    "nthread": n_threads,
+                    "learning_rate": 0.1,
+                    "max_depth": 5,
+                    "seed": 42
+                },
+                dtrain,
+                num_boost_round=100
+            )
+            model = _como_regressor(booster)
+            # Libera a DMatrix antes do diretório temporário: com external_memory,
+            # os arquivos de cache só são apagados quando ela é destruída
+            del dtrain, iterador
+        
+        # Calcula métricas no conjunto de teste, shard a shard
+        with _etapa("avaliacao"):
+            n, sse, soma_y, soma_y2 = 0, 0.0, 0.0, 0.0
+            amostra_X = []
+            for shard in teste:
+                X, y = _load_shard(shard)
+                y = np.asarray(y, dtype=np.float64)
+                y_pred = model.predict(np.asarray(X))
+                referencia.sketches[SCORE].update(y_pred)
+                n += len(y)
+                sse += float(((y - y_pred) ** 2).sum())
+                soma_y += float(y.sum())
+                soma_y2 += float((y ** 2).sum())
+                if sum(len(a) for a in amostra_X) < shap_sample:
+                    amostra_X.append(np.asarray(X))
+            mse = sse / n
+            r2 = 1 - sse / (soma_y2 - soma_y ** 2 / n)
         
         # Registra métricas
         mlflow.log_metric("mse", mse)
         mlflow.log_metric("r2", r2)
         
-        # Registra o modelo
-        mlflow.xgboost.log_model(model, "model")
+        # Registra o modelo (JSON guarda os nomes das features, o binário não)
+        mlflow.xgboost.log_model(model, "model", model_format="json")
         
-        # Registra o scaler
-        mlflow.sklearn.log_model(scaler, "scaler")
+        # Registra o perfil de referência e o publica para o monitor de drift
+        os.makedirs(reference_dir, exist_ok=True)
+        reference_path = os.path.join(reference_dir, "reference_profile.json")
+        with open(reference_path, "w") as f:
+            json.dump(referencia.to_dict(), f)
+        mlflow.log_artifact(reference_path)
         
-        # Gera e registra explicação SHAP
-        explainer = shap.TreeExplainer(model)
-        shap_values = explainer.shap_values(X_test_scaled)
+        # Gera e registra explicação SHAP sobre uma amostra limitada do teste,
+        # com o TreeSHAP nativo do XGBoost (paralelo em n_threads)
+        with _etapa("shap"):
+            amostra = np.concatenate(amostra_X)[:shap_sample]
+            contribuicoes = booster.predict(
+                xgb.DMatrix(amostra, feature_names=feature_names, nthread=n_threads),
+                pred_contribs=True
+            )
+            shap_values = contribuicoes[:, :-1]  # Última coluna é o viés
         
         # Plota e salva o gráfico SHAP
         shap.summary_plot(
             shap_values,
-            X_test,
+            pd.DataFrame(amostra, columns=feature_names),
             show=False,
             plot_size=(10, 6)
         )
@@ -126,4 +312,25 @@ def train_model():
         print(f"R2: {r2:.2f}")
 
 if __name__ == "__main__":
-    train_model() 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Treina o modelo de score.")
+    parser.add_argument('--source', type=str, default='synthetic', choices=['synthetic', 'postgres'], help='Origem dos dados')
+    parser.add_argument('--n_samples', type=int, default=1000, help='Amostras sintéticas')
+    parser.add_argument('--chunk_size', type=int, default=100000, help='Linhas por shard')
+    parser.add_argument('--external_memory', action='store_true', help='Usa DMatrix com cache em disco (dados maiores que a RAM)')
+    parser.add_argument('--n_jobs', type=int, default=-1, help='Threads do XGBoost (-1 = todos os núcleos)')
+    parser.add_argument('--shap_sample', type=int, default=2000, help='Linhas de teste usadas no SHAP')
+    parser.add_argument('--days', type=int, default=30, help='Janela dos scores usados como alvo (postgres)')
+    parser.add_argument('--data_dir', type=str, default=None, help='Diretório dos shards temporários')
+    parser.add_argument('--reference_dir', type=str, default=None, help='Destino do perfil de referência do monitor de drift')
+    args = parser.parse_args()
+    train_model(
+        source=args.source,
+        n_samples=args.n_samples,
+        chunk_size=args.chunk_size,
+        external_memory=args.external_memory,
+        n_jobs=args.n_jobs,
+        shap_sample=args.shap_sample,
+        days=args.days,
+        data_dir=args.data_dir,
+        reference_dir=args.reference_dir
+    )
@@ -0,0 +1,62 @@
+from sqlalchemy import Column, Integer, String, Float, DateTime, Boolean, ForeignKey
+from sqlalchemy.sql import func
+
+from app.db.base_class import Base
+
+class UserFeatureColumns(Base):
+    """
+    Versão tipada de UserFeature.feature_data: uma coluna numérica por feature
+    escalar, para filtros/índices em SQL e leituras em massa sem parse de JSON
+    """
+    __tablename__ = "user_feature_columns"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(String, unique=True, index=True)
+    pix_volume = Column(Float)
+    avg_transaction_value = Column(Float)
+    transaction_frequency = Column(Float)
+    chargeback_rate = Column(Float, index=True)
+    app_connections = Column(Integer)
+    last_transaction_date = Column(DateTime(timezone=True))
+    account_age_days = Column(Integer)
+    total_transactions = Column(Integer, index=True)
+    tempo_medio_entre_transacoes = Column(Float)
+    variacao_categoria_uso = Column(Integer)
+    geodispersao_ips = Column(Integer)
+    frequencia_reembolsos = Column(Float)
+    mudanca_subita_device = Column(Integer)
+    dias_desde_ultima_transacao = Column(Integer)
+    total_chargebacks = Column(Integer)
+    media_valor_reembolsos = Column(Float)
+    last_updated = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    
+    def __repr__(self):
+        return f"<UserFeatureColumns(user_id={self.user_id}, last_updated={self.last_updated})>"
+
+class UserFeatureHistory(Base):
+    """
+    Itens dos históricos de transações e logins, um por linha
+    """
+    __tablename__ = "user_feature_history"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(String, ForeignKey("user_feature_columns.user_id", ondelete="CASCADE"), index=True)
+    tipo = Column(String)  # transacao, login
+    posicao = Column(Integer)  # 0 = mais antigo
+    timestamp = Column(DateTime(timezone=True))
+    valor = Column(Float, nullable=True)
+    categoria = Column(String, nullable=True)
+    reembolsada = Column(Boolean, nullable=True)
+    chargeback = Column(Boolean, nullable=True)
+    device_id = Column(String, nullable=True)
+    cidade = Column(String, nullable=True)
+    estado = Column(String, nullable=True)
+    
+    def __repr__(self):
+        return f"<UserFeatureHistory(user_id={self.user_id}, tipo={self.tipo}, posicao={self.posicao})>"
+
+# Features escalares com coluna própria, na ordem da tabela
+FEATURE_COLUMNS = [
+    c.name for c in UserFeatureColumns.__table__.columns
+    if c.name not in ("id", "user_id", "last_updated")
+]
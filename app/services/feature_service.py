@@ -1,73 +1,856 @@
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional, Tuple, Iterator
 import redis
 import json
+import math
+import random
+import time
+import uuid
+import asyncio
 from datetime import datetime, timedelta
+import numpy as np
+from sqlalchemy import text, select, delete
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.orm import Session
+from sqlalchemy.sql import func
 from collections import deque
+from prometheus_client import Counter
 
 from app.core.config import settings
-from app.db.session import get_db
+from app.core.logger import setup_logger
+from app.core.resilience import CircuitBreaker, CircuitOpenError, DeadlineExceeded
+from app.core.sharding import redis_from_settings, check_topology
+from app.db.routing import read_router
+from app.db.session import get_db, batch_engine, POSTGRES_FALHAS
 from app.models.user_feature import UserFeature
+from app.models.user_feature_columns import UserFeatureColumns, UserFeatureHistory, FEATURE_COLUMNS
+from app.services.window_store import WindowStore, event_time, FEATURE_NAMES as FEATURES_JANELAS
+
+logger = setup_logger('feature_service')
+
+# Falhas que indicam Redis indisponível ou lento
+REDIS_FALHAS = (redis.exceptions.ConnectionError, redis.exceptions.TimeoutError)
+redis_breaker = CircuitBreaker("redis", falhas=REDIS_FALHAS)
+
+# Métricas do cache de features (hit, stale, miss, rebuild, lock_wait, bypass)
+FEATURE_CACHE_EVENTS = Counter(
+    'feature_cache_events_total',
+    'Eventos do cache de features de usuário',
+    ['result']
+)
+
+# Libera o lock apenas se o valor ainda for o token de quem o obteve
+RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# Campos guardados fora do hash, como listas limitadas no Redis
+CAMPOS_HISTORICO = ("historico_transacoes", "historico_logins")
+
+# Modo Redis primário: usuários alterados e ainda não gravados no PostgreSQL.
+# Com vários nós, cada nó tem o seu conjunto, com os usuários que guarda.
+DIRTY_SET_KEY = "user_features_dirty"
+
+# Modo postgres: usuários cujas tabelas tipadas (user_feature_columns e
+# user_feature_history) ainda não refletem a última escrita. O snapshotter as
+# sincroniza em lote, fora da transação de cada evento. Também local a cada nó.
+COLUMNS_DIRTY_SET_KEY = "user_feature_columns_dirty"
+
+# Esquemas de entrada dos modelos em uso (versão do esquema -> nomes em JSON),
+# para os quais o caminho de escrita materializa o vetor float32 do usuário
+VECTOR_SCHEMAS_KEY = "feature_vector_schemas"
+# Último uso de cada esquema (versão -> segundos Unix): os sem uso por
+# FEATURE_VECTOR_SCHEMA_IDLE_SECONDS são removidos e deixam de ser materializados
+VECTOR_SCHEMAS_SEEN_KEY = "feature_vector_schemas_seen"
+
+# Aplica as operações de um evento no cache, apenas se o usuário estiver em cache.
+# Cada aplicação incrementa o campo _seq do hash, que identifica o estado.
+# KEYS: hash de features, lista de transações, lista de logins e, opcionalmente,
+#       o conjunto de sujos (modo Redis primário), marcado na mesma execução
+# ARGV: operações em JSON, limite de transações, limite de logins,
+#       "1" para retornar o estado resultante (hash, transações, logins), user_id
+APPLY_OPERATIONS_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+redis.call('HINCRBY', KEYS[1], '_seq', 1)
+if KEYS[4] then
+    redis.call('SADD', KEYS[4], ARGV[5])
+end
+local ops = cjson.decode(ARGV[1])
+for campo, valor in pairs(ops.incr) do
+    redis.call('HINCRBYFLOAT', KEYS[1], campo, valor)
+end
+for campo, valor in pairs(ops.set) do
+    redis.call('HSET', KEYS[1], campo, valor)
+end
+if ops.push_transacao then
+    redis.call('LPUSH', KEYS[2], ops.push_transacao)
+    redis.call('LTRIM', KEYS[2], 0, tonumber(ARGV[2]) - 1)
+end
+if ops.push_login then
+    redis.call('LPUSH', KEYS[3], ops.push_login)
+    redis.call('LTRIM', KEYS[3], 0, tonumber(ARGV[3]) - 1)
+end
+if ops.marcar_ultima_transacao then
+    local ultima = redis.call('LINDEX', KEYS[2], 0)
+    if ultima then
+        local transacao = cjson.decode(ultima)
+        transacao[ops.marcar_ultima_transacao] = true
+        redis.call('LSET', KEYS[2], 0, cjson.encode(transacao))
+    end
+end
+local ttl = redis.call('PTTL', KEYS[1])
+if ttl > 0 then
+    redis.call('PEXPIRE', KEYS[2], ttl)
+    redis.call('PEXPIRE', KEYS[3], ttl)
+end
+if ARGV[4] == '1' then
+    return {
+        redis.call('HGETALL', KEYS[1]),
+        redis.call('LRANGE', KEYS[2], 0, -1),
+        redis.call('LRANGE', KEYS[3], 0, -1)
+    }
+end
+return 1
+"""
+
+# Modo Redis primário: grava as derivadas e os vetores calculados sobre o estado
+# _seq = ARGV[1]. Se outro evento já alterou o usuário, nada é gravado: as
+# derivadas dele, calculadas sobre um estado mais novo, prevalecem.
+# KEYS: hash de features, chaves dos vetores
+# ARGV: _seq, derivadas (campo -> valor em JSON) em JSON, TTL dos vetores em
+#       segundos, um valor por vetor
+WRITE_DERIVED_SCRIPT = """
+if redis.call('HGET', KEYS[1], '_seq') ~= ARGV[1] then
+    return 0
+end
+for campo, valor in pairs(cjson.decode(ARGV[2])) do
+    redis.call('HSET', KEYS[1], campo, valor)
+end
+for i = 2, #KEYS do
+    redis.call('SET', KEYS[i], ARGV[i + 2], 'EX', tonumber(ARGV[3]))
+end
+return 1
+"""
+
+# Modo Redis primário: grava o estado vindo do PostgreSQL apenas se o usuário
+# ainda não estiver no Redis, para nunca sobrescrever eventos já aplicados.
+# KEYS: hash de features, lista de transações, lista de logins
+# ARGV: campos do hash, transações e logins (mais recente primeiro), em JSON
+HYDRATE_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return 0
+end
+for campo, valor in pairs(cjson.decode(ARGV[1])) do
+    redis.call('HSET', KEYS[1], campo, valor)
+end
+redis.call('DEL', KEYS[2], KEYS[3])
+for _, item in ipairs(cjson.decode(ARGV[2])) do
+    redis.call('RPUSH', KEYS[2], item)
+end
+for _, item in ipairs(cjson.decode(ARGV[3])) do
+    redis.call('RPUSH', KEYS[3], item)
+end
+return 1
+"""
+
+# Modo postgres: regrava o cache reconstruído a partir do banco apenas se
+# nenhuma escrita tocou o usuário desde que a reconstrução leu a versão
+# (ARGV[1], vazio se não havia). A escrita incrementa a versão antes e depois
+# do commit, então um snapshot lido do banco antes dele é descartado.
+# KEYS: hash de features, lista de transações, lista de logins, versão, chaves
+#       dos vetores
+# ARGV: versão lida, campos do hash, transações e logins (mais recente
+#       primeiro) em JSON, TTL físico em segundos, TTL dos vetores em segundos,
+#       um valor por vetor
+REBUILD_SCRIPT = """
+if (redis.call('GET', KEYS[4]) or '') ~= ARGV[1] then
+    return 0
+end
+redis.call('DEL', KEYS[1], KEYS[2], KEYS[3])
+for campo, valor in pairs(cjson.decode(ARGV[2])) do
+    redis.call('HSET', KEYS[1], campo, valor)
+end
+for _, item in ipairs(cjson.decode(ARGV[3])) do
+    redis.call('RPUSH', KEYS[2], item)
+end
+for _, item in ipairs(cjson.decode(ARGV[4])) do
+    redis.call('RPUSH', KEYS[3], item)
+end
+for i = 1, 3 do
+    redis.call('EXPIRE', KEYS[i], tonumber(ARGV[5]))
+end
+for i = 5, #KEYS do
+    redis.call('SET', KEYS[i], ARGV[i + 2], 'EX', tonumber(ARGV[6]))
+end
+return 1
+"""
+
+# Lê o estado atual travando a linha até o commit: eventos concorrentes do
+# mesmo usuário são aplicados em série, sem perder incrementos.
+# Este desenho substitui o UPDATE com expressões jsonb_set pedido para os
+# contadores e históricos: as derivadas dependem do estado resultante e são
+# calculadas em Python, então o UPDATE atômico exigiria uma segunda escrita
+# da linha por evento. Com a trava, o evento é aplicado em Python
+# (_apply_operations, mesma semântica do APPLY_OPERATIONS_SCRIPT) e a linha é
+# gravada uma única vez. A atomicidade vem do FOR UPDATE, não da expressão
+# SQL; no Redis os contadores seguem com HINCRBYFLOAT e as listas com
+# LPUSH+LTRIM.
+LOCK_FEATURES_SQL = """
+SELECT feature_data FROM user_features WHERE user_id = :user_id FOR UPDATE
+"""
+
+# Primeiro evento do usuário: a linha já nasce com o evento aplicado. Se outro
+# evento inseriu a linha antes, nada é gravado (rowcount 0).
+INSERT_FEATURES_SQL = """
+INSERT INTO user_features (user_id, feature_data, last_updated)
+VALUES (:user_id, CAST(:features AS json), now())
+ON CONFLICT (user_id) DO NOTHING
+"""
+
+# Única escrita do evento: contadores, históricos e derivadas de uma vez
+WRITE_FEATURES_SQL = """
+UPDATE user_features
+SET feature_data = CAST(:features AS json), last_updated = now()
+WHERE user_id = :user_id
+"""
+
+UPSERT_MERGE_SQL = """
+INSERT INTO user_features (user_id, feature_data, last_updated)
+VALUES (:user_id, CAST(:padrao AS json), now())
+ON CONFLICT (user_id) DO UPDATE
+SET feature_data = (user_features.feature_data::jsonb || CAST(:novas AS jsonb))::json, last_updated = now()
+RETURNING feature_data
+"""
 
 class FeatureService:
-    def __init__(self):
-        self.redis_client = redis.from_url(settings.REDIS_URL)
+    def __init__(self, socket_timeout_ms: int = None):
+        # Um nó (REDIS_URL) ou vários (REDIS_NODES) com as chaves de cada
+        # usuário sob a hash tag {user_id}, no mesmo nó. Workers e scripts em
+        # lote passam REDIS_BATCH_SOCKET_TIMEOUT_MS: o timeout da API derrubaria
+        # os pipelines de milhares de chaves.
+        self.redis_client = redis_from_settings(
+            local_keys=(DIRTY_SET_KEY, COLUMNS_DIRTY_SET_KEY),
+            socket_timeout=(socket_timeout_ms or settings.REDIS_SOCKET_TIMEOUT_MS) / 1000,
+            socket_connect_timeout=settings.REDIS_CONNECT_TIMEOUT_MS / 1000
+        )
         # Parâmetro: quantos eventos manter no histórico
         self.HISTORICO_TRANSACOES = 20
         self.HISTORICO_LOGINS = 10
+        # Parâmetro: tamanho dos lotes em leituras em massa (MGET e IN no banco)
+        self.TAMANHO_LOTE = settings.FEATURE_BATCH_SIZE
+        self._release_lock_script = self.redis_client.register_script(RELEASE_LOCK_SCRIPT)
+        self._apply_operations_script = self.redis_client.register_script(APPLY_OPERATIONS_SCRIPT)
+        self._write_derived_script = self.redis_client.register_script(WRITE_DERIVED_SCRIPT)
+        self._hydrate_script = self.redis_client.register_script(HYDRATE_SCRIPT)
+        self._rebuild_script = self.redis_client.register_script(REBUILD_SCRIPT)
+        # No modo "redis" o Redis guarda o estado vivo e o PostgreSQL recebe
+        # snapshots periódicos (app/workers/feature_snapshotter.py)
+        self.redis_primario = settings.FEATURE_STORE_MODE == "redis"
+        if self.redis_primario:
+            self._verificar_topologia()
+        self._refresh_tasks = set()
+        # Janelas de tempo de evento (1h/24h/30d), calculadas na leitura
+        self.janelas = WindowStore(self.redis_client) if settings.FEATURE_WINDOWS_ENABLED else None
+        # Esquemas de vetor conhecidos, relidos do Redis periodicamente
+        self._esquemas: Dict[str, List[str]] = {}
+        self._esquemas_validos_ate = 0.0
+        self._esquemas_renovar_em: Dict[str, float] = {}  # Próxima renovação do uso de cada esquema
+    
+    def _verificar_topologia(self):
+        """
+        Com o estado vivo no Redis, não parte com uma lista de nós diferente da
+        registrada neles (TopologyError); sem Redis, segue e o breaker assume
+        """
+        try:
+            check_topology(self.redis_client)
+        except REDIS_FALHAS as e:
+            logger.warning(f"Topologia do Redis não verificada: {str(e)}")
     
     async def get_user_features(self, user_id: str) -> Dict[str, Any]:
         """
         Obtém as features de um usuário, combinando dados do Redis e PostgreSQL
         """
+        features, _ = await self.get_user_features_with_status(user_id)
+        return features
+    
+    async def get_user_features_with_status(self, user_id: str) -> Tuple[Dict[str, Any], str]:
+        """
+        Obtém as features de um usuário e o resultado do cache (hit, stale ou
+        miss), junto com as features das janelas de tempo no instante atual
+        """
+        features, resultado = await self._get_cached_features(user_id)
+        if self.janelas:
+            try:
+                with redis_breaker.guard():
+                    features = {**features, **self.janelas.features(user_id)}
+            except (CircuitOpenError, *REDIS_FALHAS):
+                # Sem Redis, o score sai sem as janelas em vez de falhar
+                pass
+        return features, resultado
+    
+    async def _get_cached_features(self, user_id: str) -> Tuple[Dict[str, Any], str]:
+        """
+        Entradas expiradas dentro da janela de stale são servidas enquanto uma
+        única chamada (dona do lock) reconstrói o cache em background.
+        
+        Com o Redis indisponível, lê direto do banco; com o PostgreSQL
+        indisponível, serve a entrada expirada que ainda estiver no cache.
+        """
         # Tenta obter do cache (Redis)
-        cached_features = self._get_from_cache(user_id)
-        if cached_features:
-            return cached_features
+        try:
+            with redis_breaker.guard():
+                entrada = self._get_from_cache(user_id)
+        except (CircuitOpenError, *REDIS_FALHAS):
+            FEATURE_CACHE_EVENTS.labels(result="bypass").inc()
+            return await self._get_from_db(user_id), "bypass"
+        if entrada:
+            if not self._deve_reconstruir(entrada):
+                FEATURE_CACHE_EVENTS.labels(result="hit").inc()
+                return entrada["data"], "hit"
+            
+            # Expiração (real ou antecipada): só quem obtém o lock reconstrói
+            expirada = time.time() >= entrada["expires_at"]
+            if not expirada or settings.FEATURE_CACHE_STALE_SECONDS > 0:
+                token, versao = self._acquire_rebuild_lock(user_id)
+                if token:
+                    self._refresh_in_background(user_id, token, versao)
+                resultado = "stale" if expirada else "hit"
+                FEATURE_CACHE_EVENTS.labels(result=resultado).inc()
+                return entrada["data"], resultado
         
-        # Se não estiver em cache, busca do banco
-        db_features = await self._get_from_db(user_id)
+        FEATURE_CACHE_EVENTS.labels(result="miss").inc()
+        try:
+            return await self._rebuild(user_id), "miss"
+        except (CircuitOpenError, DeadlineExceeded, *POSTGRES_FALHAS):
+            if not entrada:
+                raise
+            FEATURE_CACHE_EVENTS.labels(result="stale").inc()
+            return entrada["data"], "stale"
+    
+    async def _rebuild(self, user_id: str) -> Dict[str, Any]:
+        """
+        Reconstrói o cache de um usuário a partir do banco. Se outra chamada já
+        estiver reconstruindo, aguarda o cache ser repopulado antes de ir ao banco.
+        """
+        token, versao = self._acquire_rebuild_lock(user_id)
+        if not token:
+            FEATURE_CACHE_EVENTS.labels(result="lock_wait").inc()
+            prazo = time.monotonic() + settings.FEATURE_CACHE_LOCK_WAIT_MS / 1000
+            while time.monotonic() < prazo:
+                await asyncio.sleep(0.01)
+                entrada = self._get_from_cache(user_id)
+                if entrada and time.time() < entrada["expires_at"]:
+                    return entrada["data"]
         
-        # Atualiza o cache
-        self._update_cache(user_id, db_features)
+        try:
+            inicio = time.monotonic()
+            db_features = await self._get_from_db(user_id)
+            FEATURE_CACHE_EVENTS.labels(result="rebuild").inc()
+            
+            # Atualiza o cache, se nenhuma escrita passou na frente
+            self._update_cache(user_id, db_features, time.monotonic() - inicio, versao)
+            return db_features
+        finally:
+            if token:
+                self._release_rebuild_lock(user_id, token)
+    
+    def _refresh_in_background(self, user_id: str, token: str, versao: Optional[bytes]):
+        """
+        Agenda a reconstrução do cache de um usuário sem bloquear a requisição
+        atual. versao é a do cache quando o lock foi obtido.
+        """
+        async def _refresh():
+            try:
+                inicio = time.monotonic()
+                db_features = await self._get_from_db(user_id)
+                FEATURE_CACHE_EVENTS.labels(result="rebuild").inc()
+                self._update_cache(user_id, db_features, time.monotonic() - inicio, versao)
+            except Exception as e:
+                logger.error(f"Erro ao reconstruir cache de {user_id}: {str(e)}")
+            finally:
+                self._release_rebuild_lock(user_id, token)
         
-        return db_features
+        task = asyncio.get_running_loop().create_task(_refresh())
+        # Mantém referência para a task não ser coletada antes de terminar
+        self._refresh_tasks.add(task)
+        task.add_done_callback(self._refresh_tasks.discard)
+    
+    def _deve_reconstruir(self, entrada: Dict[str, Any]) -> bool:
+        """
+        Expiração antecipada probabilística (XFetch): quanto mais perto do fim do
+        TTL e mais cara a reconstrução, maior a chance de reconstruir antes
+        """
+        delta = entrada.get("delta", 0.0)
+        beta = settings.FEATURE_CACHE_XFETCH_BETA
+        return time.time() - delta * beta * math.log(1.0 - random.random()) >= entrada["expires_at"]
+    
+    def _acquire_rebuild_lock(self, user_id: str) -> Tuple[Optional[str], Optional[bytes]]:
+        """
+        Tenta obter o lock de reconstrução do cache de um usuário. Retorna o
+        token (None se outra chamada já reconstrói) e, no mesmo pipeline, a
+        versão do cache lida antes da leitura do banco (ver _versoes_do_cache)
+        """
+        token = uuid.uuid4().hex
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.set(
+            f"user_features_lock:{{{user_id}}}",
+            token,
+            nx=True,
+            px=settings.FEATURE_CACHE_LOCK_TIMEOUT_MS
+        )
+        if not self.redis_primario:
+            pipe.get(self._versao_key(user_id))
+        adquirido, *versao = pipe.execute()
+        return (token if adquirido else None), ((versao[0] or b"") if versao else None)
+    
+    def _release_rebuild_lock(self, user_id: str, token: str):
+        """
+        Libera o lock de reconstrução, apenas se ainda pertencer a este token
+        """
+        self._release_lock_script(keys=[f"user_features_lock:{{{user_id}}}"], args=[token])
     
-    def _get_from_cache(self, user_id: str) -> Dict[str, Any]:
+    async def get_many_user_features(self, user_ids: List[str]) -> List[Dict[str, Any]]:
         """
-        Obtém features do Redis
+        Obtém as features de vários usuários de uma vez, na mesma ordem de user_ids.
+        Lê o Redis em pipeline, busca os misses no PostgreSQL em consultas IN por
+        lote e repopula o cache com um único pipeline.
         """
-        cache_key = f"user_features:{user_id}"
-        cached_data = self.redis_client.get(cache_key)
+        if not user_ids:
+            return []
+        
+        ids_unicos = list(dict.fromkeys(user_ids))
+        encontrados = self._get_many_from_cache(ids_unicos)
+        
+        misses = [user_id for user_id in ids_unicos if user_id not in encontrados]
+        if misses:
+            versoes = self._versoes_do_cache(misses)
+            db_features = await self._get_many_from_db(misses)
+            self._update_many_cache(db_features, versoes)
+            encontrados.update(db_features)
+        
+        if self.janelas:
+            for lote in self._lotes(ids_unicos):
+                for user_id, janelas in self.janelas.features_many(lote).items():
+                    encontrados[user_id] = {**encontrados[user_id], **janelas}
         
-        if cached_data:
-            return json.loads(cached_data)
-        return None
+        return [encontrados[user_id] for user_id in user_ids]
+    
+    def _cache_keys(self, user_id: str) -> Tuple[str, str, str]:
+        """
+        Chaves do cache de um usuário: hash com as features escalares e listas
+        limitadas (mais recente primeiro) com os históricos, todas com a hash
+        tag do usuário
+        """
+        base = f"user_features:{{{user_id}}}"
+        return base, f"{base}:transacoes", f"{base}:logins"
+    
+    def _vector_key(self, user_id: str, esquema: str) -> str:
+        return f"user_features:{{{user_id}}}:vetor:{esquema}"
+    
+    def _escrita_key(self, user_id: str) -> str:
+        return f"user_features:{{{user_id}}}:escrita"
+    
+    def _versao_key(self, user_id: str) -> str:
+        return f"user_features:{{{user_id}}}:versao"
+    
+    def _incrementar_versao(self, pipe, user_id: str):
+        """
+        Enfileira o incremento da versão do cache do usuário (modo postgres):
+        reconstruções que leram a versão anterior descartam o que leram do banco
+        """
+        chave = self._versao_key(user_id)
+        pipe.incr(chave)
+        pipe.expire(chave, settings.FEATURE_CACHE_TTL_SECONDS + settings.FEATURE_CACHE_STALE_SECONDS)
+    
+    def _versoes_do_cache(self, user_ids: List[str]) -> Dict[str, bytes]:
+        """
+        Versões atuais do cache dos usuários (b"" se não houver), lidas antes de
+        uma reconstrução a partir do banco. Vazio no modo Redis primário, em
+        que a hidratação já não sobrescreve o estado vivo.
+        """
+        if self.redis_primario:
+            return {}
+        versoes = {}
+        for lote in self._lotes(user_ids):
+            pipe = self.redis_client.pipeline(transaction=False)
+            for user_id in lote:
+                pipe.get(self._versao_key(user_id))
+            versoes.update({user_id: versao or b"" for user_id, versao in zip(lote, pipe.execute())})
+        return versoes
+    
+    def _registrar_escrita(self, user_id: str, client):
+        """
+        Depois do commit: incrementa de novo a versão do cache, para descartar
+        reconstruções que leram o banco antes do commit, e, com réplicas de
+        leitura, guarda o instante da escrita, para que a reconstrução do cache
+        em qualquer processo só leia réplicas que já a aplicaram. O instante é
+        gravado antes da versão: quem lê a versão nova também o encontra.
+        """
+        instante = read_router.mark_write([user_id])
+        try:
+            with redis_breaker.guard():
+                pipe = client.pipeline(transaction=False)
+                if instante is not None:
+                    pipe.set(self._escrita_key(user_id), instante, ex=settings.DATABASE_READ_YOUR_WRITES_SECONDS)
+                self._incrementar_versao(pipe, user_id)
+                pipe.execute()
+        except (CircuitOpenError, *REDIS_FALHAS) as e:
+            logger.warning(f"Escrita de {user_id} não registrada no Redis: {str(e)}")
+    
+    def _escritas_recentes(self, user_ids: List[str]) -> Optional[float]:
+        """
+        Instante da escrita recente mais nova entre os usuários (0 se não houver),
+        com um GET por usuário no mesmo pipeline; None se o Redis não responder,
+        e então a leitura vai para o primário
+        """
+        try:
+            with redis_breaker.guard():
+                pipe = self.redis_client.pipeline(transaction=False)
+                for user_id in user_ids:
+                    pipe.get(self._escrita_key(user_id))
+                instantes = pipe.execute()
+        except (CircuitOpenError, *REDIS_FALHAS):
+            return None
+        return max((float(i) for i in instantes if i), default=0.0)
+    
+    def register_vector_schema(self, esquema: str, feature_names: List[str]):
+        """
+        Publica o esquema de entrada de um modelo, para que o caminho de
+        escrita (inclusive nos consumers) passe a materializar o seu vetor, e
+        renova o seu uso a cada FEATURE_VECTOR_SCHEMA_REFRESH_SECONDS
+        """
+        agora = time.time()
+        if agora < self._esquemas_renovar_em.get(esquema, 0.0):
+            return
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.hset(VECTOR_SCHEMAS_KEY, esquema, json.dumps(feature_names))
+        pipe.hset(VECTOR_SCHEMAS_SEEN_KEY, esquema, agora)
+        pipe.execute()
+        self._esquemas[esquema] = list(feature_names)
+        self._esquemas_renovar_em[esquema] = agora + settings.FEATURE_VECTOR_SCHEMA_REFRESH_SECONDS
+    
+    def _vector_schemas(self) -> Dict[str, List[str]]:
+        if not settings.FEATURE_VECTOR_CACHE_ENABLED:
+            return {}
+        if time.monotonic() >= self._esquemas_validos_ate:
+            self._esquemas = self._esquemas_ativos()
+            self._esquemas_validos_ate = time.monotonic() + settings.FEATURE_VECTOR_SCHEMA_REFRESH_SECONDS
+        return self._esquemas
+    
+    def _esquemas_ativos(self) -> Dict[str, List[str]]:
+        """
+        Lê os esquemas publicados e remove os sem uso recente, que os modelos
+        em serviço não pedem mais. Esquemas sem registro de uso (publicados
+        antes dele existir) começam a contar agora.
+        """
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.hgetall(VECTOR_SCHEMAS_KEY)
+        pipe.hgetall(VECTOR_SCHEMAS_SEEN_KEY)
+        esquemas, vistos = pipe.execute()
+        agora = time.time()
+        limite = agora - settings.FEATURE_VECTOR_SCHEMA_IDLE_SECONDS
+        ativos, sem_registro, inativos = {}, [], []
+        for esquema, nomes in esquemas.items():
+            visto = vistos.get(esquema)
+            if visto is None:
+                sem_registro.append(esquema)
+            elif float(visto) < limite:
+                inativos.append(esquema)
+                continue
+            ativos[esquema.decode() if isinstance(esquema, bytes) else esquema] = json.loads(nomes)
+        if sem_registro or inativos:
+            pipe = self.redis_client.pipeline(transaction=False)
+            for esquema in sem_registro:
+                pipe.hsetnx(VECTOR_SCHEMAS_SEEN_KEY, esquema, agora)
+            if inativos:
+                pipe.hdel(VECTOR_SCHEMAS_KEY, *inativos)
+                pipe.hdel(VECTOR_SCHEMAS_SEEN_KEY, *inativos)
+                logger.info(f"Esquemas de vetor sem uso removidos: {[e.decode() if isinstance(e, bytes) else e for e in inativos]}")
+            pipe.execute()
+        return ativos
+    
+    def _build_vector(self, features: Dict[str, Any], feature_names: List[str]) -> bytes:
+        """
+        Vetor float32 na ordem do esquema; ausentes e não numéricos viram 0,
+        como na montagem da entrada do ModelManager. As features das janelas
+        são preenchidas na leitura.
+        """
+        valores = []
+        for nome in feature_names:
+            valor = features.get(nome)
+            valores.append(valor if isinstance(valor, (int, float)) else 0.0)
+        return np.asarray(valores, dtype=np.float32).tobytes()
+    
+    def _write_vectors(self, pipe, user_id: str, features: Dict[str, Any]):
+        """
+        Enfileira no pipeline o vetor do usuário para cada esquema em uso
+        """
+        for esquema, nomes in self._vector_schemas().items():
+            pipe.set(
+                self._vector_key(user_id, esquema),
+                self._build_vector(features, nomes),
+                ex=settings.FEATURE_CACHE_TTL_SECONDS
+            )
+    
+    def store_feature_vector(self, user_id: str, esquema: str, feature_names: List[str], features: Dict[str, Any]):
+        """
+        Reconstrução preguiçosa: grava o vetor de um esquema a partir das
+        features já lidas pelo caminho normal. Só grava se o vetor não existir
+        (NX): um evento aplicado depois da leitura já gravou um mais novo.
+        """
+        try:
+            with redis_breaker.guard():
+                self.redis_client.set(
+                    self._vector_key(user_id, esquema),
+                    self._build_vector(features, feature_names),
+                    ex=settings.FEATURE_CACHE_TTL_SECONDS,
+                    nx=True
+                )
+        except (CircuitOpenError, *REDIS_FALHAS):
+            pass
+    
+    def get_feature_vector(self, user_id: str, esquema: str, feature_names: List[str]) -> Optional[np.ndarray]:
+        """
+        Vetor pronto para o modelo direto dos bytes do Redis, com as features
+        das janelas preenchidas no instante atual. None se o vetor ainda não
+        existe para o esquema (modelo novo ou entrada expirada).
+        """
+        try:
+            with redis_breaker.guard():
+                bruto = self.redis_client.get(self._vector_key(user_id, esquema))
+        except (CircuitOpenError, *REDIS_FALHAS):
+            return None
+        if bruto is None:
+            FEATURE_CACHE_EVENTS.labels(result="vector_miss").inc()
+            return None
+        vetor = np.frombuffer(bruto, dtype=np.float32)
+        if len(vetor) != len(feature_names):
+            FEATURE_CACHE_EVENTS.labels(result="vector_miss").inc()
+            return None
+        FEATURE_CACHE_EVENTS.labels(result="vector_hit").inc()
+        
+        indices = [i for i, nome in enumerate(feature_names) if nome in FEATURES_JANELAS]
+        if self.janelas and indices:
+            janelas = self.janelas.features(user_id)
+            vetor = vetor.copy()
+            vetor[indices] = [janelas[feature_names[i]] for i in indices]
+        return vetor
+    
+    def _get_from_cache(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Obtém do Redis a entrada de cache de um usuário ({data, expires_at, delta})
+        """
+        chave, chave_transacoes, chave_logins = self._cache_keys(user_id)
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.hgetall(chave)
+        pipe.lrange(chave_transacoes, 0, -1)
+        pipe.lrange(chave_logins, 0, -1)
+        return self._decode_cache_entry(*pipe.execute())
+    
+    def _decode_cache_entry(self, campos, transacoes, logins) -> Optional[Dict[str, Any]]:
+        """
+        Converte o hash e as listas do Redis de volta no dicionário de features
+        """
+        if not campos:
+            return None
+        
+        features = {
+            (campo.decode() if isinstance(campo, bytes) else campo): json.loads(valor)
+            for campo, valor in campos.items()
+        }
+        expires_at = features.pop("_expires_at", 0.0)
+        delta = features.pop("_delta", 0.0)
+        features.pop("_seq", None)
+        # As listas guardam o evento mais recente primeiro; as features, o mais antigo
+        features["historico_transacoes"] = [json.loads(t) for t in reversed(transacoes)]
+        features["historico_logins"] = [json.loads(l) for l in reversed(logins)]
+        return {"data": features, "expires_at": expires_at, "delta": delta}
     
     async def _get_from_db(self, user_id: str) -> Dict[str, Any]:
         """
-        Obtém features do PostgreSQL
+        Obtém features do PostgreSQL, de uma réplica que já tenha as escritas
+        recentes do usuário. No modo Redis primário a hidratação lê sempre do
+        primário, que tem o último snapshot.
         """
-        db = next(get_db())
-        features = db.query(UserFeature).filter(
-            UserFeature.user_id == user_id
-        ).first()
+        escrita = self._escritas_recentes([user_id]) if read_router.enabled and not self.redis_primario else 0.0
+        features = read_router.run(
+            lambda db: db.query(UserFeature).filter(
+                UserFeature.user_id == user_id
+            ).first(),
+            user_ids=[user_id],
+            escrita_em=escrita or 0.0,
+            primary=self.redis_primario or escrita is None
+        )
         
         if not features:
             return self._get_default_features()
         
         return features.feature_data
     
-    def _update_cache(self, user_id: str, features: Dict[str, Any]):
+    def _lotes(self, itens: List[str]) -> List[List[str]]:
         """
-        Atualiza o cache no Redis
+        Divide uma lista de ids em lotes de TAMANHO_LOTE
         """
-        cache_key = f"user_features:{user_id}"
-        self.redis_client.setex(
-            cache_key,
-            timedelta(hours=1),  # Cache por 1 hora
-            json.dumps(features)
-        )
+        return [itens[i:i + self.TAMANHO_LOTE] for i in range(0, len(itens), self.TAMANHO_LOTE)]
+    
+    def _get_many_from_cache(self, user_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """
+        Obtém features de vários usuários do Redis com um pipeline por lote.
+        Entradas já expiradas (servíveis apenas como stale) contam como miss.
+        """
+        agora = time.time()
+        encontrados = {}
+        for lote in self._lotes(user_ids):
+            pipe = self.redis_client.pipeline(transaction=False)
+            for user_id in lote:
+                chave, chave_transacoes, chave_logins = self._cache_keys(user_id)
+                pipe.hgetall(chave)
+                pipe.lrange(chave_transacoes, 0, -1)
+                pipe.lrange(chave_logins, 0, -1)
+            
+            valores = pipe.execute()
+            for i, user_id in enumerate(lote):
+                entrada = self._decode_cache_entry(*valores[3 * i:3 * i + 3])
+                if entrada and agora < entrada["expires_at"]:
+                    encontrados[user_id] = entrada["data"]
+        return encontrados
+    
+    async def _get_many_from_db(self, user_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """
+        Obtém features de vários usuários do PostgreSQL com uma consulta IN por lote.
+        Cada lote vai para uma réplica que já tenha as escritas recentes dos
+        seus usuários, inclusive as feitas por outros processos.
+        Usuários sem registro recebem as features padrão.
+        """
+        resultado = {}
+        for lote in self._lotes(user_ids):
+            escrita = self._escritas_recentes(lote) if read_router.enabled and not self.redis_primario else 0.0
+            registros = read_router.run(
+                lambda db: db.query(UserFeature.user_id, UserFeature.feature_data).filter(
+                    UserFeature.user_id.in_(lote)
+                ).all(),
+                user_ids=lote,
+                escrita_em=escrita or 0.0,
+                primary=self.redis_primario or escrita is None
+            )
+            resultado.update({user_id: feature_data for user_id, feature_data in registros})
+        
+        for user_id in user_ids:
+            if user_id not in resultado:
+                resultado[user_id] = self._get_default_features()
+        return resultado
+    
+    def _encode_cache_entry(
+        self,
+        features: Dict[str, Any],
+        expires_at: float,
+        delta: float
+    ) -> Tuple[Dict[str, str], List[str], List[str]]:
+        """
+        Serializa as features no formato do Redis: campos do hash e itens das
+        listas de histórico (mais recente primeiro)
+        """
+        campos = {
+            campo: json.dumps(valor)
+            for campo, valor in features.items()
+            if campo not in CAMPOS_HISTORICO
+        }
+        campos["_expires_at"] = json.dumps(expires_at)
+        campos["_delta"] = json.dumps(delta)
+        transacoes = [json.dumps(t) for t in reversed(features.get("historico_transacoes") or [])]
+        logins = [json.dumps(l) for l in reversed(features.get("historico_logins") or [])]
+        return campos, transacoes, logins
+    
+    def _write_cache_entry(
+        self,
+        pipe,
+        user_id: str,
+        features: Dict[str, Any],
+        delta: float = 0.0,
+        versao: Optional[bytes] = None
+    ):
+        """
+        Enfileira no pipeline a regravação completa do cache de um usuário, com
+        expiração lógica e TTL físico. O TTL lógico recebe jitter para que chaves
+        criadas juntas (ex: após deploy) não expirem juntas; o TTL físico inclui a
+        janela em que a entrada pode ser servida stale.
+        
+        Reconstruções a partir do banco passam a versão lida antes da leitura
+        (ver _versoes_do_cache) e só gravam se ela não mudou; o caminho de
+        escrita passa None e grava sempre.
+        """
+        chaves = self._cache_keys(user_id)
+        if self.redis_primario:
+            # O Redis é a fonte da verdade: só hidrata a partir do banco, sem TTL
+            campos, transacoes, logins = self._encode_cache_entry(features, math.inf, delta)
+            self._hydrate_script(
+                keys=list(chaves),
+                args=[json.dumps(campos), json.dumps(transacoes), json.dumps(logins)],
+                client=pipe
+            )
+            return
+        
+        jitter = settings.FEATURE_CACHE_TTL_JITTER
+        ttl = settings.FEATURE_CACHE_TTL_SECONDS * random.uniform(1 - jitter, 1 + jitter)
+        ttl_fisico = int(ttl) + settings.FEATURE_CACHE_STALE_SECONDS
+        campos, transacoes, logins = self._encode_cache_entry(features, time.time() + ttl, delta)
+        
+        if versao is not None:
+            esquemas = self._vector_schemas()
+            self._rebuild_script(
+                keys=list(chaves) + [self._versao_key(user_id)] + [self._vector_key(user_id, e) for e in esquemas],
+                args=[
+                    versao,
+                    json.dumps(campos),
+                    json.dumps(transacoes),
+                    json.dumps(logins),
+                    ttl_fisico,
+                    settings.FEATURE_CACHE_TTL_SECONDS
+                ] + [self._build_vector(features, nomes) for nomes in esquemas.values()],
+                client=pipe
+            )
+            return
+        
+        chave, chave_transacoes, chave_logins = chaves
+        pipe.delete(*chaves)
+        pipe.hset(chave, mapping=campos)
+        if transacoes:
+            pipe.rpush(chave_transacoes, *transacoes)
+        if logins:
+            pipe.rpush(chave_logins, *logins)
+        for c in chaves:
+            pipe.expire(c, ttl_fisico)
+        self._write_vectors(pipe, user_id, features)
+    
+    def _update_many_cache(
+        self,
+        features_por_usuario: Dict[str, Dict[str, Any]],
+        versoes: Optional[Dict[str, bytes]] = None
+    ):
+        """
+        Atualiza o cache de vários usuários no Redis com um único pipeline.
+        Com versoes, cada usuário só é gravado se a versão dele não mudou.
+        """
+        versoes = versoes or {}
+        pipe = self.redis_client.pipeline(transaction=False)
+        for user_id, features in features_por_usuario.items():
+            self._write_cache_entry(pipe, user_id, features, versao=versoes.get(user_id))
+        pipe.execute()
+    
+    def _update_cache(self, user_id: str, features: Dict[str, Any], delta: float = 0.0, versao: Optional[bytes] = None):
+        """
+        Atualiza o cache no Redis. delta é o tempo gasto para recalcular as
+        features, usado na expiração antecipada; versao, a lida antes de uma
+        reconstrução (ver _write_cache_entry).
+        """
+        # MULTI/EXEC: leitores nunca veem o hash sem as listas
+        pipe = self.redis_client.pipeline(transaction=True)
+        self._write_cache_entry(pipe, user_id, features, delta, versao)
+        pipe.execute()
     
     def _get_default_features(self) -> Dict[str, Any]:
         """
@@ -102,98 +885,420 @@ class FeatureService:
         new_features: Dict[str, Any]
     ) -> Dict[str, Any]:
         """
-        Atualiza as features de um usuário
+        Atualiza as features de um usuário, mesclando new_features no registro
+        com um único UPSERT (sem ler e regravar o dicionário em Python)
         """
-        # Obtém features atuais
-        current_features = await self.get_user_features(user_id)
-        
-        # Atualiza com novas features
-        updated_features = {**current_features, **new_features}
+        if self.redis_primario:
+            return await self._update_features_redis(user_id, new_features)
         
-        # Salva no banco
         db = next(get_db())
-        feature_record = db.query(UserFeature).filter(
-            UserFeature.user_id == user_id
-        ).first()
-        
-        if not feature_record:
-            feature_record = UserFeature(
-                user_id=user_id,
-                feature_data=updated_features
-            )
-            db.add(feature_record)
-        else:
-            feature_record.feature_data = updated_features
+        padrao = {**self._get_default_features(), **new_features}
+        try:
+            # O UPSERT trava a linha até o commit; o cache é regravado antes,
+            # na mesma ordem das escritas no banco
+            updated_features = db.execute(text(UPSERT_MERGE_SQL), {
+                "user_id": user_id,
+                "padrao": json.dumps(padrao),
+                "novas": json.dumps(new_features)
+            }).scalar()
+            if not self._atualizar_cache_da_escrita(user_id, updated_features):
+                self.sync_feature_columns(db, {user_id: updated_features})
+            db.commit()
+        except Exception:
+            db.rollback()
+            self._invalidar_cache(user_id)
+            raise
+        finally:
+            db.close()
+        self._registrar_escrita(user_id, self.redis_client)
         
-        db.commit()
+        return updated_features
+    
+    async def _update_features_redis(
+        self,
+        user_id: str,
+        new_features: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        """
+        Modo Redis primário: mescla new_features no estado vivo do Redis e marca
+        o usuário para o próximo snapshot
+        """
+        await self.get_user_features(user_id)  # Garante o estado hidratado
+        if not new_features:
+            return self._get_from_cache(user_id)["data"]
         
-        # Atualiza cache
-        self._update_cache(user_id, updated_features)
+        escalares = {c: v for c, v in new_features.items() if c not in CAMPOS_HISTORICO}
+        chave, chave_transacoes, chave_logins = self._cache_keys(user_id)
+        pipe = self.redis_client.pipeline(transaction=True)
+        # Novo estado: derivadas calculadas por eventos anteriores não o sobrescrevem
+        pipe.hincrby(chave, "_seq", 1)
+        if escalares:
+            pipe.hset(chave, mapping={c: json.dumps(v) for c, v in escalares.items()})
+        for campo, chave_lista in zip(CAMPOS_HISTORICO, (chave_transacoes, chave_logins)):
+            if campo in new_features:
+                pipe.delete(chave_lista)
+                if new_features[campo]:
+                    pipe.rpush(chave_lista, *[json.dumps(i) for i in reversed(new_features[campo])])
+        # Conjunto de sujos do nó do usuário (o comando anterior define o nó)
+        pipe.sadd(DIRTY_SET_KEY, user_id)
+        pipe.execute()
         
-        return updated_features
+        features = self._get_from_cache(user_id)["data"]
+        pipe = self.redis_client.pipeline(transaction=False)
+        self._write_vectors(pipe, user_id, features)
+        pipe.execute()
+        return features
     
     async def process_event(self, event: Dict[str, Any]):
         """
-        Processa um evento e atualiza as features do usuário
+        Processa um evento e atualiza as features do usuário. No PostgreSQL, a
+        linha do usuário fica travada do SELECT ... FOR UPDATE até o commit e é
+        regravada uma única vez, já com as derivadas; no Redis primário, as
+        operações são aplicadas por um script Lua. Eventos concorrentes do mesmo
+        usuário não perdem incrementos.
         """
         user_id = event.get("user_id")
         event_type = event.get("type")
         event_data = event.get("data", {})
         if not user_id or not event_type:
             return
-        features = await self.get_user_features(user_id)
-        historico_transacoes = features.get("historico_transacoes", [])
-        historico_logins = features.get("historico_logins", [])
-        now = datetime.utcnow()
+        # Tempo de evento: o atraso do consumer não desloca históricos e janelas
+        quando = event_time(event) or datetime.utcnow()
+        operacoes = self._event_operations(event_type, event_data, quando)
+        if operacoes is None:
+            return
+        
+        if self.redis_primario:
+            await self._process_event_redis(user_id, operacoes)
+        else:
+            db = next(get_db())
+            try:
+                features = self._apply_operations_db(db, user_id, operacoes)
+                # O cache é regravado com a linha ainda travada: a ordem das escritas
+                # no Redis é a mesma dos commits no PostgreSQL. As tabelas tipadas
+                # ficam para o snapshotter, exceto se o Redis não marcou o usuário.
+                if not self._atualizar_cache_da_escrita(user_id, features):
+                    self.sync_feature_columns(db, {user_id: features})
+                db.commit()
+            except Exception:
+                db.rollback()
+                self._invalidar_cache(user_id)
+                raise
+            finally:
+                db.close()
+            self._registrar_escrita(user_id, self.redis_client)
+        self._registrar_janelas(user_id, event_type, event_data, quando)
+    
+    def _registrar_janelas(self, user_id: str, event_type: str, event_data: Dict[str, Any], quando: datetime):
+        """
+        Soma nas janelas um evento já aplicado. Um evento que falhou antes disso
+        e é reentregue não é contado duas vezes; se o Redis falhar aqui, as
+        janelas perdem o evento em vez de ele ser reprocessado nas features.
+        """
+        if not self.janelas:
+            return
+        try:
+            with redis_breaker.guard():
+                self.janelas.record(user_id, event_type, event_data, quando)
+        except (CircuitOpenError, *REDIS_FALHAS) as e:
+            logger.warning(f"Janelas de {user_id} não atualizadas: {str(e)}")
+    
+    def _atualizar_cache_da_escrita(self, user_id: str, features: Dict[str, Any]) -> bool:
+        """
+        Regrava o cache com o estado completo de uma escrita ainda não
+        commitada, incrementa a versão (reconstruções em andamento não o
+        sobrescrevem) e marca o usuário para a sincronização das tabelas
+        tipadas. Retorna False sem Redis: a escrita segue para o banco e o
+        cache se corrige na expiração.
+        """
+        try:
+            with redis_breaker.guard():
+                pipe = self.redis_client.pipeline(transaction=True)
+                self._incrementar_versao(pipe, user_id)
+                self._write_cache_entry(pipe, user_id, features)
+                # Conjunto do nó do usuário (o comando anterior define o nó)
+                pipe.sadd(COLUMNS_DIRTY_SET_KEY, user_id)
+                pipe.execute()
+            return True
+        except (CircuitOpenError, *REDIS_FALHAS) as e:
+            logger.warning(f"Cache de {user_id} não atualizado: {str(e)}")
+            return False
+    
+    def _invalidar_cache(self, user_id: str):
+        """
+        Remove o cache de um usuário cuja escrita no banco não foi commitada,
+        inclusive os vetores gravados junto com ela
+        """
+        try:
+            with redis_breaker.guard():
+                self.redis_client.delete(
+                    *self._cache_keys(user_id),
+                    *[self._vector_key(user_id, esquema) for esquema in self._vector_schemas()]
+                )
+        except (CircuitOpenError, *REDIS_FALHAS) as e:
+            logger.warning(f"Cache de {user_id} não invalidado: {str(e)}")
+    
+    async def _process_event_redis(self, user_id: str, operacoes: Dict[str, Any]):
+        """
+        Modo Redis primário: aplica o evento apenas no Redis e marca o usuário
+        como sujo no mesmo script; o snapshotter grava no PostgreSQL em lote.
+        As derivadas só são gravadas se nenhum outro evento alterou o usuário
+        nesse meio tempo.
+        """
+        estado = self._apply_operations_cache(user_id, operacoes, retornar_estado=True, marcar_sujo=True)
+        if not estado:
+            # Partida a frio: recupera o último snapshot do PostgreSQL e reaplica
+            self._update_cache(user_id, await self._get_from_db(user_id))
+            estado = self._apply_operations_cache(user_id, operacoes, retornar_estado=True, marcar_sujo=True)
+        
+        campos, transacoes, logins = estado
+        campos = dict(zip(campos[::2], campos[1::2]))
+        seq = campos.get(b"_seq", campos.get("_seq"))
+        features = self._decode_cache_entry(campos, transacoes, logins)["data"]
+        
+        derivadas = self._calcular_derivadas(features)
+        esquemas = self._vector_schemas()
+        self._write_derived_script(
+            keys=[self._cache_keys(user_id)[0]] + [self._vector_key(user_id, esquema) for esquema in esquemas],
+            args=[
+                seq,
+                json.dumps({campo: json.dumps(valor) for campo, valor in derivadas.items()}),
+                settings.FEATURE_CACHE_TTL_SECONDS
+            ] + [self._build_vector({**features, **derivadas}, nomes) for nomes in esquemas.values()]
+        )
+    
+    def _event_operations(
+        self,
+        event_type: str,
+        event_data: Dict[str, Any],
+        now: datetime
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Traduz um evento nas operações atômicas a aplicar: incrementos de
+        contadores, valores a sobrescrever, itens a inserir nos históricos e
+        marcação da última transação. Retorna None para eventos desconhecidos.
+        """
+        operacoes = {"incr": {}, "set": {}}
         # Atualiza históricos e features conforme o tipo de evento
         if event_type == "pix_payment":
-            transacao = {
-                "timestamp": now,
+            operacoes["push_transacao"] = {
+                "timestamp": now.isoformat(),
                 "valor": event_data.get("amount", 0),
                 "categoria": event_data.get("categoria", "pix"),
                 "reembolsada": event_data.get("reembolsada", False),
                 "chargeback": False
             }
-            historico_transacoes.append(transacao)
-            historico_transacoes = historico_transacoes[-self.HISTORICO_TRANSACOES:]
-            features["pix_volume"] = features.get("pix_volume", 0.0) + event_data.get("amount", 0)
-            features["total_transactions"] = features.get("total_transactions", 0) + 1
-            features["last_transaction_date"] = now.isoformat()
-            features["avg_transaction_value"] = features["pix_volume"] / features["total_transactions"]
+            operacoes["incr"]["pix_volume"] = event_data.get("amount", 0)
+            operacoes["incr"]["total_transactions"] = 1
+            operacoes["set"]["last_transaction_date"] = now.isoformat()
         elif event_type == "chargeback":
             # Marca a última transação como chargeback
-            if historico_transacoes:
-                historico_transacoes[-1]["chargeback"] = True
-            features["total_chargebacks"] = features.get("total_chargebacks", 0) + 1
-            features["chargeback_rate"] = features["total_chargebacks"] / features.get("total_transactions", 1)
+            operacoes["marcar_ultima_transacao"] = "chargeback"
+            operacoes["incr"]["total_chargebacks"] = 1
         elif event_type == "refund":
             # Marca a última transação como reembolsada
-            if historico_transacoes:
-                historico_transacoes[-1]["reembolsada"] = True
+            operacoes["marcar_ultima_transacao"] = "reembolsada"
         elif event_type == "app_connection":
-            features["app_connections"] = features.get("app_connections", 0) + 1
+            operacoes["incr"]["app_connections"] = 1
         elif event_type == "login":
-            login = {
-                "timestamp": now,
+            operacoes["push_login"] = {
+                "timestamp": now.isoformat(),
                 "device_id": event_data.get("device_id", "unknown"),
                 "cidade": event_data.get("cidade", ""),
                 "estado": event_data.get("estado", "")
             }
-            historico_logins.append(login)
-            historico_logins = historico_logins[-self.HISTORICO_LOGINS:]
-        # Atualiza históricos
-        features["historico_transacoes"] = historico_transacoes
-        features["historico_logins"] = historico_logins
-        # Recalcula features comportamentais avançadas
-        features["tempo_medio_entre_transacoes"] = self.calcular_tempo_medio_entre_transacoes(historico_transacoes)
-        features["variacao_categoria_uso"] = self.calcular_variacao_categoria_uso(historico_transacoes)
-        features["geodispersao_ips"] = self.calcular_geodispersao_ips(historico_logins)
-        features["frequencia_reembolsos"] = self.calcular_frequencia_reembolsos(historico_transacoes)
-        features["mudanca_subita_device"] = self.calcular_mudanca_subita_device(historico_logins)
-        features["dias_desde_ultima_transacao"] = self.calcular_dias_desde_ultima_transacao(historico_transacoes)
-        features["total_chargebacks"] = self.calcular_total_chargebacks(historico_transacoes)
-        features["media_valor_reembolsos"] = self.calcular_media_valor_reembolsos(historico_transacoes)
-        await self.update_features(user_id, features)
+        else:
+            return None
+        return operacoes
+    
+    def _apply_operations_db(self, db: Session, user_id: str, operacoes: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Aplica as operações no PostgreSQL sobre a linha travada, recalcula as
+        derivadas e grava o resultado com uma única escrita. Retorna as
+        features resultantes; a trava vale até o commit de db.
+        """
+        atual = db.execute(text(LOCK_FEATURES_SQL), {"user_id": user_id}).scalar()
+        if atual is None:
+            features = self._com_derivadas(self._apply_operations(self._get_default_features(), operacoes))
+            inserida = db.execute(text(INSERT_FEATURES_SQL), {
+                "user_id": user_id,
+                "features": json.dumps(features)
+            }).rowcount
+            if inserida:
+                return features
+            atual = db.execute(text(LOCK_FEATURES_SQL), {"user_id": user_id}).scalar()
+        
+        features = self._com_derivadas(self._apply_operations(atual, operacoes))
+        db.execute(text(WRITE_FEATURES_SQL), {"user_id": user_id, "features": json.dumps(features)})
+        return features
+    
+    def _apply_operations(self, features: Dict[str, Any], operacoes: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Aplica as operações de um evento sobre um dicionário de features, com a
+        mesma semântica do APPLY_OPERATIONS_SCRIPT. Retorna um novo dicionário.
+        """
+        features = dict(features)
+        for campo, valor in operacoes["incr"].items():
+            features[campo] = (features.get(campo) or 0) + valor
+        features.update(operacoes["set"])
+        for chave, campo, limite in (
+            ("push_transacao", "historico_transacoes", self.HISTORICO_TRANSACOES),
+            ("push_login", "historico_logins", self.HISTORICO_LOGINS)
+        ):
+            features[campo] = list(features.get(campo) or [])
+            if chave in operacoes:
+                features[campo] = (features[campo] + [operacoes[chave]])[-limite:]
+        if "marcar_ultima_transacao" in operacoes and features["historico_transacoes"]:
+            ultima = {**features["historico_transacoes"][-1], operacoes["marcar_ultima_transacao"]: True}
+            features["historico_transacoes"][-1] = ultima
+        return features
+    
+    def _com_derivadas(self, features: Dict[str, Any]) -> Dict[str, Any]:
+        return {**features, **self._calcular_derivadas(features)}
+    
+    def _apply_operations_cache(
+        self,
+        user_id: str,
+        operacoes: Dict[str, Any],
+        retornar_estado: bool = False,
+        marcar_sujo: bool = False,
+        client=None
+    ):
+        """
+        Aplica as operações no cache do Redis com um script Lua atômico. Usuários
+        fora do cache são ignorados: a próxima leitura reconstrói a partir do banco.
+        Com retornar_estado, devolve o hash e as listas resultantes (ou 0 se o
+        usuário não estava no Redis); com marcar_sujo, inclui o usuário no
+        conjunto de sujos na mesma execução.
+        """
+        argumentos = {
+            "incr": operacoes["incr"],
+            "set": {campo: json.dumps(valor) for campo, valor in operacoes["set"].items()}
+        }
+        for chave in ("push_transacao", "push_login"):
+            if chave in operacoes:
+                argumentos[chave] = json.dumps(operacoes[chave])
+        if "marcar_ultima_transacao" in operacoes:
+            argumentos["marcar_ultima_transacao"] = operacoes["marcar_ultima_transacao"]
+        
+        return self._apply_operations_script(
+            keys=list(self._cache_keys(user_id)) + ([DIRTY_SET_KEY] if marcar_sujo else []),
+            args=[
+                json.dumps(argumentos),
+                self.HISTORICO_TRANSACOES,
+                self.HISTORICO_LOGINS,
+                "1" if retornar_estado else "0",
+                user_id
+            ],
+            client=client
+        )
+    
+    def _calcular_derivadas(self, features: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Recalcula as features derivadas dos contadores e históricos
+        """
+        historico_transacoes = self._com_datetimes(features.get("historico_transacoes", []))
+        historico_logins = self._com_datetimes(features.get("historico_logins", []))
+        total_transactions = features.get("total_transactions", 0)
+        return {
+            "avg_transaction_value": features.get("pix_volume", 0.0) / total_transactions if total_transactions else 0.0,
+            "chargeback_rate": features.get("total_chargebacks", 0) / (total_transactions or 1),
+            # Recalcula features comportamentais avançadas
+            "tempo_medio_entre_transacoes": self.calcular_tempo_medio_entre_transacoes(historico_transacoes),
+            "variacao_categoria_uso": self.calcular_variacao_categoria_uso(historico_transacoes),
+            "geodispersao_ips": self.calcular_geodispersao_ips(historico_logins),
+            "frequencia_reembolsos": self.calcular_frequencia_reembolsos(historico_transacoes),
+            "mudanca_subita_device": self.calcular_mudanca_subita_device(historico_logins),
+            "dias_desde_ultima_transacao": self.calcular_dias_desde_ultima_transacao(historico_transacoes),
+            "media_valor_reembolsos": self.calcular_media_valor_reembolsos(historico_transacoes)
+        }
+    
+    def sync_feature_columns(self, db: Session, features_por_usuario: Dict[str, Dict[str, Any]]):
+        """
+        Espelha as features na tabela tipada (user_feature_columns) e nos
+        históricos normalizados (user_feature_history), em lote e dentro da
+        transação de db. Os históricos dos usuários são substituídos por
+        inteiro, então a chamada é feita por lotes (snapshotter e backfill),
+        não a cada evento.
+        """
+        if not features_por_usuario:
+            return
+        
+        linhas = []
+        historicos = []
+        for user_id, features in features_por_usuario.items():
+            linha = {"user_id": user_id}
+            for coluna in FEATURE_COLUMNS:
+                linha[coluna] = features.get(coluna)
+            linha["last_transaction_date"] = self._parse_timestamp(linha["last_transaction_date"])
+            linhas.append(linha)
+            
+            for tipo, campo in (("transacao", "historico_transacoes"), ("login", "historico_logins")):
+                for posicao, item in enumerate(features.get(campo) or []):
+                    historicos.append({
+                        "user_id": user_id,
+                        "tipo": tipo,
+                        "posicao": posicao,
+                        "timestamp": self._parse_timestamp(item.get("timestamp")),
+                        "valor": item.get("valor"),
+                        "categoria": item.get("categoria"),
+                        "reembolsada": item.get("reembolsada"),
+                        "chargeback": item.get("chargeback"),
+                        "device_id": item.get("device_id"),
+                        "cidade": item.get("cidade"),
+                        "estado": item.get("estado")
+                    })
+        
+        stmt = insert(UserFeatureColumns.__table__).values(linhas)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["user_id"],
+            set_={**{c: stmt.excluded[c] for c in FEATURE_COLUMNS}, "last_updated": func.now()}
+        )
+        db.execute(stmt)
+        db.execute(delete(UserFeatureHistory.__table__).where(
+            UserFeatureHistory.user_id.in_(list(features_por_usuario))
+        ))
+        if historicos:
+            db.execute(UserFeatureHistory.__table__.insert(), historicos)
+    
+    def iter_feature_matrix(
+        self,
+        colunas: Optional[List[str]] = None,
+        tamanho_lote: int = 10000
+    ) -> Iterator[Tuple[List[str], np.ndarray]]:
+        """
+        Lê a tabela tipada com cursor no servidor e entrega cada lote como
+        (user_ids, matriz float64 de len(user_ids) x len(colunas)). Valores nulos
+        viram NaN.
+        """
+        colunas = colunas or [c for c in FEATURE_COLUMNS if c != "last_transaction_date"]
+        tabela = UserFeatureColumns.__table__
+        consulta = select(tabela.c.user_id, *[tabela.c[c] for c in colunas]).order_by(tabela.c.user_id)
+        
+        with batch_engine.connect() as conn:
+            resultado = conn.execution_options(stream_results=True, yield_per=tamanho_lote).execute(consulta)
+            for lote in resultado.partitions():
+                user_ids = [linha[0] for linha in lote]
+                matriz = np.array([linha[1:] for linha in lote], dtype=np.float64)
+                yield user_ids, matriz
+    
+    def _parse_timestamp(self, valor: Any) -> Optional[datetime]:
+        """
+        Converte timestamps ISO em datetime, mantendo None e datetimes
+        """
+        if isinstance(valor, str):
+            return datetime.fromisoformat(valor)
+        return valor
+    
+    def _com_datetimes(self, historico: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Converte os timestamps ISO dos históricos em datetime para os cálculos
+        """
+        return [
+            {**item, "timestamp": datetime.fromisoformat(item["timestamp"])}
+            if isinstance(item.get("timestamp"), str) else item
+            for item in historico
+        ]
     
     # Funções utilitárias para cálculo das novas features
     def calcular_tempo_medio_entre_transacoes(self, transacoes):
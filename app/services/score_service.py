@@ -1,21 +1,118 @@
+import os
+import threading
+import time
+
 import mlflow
 import shap
 import numpy as np
 from datetime import datetime
-from typing import Dict, Any, List, Tuple
+from typing import Dict, Any, List, Optional, Sequence, Tuple
 import pandas as pd
 from sqlalchemy.orm import Session
 
 from app.core.config import settings
-from app.db.session import get_db
+from app.core.logger import setup_logger
+from app.core.metrics import medir_etapa, SCORE_BATCH_SIZE
+from app.core.resilience import CircuitBreaker, CircuitOpenError
+from app.db.routing import read_router
+from app.db.session import get_db, postgres_breaker
 from app.models.score import Score
 from app.models.score_contest import ScoreContest
 
+logger = setup_logger('score_service')
+
+DESCRIPTION_TEMPLATE = "O valor de {} ({:.2f}) {} {} o score"
+IMPACTO_SIGNIFICATIVO = 0.1
+
+mlflow_breaker = CircuitBreaker("mlflow")
+
+def build_explanations(
+    feature_names: Sequence[str],
+    values: np.ndarray,
+    shap_values: np.ndarray,
+    top_k: Optional[int] = None
+) -> List[List[Dict[str, Any]]]:
+    """
+    Monta as explicações de um lote a partir das matrizes (n, k) de valores e
+    de SHAP. Com top_k, seleciona por linha as K features de maior |impacto|
+    (argpartition, ordenadas por impacto); sem top_k, mantém a ordem das
+    colunas. Direção e magnitude são classificadas de forma vetorizada e as
+    descrições só são formatadas para as features selecionadas.
+    """
+    values = np.atleast_2d(np.asarray(values, dtype=np.float64))
+    shap_values = np.atleast_2d(np.asarray(shap_values, dtype=np.float64))
+    n, k = shap_values.shape
+    magnitudes = np.abs(shap_values)
+
+    if top_k and top_k < k:
+        indices = np.argpartition(-magnitudes, top_k - 1, axis=1)[:, :top_k]
+        ordem = np.argsort(-np.take_along_axis(magnitudes, indices, axis=1), axis=1, kind="stable")
+        indices = np.take_along_axis(indices, ordem, axis=1)
+    else:
+        indices = np.broadcast_to(np.arange(k), (n, k))
+
+    valores = np.take_along_axis(values, indices, axis=1)
+    impactos = np.take_along_axis(shap_values, indices, axis=1)
+    direcoes = np.where(impactos > 0, "aumentou", "diminuiu")
+    intensidades = np.where(np.abs(impactos) > IMPACTO_SIGNIFICATIVO, "significativamente", "levemente")
+    nomes = np.asarray(feature_names, dtype=object)[indices]
+
+    return [
+        [
+            {
+                "feature": feature,
+                "value": value,
+                "impact": impact,
+                "description": DESCRIPTION_TEMPLATE.format(feature, value, direcao, intensidade)
+            }
+            for feature, value, impact, direcao, intensidade in zip(*linha)
+        ]
+        for linha in zip(
+            nomes.tolist(), valores.tolist(), impactos.tolist(),
+            direcoes.tolist(), intensidades.tolist()
+        )
+    ]
+
 class ScoreService:
     def __init__(self):
+        # O cliente HTTP do MLflow lê o timeout e as tentativas do ambiente
+        os.environ.setdefault("MLFLOW_HTTP_REQUEST_TIMEOUT", str(settings.MLFLOW_HTTP_TIMEOUT_SECONDS))
+        os.environ.setdefault("MLFLOW_HTTP_REQUEST_MAX_RETRIES", str(settings.MLFLOW_HTTP_MAX_RETRIES))
         mlflow.set_tracking_uri(settings.MLFLOW_TRACKING_URI)
-        self.model = self._load_model()
-        self.explainer = self._create_explainer()
+        self.model = None
+        self.explainer = None
+        # O modelo é carregado fora do caminho das requisições: com o MLflow
+        # fora do ar, a partida não trava nem falha
+        threading.Thread(target=self._carregar_em_segundo_plano, name="mlflow_loader", daemon=True).start()
+    
+    def refresh_model(self) -> bool:
+        """
+        Recarrega o modelo do MLflow. Em caso de falha (ou com o circuito
+        aberto), mantém o modelo já carregado e retorna False.
+        """
+        try:
+            with mlflow_breaker.guard():
+                model = self._load_model()
+            explainer = self._create_explainer(model)
+        except Exception as e:
+            logger.warning(f"Não foi possível carregar o modelo do MLflow: {str(e)}")
+            return False
+        self.model, self.explainer = model, explainer
+        return True
+    
+    def _carregar_em_segundo_plano(self):
+        while not self.refresh_model():
+            time.sleep(settings.CIRCUIT_RESET_TIMEOUT_SECONDS)
+    
+    def _explainer_carregado(self):
+        """
+        Explicador do último modelo carregado; sem nenhum, falha na hora em vez
+        de chamar o MLflow no caminho da requisição
+        """
+        explainer = self.explainer
+        if explainer is None:
+            raise CircuitOpenError("Modelo do MLflow ainda não carregado")
+        return explainer
     
     def _load_model(self):
         """
@@ -39,7 +136,7 @@ class ScoreService:
         best_run = runs[0]
         return mlflow.pyfunc.load_model(f"runs:/{best_run.info.run_id}/model")
     
-    def _create_explainer(self):
+    def _create_explainer(self, model):
         """
         Cria o explicador SHAP para o modelo
         """
@@ -51,8 +148,9 @@ class ScoreService:
             'chargeback_rate': np.random.normal(0.01, 0.005, 1000),
             'app_connections': np.random.normal(3, 1, 1000)
         })
+        self.feature_names = list(background_data.columns)
         
-        return shap.TreeExplainer(self.model, background_data)
+        return shap.TreeExplainer(model, background_data)
     
     async def calculate_score(
         self,
@@ -62,34 +160,70 @@ class ScoreService:
         """
         Calcula o score e gera explicação usando SHAP
         """
+        explainer = self._explainer_carregado()
+        SCORE_BATCH_SIZE.labels(model_version="mlflow").observe(1)
+        
         # Converte features para DataFrame
-        feature_df = pd.DataFrame([features])
+        with medir_etapa("feature_assembly", "mlflow"):
+            feature_df = pd.DataFrame([features])
         
         # Calcula o score
-        score = float(self.model.predict(feature_df)[0])
+        with medir_etapa("model_inference", "mlflow"):
+            score = float(self.model.predict(feature_df)[0])
         
         # Gera explicação SHAP
-        shap_values = self.explainer.shap_values(feature_df)
-        
-        # Formata a explicação
-        explanation = []
-        for feature, value, shap_value in zip(
-            feature_df.columns,
-            feature_df.iloc[0],
-            shap_values[0]
-        ):
-            explanation.append({
-                "feature": feature,
-                "value": float(value),
-                "impact": float(shap_value),
-                "description": self._get_feature_description(feature, value, shap_value)
-            })
+        with medir_etapa("shap", "mlflow"):
+            explanation = build_explanations(
+                list(feature_df.columns),
+                feature_df.to_numpy(dtype=np.float64),
+                self._shap_matrix(feature_df, explainer),
+                top_k=settings.SCORE_EXPLANATION_TOP_K or None
+            )[0]
         
         # Salva o score no banco
-        await self._save_score(user_id, score, features, explanation)
+        with medir_etapa("persistence", "mlflow"):
+            await self._save_score(user_id, score, features, explanation)
         
         return score, explanation
     
+    async def generate_explanation(
+        self,
+        features: Dict[str, Any],
+        score: float,
+        top_k: int = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Gera a explicação SHAP de um score já calculado, sobre as features do
+        modelo. Com top_k, retorna só as K features de maior impacto absoluto.
+        """
+        return (await self.generate_explanations([features], top_k=top_k))[0]
+    
+    async def generate_explanations(
+        self,
+        features_batch: List[Dict[str, Any]],
+        top_k: int = None
+    ) -> List[List[Dict[str, Any]]]:
+        """
+        Gera as explicações de um lote de usuários com uma única chamada ao SHAP
+        """
+        explainer = self._explainer_carregado()
+        matriz = np.array(
+            [[features.get(nome, 0.0) for nome in self.feature_names] for features in features_batch],
+            dtype=np.float64
+        ).reshape(len(features_batch), len(self.feature_names))
+        feature_df = pd.DataFrame(matriz, columns=self.feature_names)
+        return build_explanations(self.feature_names, matriz, self._shap_matrix(feature_df, explainer), top_k=top_k)
+    
+    def _shap_matrix(self, feature_df: pd.DataFrame, explainer) -> np.ndarray:
+        """
+        Valores SHAP como matriz (n, k); para classificadores com uma matriz
+        por classe, usa a da classe positiva
+        """
+        shap_values = explainer.shap_values(feature_df)
+        if isinstance(shap_values, list):
+            shap_values = shap_values[-1]
+        return np.asarray(shap_values)
+    
     def _get_feature_description(
         self,
         feature: str,
@@ -100,9 +234,9 @@ class ScoreService:
         Gera uma descrição legível do impacto de uma feature
         """
         impact_direction = "aumentou" if impact > 0 else "diminuiu"
-        impact_magnitude = "significativamente" if abs(impact) > 0.1 else "levemente"
+        impact_magnitude = "significativamente" if abs(impact) > IMPACTO_SIGNIFICATIVO else "levemente"
         
-        return f"O valor de {feature} ({value:.2f}) {impact_direction} {impact_magnitude} o score"
+        return DESCRIPTION_TEMPLATE.format(feature, value, impact_direction, impact_magnitude)
     
     async def _save_score(
         self,
@@ -123,16 +257,22 @@ class ScoreService:
             timestamp=datetime.utcnow()
         )
         db.add(score_record)
-        db.commit()
+        with postgres_breaker.guard():
+            db.commit()
+        # O próximo histórico deste usuário não pode vir de réplica sem este score
+        read_router.mark_write([user_id])
     
     async def get_score_history(self, user_id: str) -> List[Dict[str, Any]]:
         """
-        Retorna o histórico de scores de um usuário
+        Retorna o histórico de scores de um usuário, lido de uma réplica
+        quando houver uma em dia
         """
-        db = next(get_db())
-        scores = db.query(Score).filter(
-            Score.user_id == user_id
-        ).order_by(Score.timestamp.desc()).all()
+        scores = read_router.run(
+            lambda db: db.query(Score).filter(
+                Score.user_id == user_id
+            ).order_by(Score.timestamp.desc()).all(),
+            user_ids=[user_id]
+        )
         
         return [
             {
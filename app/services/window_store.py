@@ -0,0 +1,194 @@
+from typing import Dict, Any, List, Optional, Tuple
+from datetime import datetime, timezone
+import json
+import time
+
+import numpy as np
+from prometheus_client import Counter
+
+# Métricas acumuladas em cada bucket, na ordem em que são guardadas
+METRICAS = ("transacoes", "valor_transacoes", "chargebacks", "reembolsos", "logins", "app_connections")
+
+# Anéis de buckets por granularidade: nome da janela -> (segundos por bucket, buckets).
+# Cada anel cobre a sua janela deslizante com a resolução de um bucket.
+JANELAS = {
+    "1h": (300, 12),
+    "24h": (3600, 24),
+    "30d": (86400, 30),
+}
+
+# Features calculadas a partir das janelas no instante da leitura
+FEATURE_NAMES = tuple(f"{m}_{janela}" for janela in JANELAS for m in METRICAS) + (
+    "dias_ativos_30d", "ticket_medio_30d", "chargeback_rate_30d", "taxa_reembolso_30d"
+)
+
+# Incremento de cada tipo de evento nas métricas dos buckets
+INCREMENTOS = {
+    "pix_payment": lambda dados: {"transacoes": 1, "valor_transacoes": dados.get("amount", 0)},
+    "chargeback": lambda dados: {"chargebacks": 1},
+    "refund": lambda dados: {"reembolsos": 1},
+    "login": lambda dados: {"logins": 1},
+    "app_connection": lambda dados: {"app_connections": 1},
+}
+
+WINDOW_EVENTS = Counter(
+    'feature_window_events_total',
+    'Eventos aplicados nas janelas de tempo de evento',
+    ['result']  # applied, late (mais antigo que todas as janelas)
+)
+
+# Soma o evento no bucket da sua época em cada anel. O slot é reutilizado em
+# O(1): se guarda uma época mais antiga, é zerado; se guarda uma mais nova, o
+# evento chegou tarde demais para este anel e é ignorado.
+# KEYS: um hash por anel (slot -> [época, métricas...] em JSON)
+# ARGV: incrementos em JSON, quantidade de métricas e, por anel, época, slot e TTL
+WINDOW_UPDATE_SCRIPT = """
+local incr = cjson.decode(ARGV[1])
+local n_metricas = tonumber(ARGV[2])
+local aplicados = 0
+for i, chave in ipairs(KEYS) do
+    local epoca = tonumber(ARGV[i * 3])
+    local slot = ARGV[i * 3 + 1]
+    local atual = redis.call('HGET', chave, slot)
+    local bucket = atual and cjson.decode(atual)
+    if not bucket or bucket[1] < epoca then
+        bucket = {epoca}
+        for m = 1, n_metricas do
+            bucket[m + 1] = 0
+        end
+    end
+    if bucket[1] == epoca then
+        for m = 1, n_metricas do
+            bucket[m + 1] = (bucket[m + 1] or 0) + incr[m]
+        end
+        redis.call('HSET', chave, slot, cjson.encode(bucket))
+        aplicados = aplicados + 1
+    end
+    redis.call('EXPIRE', chave, tonumber(ARGV[i * 3 + 2]))
+end
+return aplicados
+"""
+
+def _epoch(instante: datetime) -> float:
+    """
+    Segundos desde a época Unix; datetimes sem fuso são tratados como UTC
+    """
+    if instante.tzinfo is None:
+        instante = instante.replace(tzinfo=timezone.utc)
+    return instante.timestamp()
+
+class WindowStore:
+    """
+    Janelas de tempo de evento por usuário no Redis: para cada granularidade,
+    um anel de tamanho fixo de buckets com contagens e somas. Eventos fora de
+    ordem caem no bucket do seu próprio instante, buckets vencidos são
+    reaproveitados sem varredura e a memória por usuário é constante.
+    """
+    def __init__(self, redis_client):
+        self.redis_client = redis_client
+        self._update_script = redis_client.register_script(WINDOW_UPDATE_SCRIPT)
+
+    def _keys(self, user_id: str) -> List[str]:
+        # Hash tag do usuário: os anéis ficam no mesmo nó que as suas features
+        return [f"user_windows:{{{user_id}}}:{janela}" for janela in JANELAS]
+
+    def record(self, user_id: str, event_type: str, event_data: Dict[str, Any], instante: datetime, agora: float = None) -> int:
+        """
+        Soma um evento nas janelas e retorna em quantos anéis ele foi aplicado
+        (0 para tipos sem métricas ou eventos mais antigos que todas as janelas)
+        """
+        incremento = INCREMENTOS.get(event_type)
+        if incremento is None:
+            return 0
+        valores = incremento(event_data)
+        agora = agora or time.time()
+        # Relógios adiantados não criam buckets no futuro
+        segundos = min(_epoch(instante), agora)
+
+        keys, args = [], []
+        for chave, (tamanho, n_buckets) in zip(self._keys(user_id), JANELAS.values()):
+            epoca = int(segundos // tamanho)
+            if epoca <= int(agora // tamanho) - n_buckets:
+                continue
+            keys.append(chave)
+            args.extend([epoca, epoca % n_buckets, tamanho * (n_buckets + 1)])
+        if not keys:
+            WINDOW_EVENTS.labels(result="late").inc()
+            return 0
+
+        aplicados = self._update_script(
+            keys=keys,
+            args=[json.dumps([valores.get(m, 0) for m in METRICAS]), len(METRICAS)] + args
+        )
+        WINDOW_EVENTS.labels(result="applied" if aplicados else "late").inc()
+        return aplicados
+
+    def features(self, user_id: str, agora: float = None) -> Dict[str, Any]:
+        return self.features_many([user_id], agora)[user_id]
+
+    def features_many(self, user_ids: List[str], agora: float = None) -> Dict[str, Dict[str, Any]]:
+        """
+        Lê os anéis de vários usuários em um único pipeline e calcula as
+        features de cada janela no instante agora
+        """
+        agora = agora or time.time()
+        pipe = self.redis_client.pipeline(transaction=False)
+        for user_id in user_ids:
+            for chave in self._keys(user_id):
+                pipe.hvals(chave)
+        respostas = iter(pipe.execute())
+
+        resultado = {}
+        for user_id in user_ids:
+            features = {}
+            for janela, (tamanho, n_buckets) in JANELAS.items():
+                totais, ativos = self._somar(next(respostas), int(agora // tamanho), n_buckets)
+                features.update({f"{m}_{janela}": float(v) for m, v in zip(METRICAS, totais)})
+                if janela == "30d":
+                    # Anel diário: buckets com transação são dias com atividade
+                    features["dias_ativos_30d"] = ativos
+            resultado[user_id] = self._derivadas(features)
+        return resultado
+
+    def _somar(self, buckets: List[bytes], epoca_atual: int, n_buckets: int) -> Tuple[np.ndarray, int]:
+        """
+        Soma as métricas dos buckets dentro da janela e conta os buckets com
+        alguma transação
+        """
+        if not buckets:
+            return np.zeros(len(METRICAS)), 0
+        matriz = np.zeros((len(buckets), len(METRICAS) + 1))
+        for i, bucket in enumerate(buckets):
+            valores = json.loads(bucket)[:len(METRICAS) + 1]
+            matriz[i, :len(valores)] = valores
+        na_janela = matriz[:, 0] > epoca_atual - n_buckets
+        dentro = matriz[na_janela, 1:]
+        return dentro.sum(axis=0), int((dentro[:, 0] > 0).sum())
+
+    def _derivadas(self, features: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Taxas sobre a janela de 30 dias
+        """
+        transacoes = features["transacoes_30d"]
+        features["ticket_medio_30d"] = features["valor_transacoes_30d"] / transacoes if transacoes else 0.0
+        features["chargeback_rate_30d"] = features["chargebacks_30d"] / transacoes if transacoes else 0.0
+        features["taxa_reembolso_30d"] = features["reembolsos_30d"] / transacoes if transacoes else 0.0
+        return features
+
+def event_time(event: Dict[str, Any]) -> Optional[datetime]:
+    """
+    Instante do evento (campo "timestamp" em ISO ou segundos Unix), se houver
+    e for válido; um timestamp malformado não derruba o evento
+    """
+    valor = event.get("timestamp")
+    try:
+        if isinstance(valor, (int, float)):
+            return datetime.utcfromtimestamp(valor)
+        if isinstance(valor, str):
+            instante = datetime.fromisoformat(valor.replace("Z", "+00:00"))
+            if instante.tzinfo is not None:
+                instante = instante.astimezone(timezone.utc).replace(tzinfo=None)
+            return instante
+    except (ValueError, OverflowError, OSError):
+        return None
+    return None
@@ -0,0 +1,321 @@
+import os
+
+from app.core.config import settings
+
+# Supervisor e consumers escrevem as métricas em arquivos compartilhados, que o
+# supervisor agrega; precisa estar definido antes do import do prometheus_client
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", settings.PROMETHEUS_MULTIPROC_DIR)
+os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"], exist_ok=True)
+
+import asyncio
+import json
+import logging
+import multiprocessing
+import signal
+import time
+from typing import Dict, List, Tuple
+
+from kafka import ConsumerRebalanceListener, KafkaConsumer, KafkaProducer, TopicPartition
+from kafka.coordinator.assignors.sticky.sticky_assignor import StickyPartitionAssignor
+from kafka.structs import OffsetAndMetadata
+from prometheus_client import CollectorRegistry, Counter, Gauge, multiprocess, start_http_server
+
+from app.core.metrics import mark_process_dead
+from app.services.feature_service import FeatureService
+from app.workers.event_consumer import EventConsumer, TOPIC
+
+# Configuração do logging
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(processName)s %(levelname)s %(message)s")
+logger = logging.getLogger(__name__)
+
+# Métricas por partição; cada partição pertence a um processo por vez, então o
+# valor agregado é o do processo vivo que a detém (os demais ficam em 0)
+CONSUMER_EVENTS = Counter(
+    'consumer_events_total',
+    'Eventos processados por partição',
+    ['partition']
+)
+
+CONSUMER_EVENTS_RATE = Gauge(
+    'consumer_events_per_second',
+    'Eventos por segundo por partição no último intervalo',
+    ['partition'],
+    multiprocess_mode='livemax'
+)
+
+CONSUMER_LAG = Gauge(
+    'consumer_partition_lag',
+    'Mensagens ainda não processadas por partição',
+    ['partition'],
+    multiprocess_mode='livemax'
+)
+
+CONSUMER_FAILURES = Counter(
+    'consumer_event_failures_total',
+    'Falhas ao processar eventos, por partição e destino',
+    ['partition', 'result']  # retry (reentregue), dead_letter (enviado ao CONSUMER_DLQ_TOPIC)
+)
+
+CONSUMER_RESTARTS = Counter(
+    'consumer_process_restarts_total',
+    'Processos consumers reiniciados pelo supervisor após falha'
+)
+
+CONSUMER_ALIVE = Gauge(
+    'consumer_processes_alive',
+    'Processos consumers vivos',
+    multiprocess_mode='livesum'
+)
+
+class _RebalanceListener(ConsumerRebalanceListener):
+    def __init__(self, worker: "PartitionedEventConsumer"):
+        self.worker = worker
+
+    def on_partitions_revoked(self, revoked):
+        self.worker.flush(revoked)
+
+    def on_partitions_assigned(self, assigned):
+        logger.info(f"Partições atribuídas: {sorted(tp.partition for tp in assigned)}")
+
+class PartitionedEventConsumer(EventConsumer):
+    """
+    Consumer de um processo da frota: recebe um subconjunto das partições do
+    grupo, processa em lotes e faz commit manual dos offsets já processados,
+    inclusive de forma síncrona quando perde partições num rebalanceamento.
+    Um evento que falha interrompe a sua partição: o commit não passa dele e
+    ele é reentregue até CONSUMER_MAX_ATTEMPTS vezes, depois vai para o
+    CONSUMER_DLQ_TOPIC.
+    """
+    def __init__(self, indice: int):
+        self.indice = indice
+        self.consumer = KafkaConsumer(
+            bootstrap_servers=settings.KAFKA_BOOTSTRAP_SERVERS,
+            group_id=settings.KAFKA_CONSUMER_GROUP,
+            client_id=f"{settings.KAFKA_CONSUMER_GROUP}-{indice}",
+            auto_offset_reset='latest',
+            enable_auto_commit=False,
+            # Sticky: reinícios e rebalanceamentos movem o mínimo de partições
+            partition_assignment_strategy=[StickyPartitionAssignor],
+            value_deserializer=lambda x: json.loads(x.decode('utf-8'))
+        )
+        self.consumer.subscribe([TOPIC], listener=_RebalanceListener(self))
+        self.feature_service = FeatureService(settings.REDIS_BATCH_SOCKET_TIMEOUT_MS)
+        self._processados: Dict[TopicPartition, OffsetAndMetadata] = {}
+        self._novos: Dict[TopicPartition, OffsetAndMetadata] = {}
+        self._contagem: Dict[TopicPartition, int] = {}
+        self._tentativas: Dict[TopicPartition, Tuple[int, int]] = {}  # (offset que falhou, tentativas)
+        self._produtor = None
+        self._parar = False
+
+    def stop(self, *args):
+        self._parar = True
+
+    def flush(self, particoes: List[TopicPartition] = None):
+        """
+        Commit síncrono dos offsets processados (das partições informadas ou de
+        todas), antes que outro processo assuma essas partições
+        """
+        particoes = list(self._processados) if particoes is None else particoes
+        offsets = {tp: self._processados[tp] for tp in particoes if tp in self._processados}
+        if offsets:
+            self.consumer.commit(offsets)
+        for tp in particoes:
+            self._processados.pop(tp, None)
+            self._novos.pop(tp, None)
+            self._contagem.pop(tp, None)
+            self._tentativas.pop(tp, None)
+            CONSUMER_LAG.labels(partition=str(tp.partition)).set(0)
+            CONSUMER_EVENTS_RATE.labels(partition=str(tp.partition)).set(0)
+
+    async def _processar(self, tp: TopicPartition, mensagem) -> bool:
+        """
+        Processa um evento e diz se a partição pode avançar além dele: sim se
+        foi aplicado ou, esgotadas as tentativas, enviado ao tópico de dead letter
+        """
+        try:
+            await self.feature_service.process_event(mensagem.value)
+            self._tentativas.pop(tp, None)
+            return True
+        except Exception as e:
+            offset, tentativas = self._tentativas.get(tp, (mensagem.offset, 0))
+            tentativas = tentativas + 1 if offset == mensagem.offset else 1
+            self._tentativas[tp] = (mensagem.offset, tentativas)
+            logger.error(f"Erro no evento {tp.partition}:{mensagem.offset} (tentativa {tentativas}): {str(e)}")
+        if tentativas < settings.CONSUMER_MAX_ATTEMPTS:
+            CONSUMER_FAILURES.labels(partition=str(tp.partition), result="retry").inc()
+            return False
+        try:
+            self._dead_letter(tp, mensagem)
+        except Exception as e:
+            logger.error(f"Evento {tp.partition}:{mensagem.offset} não enviado ao dead letter: {str(e)}")
+            return False
+        self._tentativas.pop(tp, None)
+        CONSUMER_FAILURES.labels(partition=str(tp.partition), result="dead_letter").inc()
+        return True
+
+    def _dead_letter(self, tp: TopicPartition, mensagem):
+        """
+        Publica o evento no tópico de dead letter e espera a confirmação
+        """
+        if self._produtor is None:
+            self._produtor = KafkaProducer(
+                bootstrap_servers=settings.KAFKA_BOOTSTRAP_SERVERS,
+                value_serializer=lambda x: json.dumps(x).encode('utf-8')
+            )
+        self._produtor.send(
+            settings.CONSUMER_DLQ_TOPIC,
+            value=mensagem.value,
+            headers=[("origem", f"{tp.topic}:{tp.partition}:{mensagem.offset}".encode())]
+        ).get(timeout=10)
+
+    def _atualizar_metricas(self, intervalo: float):
+        """
+        Lag (fim da partição menos a posição do consumer) e eventos/s por partição
+        """
+        atribuidas = list(self.consumer.assignment())
+        if not atribuidas:
+            return
+        fins = self.consumer.end_offsets(atribuidas)
+        for tp in atribuidas:
+            particao = str(tp.partition)
+            CONSUMER_LAG.labels(partition=particao).set(max(fins[tp] - self.consumer.position(tp), 0))
+            CONSUMER_EVENTS_RATE.labels(partition=particao).set(self._contagem.pop(tp, 0) / intervalo)
+
+    async def start(self):
+        """
+        Consome até receber SIGTERM/SIGINT
+        """
+        logger.info(f"Iniciando consumer {self.indice} (pid {os.getpid()})...")
+        ultima_medicao = time.monotonic()
+        try:
+            while not self._parar:
+                lotes = self.consumer.poll(timeout_ms=500, max_records=settings.CONSUMER_POLL_MAX_RECORDS)
+                falhou = False
+                for tp, mensagens in lotes.items():
+                    processadas = 0
+                    for mensagem in mensagens:
+                        if not await self._processar(tp, mensagem):
+                            break
+                        processadas += 1
+                    if processadas < len(mensagens):
+                        # O próximo poll começa no evento que falhou
+                        self.consumer.seek(tp, mensagens[processadas].offset)
+                        falhou = True
+                    if not processadas:
+                        continue
+                    offset = OffsetAndMetadata(mensagens[processadas - 1].offset + 1, None)
+                    self._processados[tp] = self._novos[tp] = offset
+                    self._contagem[tp] = self._contagem.get(tp, 0) + processadas
+                    CONSUMER_EVENTS.labels(partition=str(tp.partition)).inc(processadas)
+
+                if self._novos:
+                    self.consumer.commit_async(dict(self._novos))
+                    self._novos.clear()
+                if falhou:
+                    await asyncio.sleep(settings.CONSUMER_RETRY_BACKOFF_MS / 1000)
+
+                agora = time.monotonic()
+                if agora - ultima_medicao >= settings.CONSUMER_METRICS_INTERVAL_SECONDS:
+                    self._atualizar_metricas(agora - ultima_medicao)
+                    ultima_medicao = agora
+        finally:
+            self.flush()
+            self.consumer.close(autocommit=False)
+            if self._produtor is not None:
+                self._produtor.close()
+            logger.info(f"Consumer {self.indice} encerrado")
+
+def _run_consumer(indice: int):
+    """
+    Ponto de entrada de cada processo filho
+    """
+    worker = PartitionedEventConsumer(indice)
+    signal.signal(signal.SIGTERM, worker.stop)
+    signal.signal(signal.SIGINT, worker.stop)
+    asyncio.run(worker.start())
+
+class ConsumerFleet:
+    """
+    Supervisor: mantém N processos consumers no mesmo grupo, reinicia os que
+    falham (com backoff exponencial) e expõe as métricas agregadas de todos
+    """
+    def __init__(self, n_processos: int = None):
+        self.n_processos = n_processos or settings.CONSUMER_PROCESSES or os.cpu_count()
+        self._ctx = multiprocessing.get_context("spawn")
+        self._processos: Dict[int, multiprocessing.Process] = {}
+        self._iniciado_em: Dict[int, float] = {}
+        self._falhas: Dict[int, int] = {}
+        self._reiniciar_em: Dict[int, float] = {}
+        self._parar = False
+
+    def _iniciar(self, indice: int):
+        processo = self._ctx.Process(target=_run_consumer, args=(indice,), name=f"event-consumer-{indice}")
+        processo.start()
+        self._processos[indice] = processo
+        self._iniciado_em[indice] = time.monotonic()
+
+    def _verificar(self):
+        """
+        Agenda o reinício dos processos que morreram e inicia os já agendados
+        """
+        agora = time.monotonic()
+        for indice, processo in list(self._processos.items()):
+            if processo.is_alive():
+                continue
+            del self._processos[indice]
+            mark_process_dead(processo.pid)
+            # Um processo que rodou por um minuto zera o backoff
+            if agora - self._iniciado_em[indice] >= 60:
+                self._falhas[indice] = 0
+            self._falhas[indice] = self._falhas.get(indice, 0) + 1
+            espera = min(2 ** self._falhas[indice], 60)
+            self._reiniciar_em[indice] = agora + espera
+            logger.error(f"Consumer {indice} saiu com código {processo.exitcode}; reiniciando em {espera}s")
+
+        for indice, quando in list(self._reiniciar_em.items()):
+            if agora >= quando:
+                del self._reiniciar_em[indice]
+                CONSUMER_RESTARTS.inc()
+                self._iniciar(indice)
+        CONSUMER_ALIVE.set(len(self._processos))
+
+    def stop(self, *args):
+        self._parar = True
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry, path=os.environ["PROMETHEUS_MULTIPROC_DIR"])
+        start_http_server(settings.CONSUMER_METRICS_PORT, registry=registry)
+
+        logger.info(f"Iniciando frota de {self.n_processos} consumers...")
+        for indice in range(self.n_processos):
+            self._iniciar(indice)
+        try:
+            while not self._parar:
+                self._verificar()
+                time.sleep(1)
+        finally:
+            self._encerrar()
+
+    def _encerrar(self):
+        """
+        Pede o encerramento a todos (commit dos offsets e saída do grupo) e
+        força a saída de quem não terminar a tempo
+        """
+        for processo in self._processos.values():
+            processo.terminate()
+        prazo = time.monotonic() + settings.CONSUMER_SHUTDOWN_TIMEOUT_SECONDS
+        for processo in self._processos.values():
+            processo.join(max(prazo - time.monotonic(), 0))
+            if processo.is_alive():
+                processo.kill()
+                processo.join()
+            mark_process_dead(processo.pid)
+        CONSUMER_ALIVE.set(0)
+        logger.info("Frota de consumers encerrada")
+
+if __name__ == "__main__":
+    ConsumerFleet().run()
@@ -11,17 +11,19 @@ from app.services.feature_service import FeatureService
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+TOPIC = 'user_events'
+
 class EventConsumer:
     def __init__(self):
         self.consumer = KafkaConsumer(
-            'user_events',
+            TOPIC,
             bootstrap_servers=settings.KAFKA_BOOTSTRAP_SERVERS,
             group_id=settings.KAFKA_CONSUMER_GROUP,
             auto_offset_reset='latest',
             enable_auto_commit=True,
             value_deserializer=lambda x: json.loads(x.decode('utf-8'))
         )
-        self.feature_service = FeatureService()
+        self.feature_service = FeatureService(settings.REDIS_BATCH_SOCKET_TIMEOUT_MS)
     
     async def process_message(self, message: Dict[str, Any]):
         """
@@ -0,0 +1,240 @@
+import argparse
+import asyncio
+import json
+import time
+from typing import List
+import logging
+
+from prometheus_client import Counter, Gauge, Histogram
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.sql import func
+
+from app.core.config import settings
+from app.core.sharding import ShardedRedis, TopologyError, rebalance, shards
+from app.db.session import BatchSessionLocal
+from app.models.user_feature import UserFeature
+from app.services.feature_service import FeatureService, DIRTY_SET_KEY, COLUMNS_DIRTY_SET_KEY
+
+# Configuração do logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Métricas do snapshotter
+SNAPSHOT_USERS = Counter(
+    'feature_snapshot_users_total',
+    'Usuários gravados no PostgreSQL pelo snapshotter'
+)
+
+SNAPSHOT_LATENCY = Histogram(
+    'feature_snapshot_duration_seconds',
+    'Duração de cada lote gravado pelo snapshotter'
+)
+
+SNAPSHOT_MISSING = Counter(
+    'feature_snapshot_missing_users_total',
+    'Usuários sujos sem estado no Redis (chave expulsa ou perdida), mantidos para a próxima tentativa'
+)
+
+SNAPSHOT_DIRTY = Gauge(
+    'feature_snapshot_dirty_users',
+    'Usuários alterados no Redis ainda não gravados no PostgreSQL'
+)
+
+COLUMNS_SYNCED = Counter(
+    'feature_columns_synced_users_total',
+    'Usuários sincronizados nas tabelas tipadas pelo snapshotter (modo postgres)'
+)
+
+COLUMNS_PENDING = Gauge(
+    'feature_columns_pending_users',
+    'Usuários com escritas ainda não refletidas nas tabelas tipadas'
+)
+
+class FeatureSnapshotter:
+    """
+    Grava periodicamente no PostgreSQL, em lote, o estado dos usuários alterados
+    no Redis (FEATURE_STORE_MODE=redis). No modo postgres, sincroniza em lote
+    as tabelas tipadas dos usuários com escritas recentes.
+    """
+    def __init__(self, feature_service: FeatureService = None):
+        self.feature_service = feature_service or FeatureService(settings.REDIS_BATCH_SOCKET_TIMEOUT_MS)
+        self.redis_client = self.feature_service.redis_client
+        self.intervalo = settings.FEATURE_SNAPSHOT_INTERVAL_SECONDS
+        self.tamanho_lote = settings.FEATURE_SNAPSHOT_BATCH_SIZE
+
+    def flush(self) -> int:
+        """
+        Grava todos os usuários sujos no momento e retorna quantos foram gravados.
+        Com o cache distribuído, cada nó guarda o conjunto dos seus usuários.
+        Só um dos conjuntos é usado, conforme FEATURE_STORE_MODE.
+        """
+        total = 0
+        for cliente in shards(self.redis_client):
+            total += self._flush_shard(cliente, DIRTY_SET_KEY, self._snapshot)
+            total += self._flush_shard(cliente, COLUMNS_DIRTY_SET_KEY, self._sync_columns)
+
+        SNAPSHOT_DIRTY.set(sum(cliente.scard(DIRTY_SET_KEY) for cliente in shards(self.redis_client)))
+        COLUMNS_PENDING.set(sum(cliente.scard(COLUMNS_DIRTY_SET_KEY) for cliente in shards(self.redis_client)))
+        return total
+
+    def _flush_shard(self, cliente, chave: str, gravar) -> int:
+        """
+        Cada lote passa do conjunto de sujos para o de processamento (SMOVE) e
+        só sai dele depois do commit: se o processo cair no meio do lote, os
+        usuários voltam para o conjunto de sujos no próximo flush. gravar pode
+        retornar os usuários que não conseguiu gravar; eles também ficam no
+        conjunto de processamento até o próximo flush. Supõe um único
+        snapshotter por implantação.
+        """
+        processando = f"{chave}:processando"
+        self._devolver(cliente, chave, processando)
+        total = 0
+        while True:
+            candidatos = cliente.srandmember(chave, self.tamanho_lote)
+            if not candidatos:
+                break
+            pipe = cliente.pipeline(transaction=False)
+            for user_id in candidatos:
+                pipe.smove(chave, processando, user_id)
+            user_ids = [
+                u.decode() if isinstance(u, bytes) else u
+                for u, movido in zip(candidatos, pipe.execute()) if movido
+            ]
+            if not user_ids:
+                continue
+
+            try:
+                pendentes = set(gravar(user_ids) or ())
+            except Exception:
+                # Devolve os usuários ao conjunto para a próxima tentativa
+                self._devolver(cliente, chave, processando)
+                raise
+            gravados = [user_id for user_id in user_ids if user_id not in pendentes]
+            if gravados:
+                cliente.srem(processando, *gravados)
+            total += len(gravados)
+        return total
+
+    def _devolver(self, cliente, chave: str, processando: str):
+        pipe = cliente.pipeline(transaction=True)
+        pipe.sunionstore(chave, [chave, processando])
+        pipe.delete(processando)
+        pipe.execute()
+
+    def _snapshot(self, user_ids: List[str]) -> List[str]:
+        """
+        Lê o estado dos usuários do Redis e grava tudo com um único UPSERT.
+        Eventos aplicados depois da leitura remarcam o usuário como sujo, então
+        entram no próximo lote. Retorna os usuários sem estado no Redis (chave
+        expulsa ou perdida), que não são gravados nem descartados.
+        """
+        inicio = time.perf_counter()
+        # As derivadas são recalculadas: a gravação delas no Redis pode ter
+        # ficado para trás se o processo do evento caiu antes dela
+        estados = {
+            user_id: self.feature_service._com_derivadas(features)
+            for user_id, features in self.feature_service._get_many_from_cache(user_ids).items()
+        }
+        ausentes = [user_id for user_id in user_ids if user_id not in estados]
+        if ausentes:
+            SNAPSHOT_MISSING.inc(len(ausentes))
+            logger.warning(
+                f"{len(ausentes)} usuário(s) sujo(s) sem estado no Redis, snapshot adiado: {ausentes[:20]}"
+            )
+        if not estados:
+            return ausentes
+
+        stmt = insert(UserFeature.__table__).values([
+            {"user_id": user_id, "feature_data": features}
+            for user_id, features in estados.items()
+        ])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["user_id"],
+            set_={"feature_data": stmt.excluded.feature_data, "last_updated": func.now()}
+        )
+
+        db = BatchSessionLocal()
+        try:
+            db.execute(stmt)
+            self.feature_service.sync_feature_columns(db, estados)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+        SNAPSHOT_USERS.inc(len(estados))
+        SNAPSHOT_LATENCY.observe(time.perf_counter() - inicio)
+        return ausentes
+
+    def _sync_columns(self, user_ids: List[str]):
+        """
+        Modo postgres: relê de user_features o estado dos usuários e o espelha
+        nas tabelas tipadas em uma transação. O FOR SHARE espera os eventos
+        ainda em andamento desses usuários, que os marcam antes do commit.
+        """
+        db = BatchSessionLocal()
+        try:
+            linhas = db.execute(
+                select(UserFeature.user_id, UserFeature.feature_data)
+                .where(UserFeature.user_id.in_(user_ids))
+                .with_for_update(read=True)
+            ).all()
+            self.feature_service.sync_feature_columns(db, dict(linhas))
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+        COLUMNS_SYNCED.inc(len(linhas))
+
+    def rebalance(self, urls: List[str]) -> int:
+        """
+        Prepara a troca de REDIS_NODES no modo redis, com consumers e API
+        parados: grava todos os sujos no PostgreSQL, move para os novos nós as
+        chaves que mudam de dono e registra a nova lista. Retorna quantas
+        chaves foram movidas.
+        """
+        self.flush()
+        if any(cliente.scard(DIRTY_SET_KEY) for cliente in shards(self.redis_client)):
+            raise TopologyError("Ainda há eventos chegando: pare consumers e API antes do rebalance")
+        locais = (DIRTY_SET_KEY, COLUMNS_DIRTY_SET_KEY)
+        novo = ShardedRedis.from_urls(urls, locais + tuple(f"{chave}:processando" for chave in locais))
+        return rebalance(self.redis_client, novo)
+
+    async def start(self):
+        """
+        Inicia o ciclo de snapshots
+        """
+        logger.info(f"Iniciando snapshotter de features (intervalo de {self.intervalo}s)...")
+        try:
+            while True:
+                await asyncio.sleep(self.intervalo)
+                try:
+                    gravados = self.flush()
+                    if gravados:
+                        logger.info(f"Snapshot: {gravados} usuários gravados")
+                except Exception as e:
+                    logger.error(f"Erro no snapshot: {str(e)}")
+        finally:
+            # Grava o que restou antes de encerrar
+            self.flush()
+
+async def main():
+    snapshotter = FeatureSnapshotter()
+    await snapshotter.start()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Snapshotter de features.")
+    parser.add_argument('--rebalance', type=str, default=None,
+                        help='Nova REDIS_NODES em JSON: grava os sujos, move as chaves e sai (rode com a lista antiga)')
+    args = parser.parse_args()
+    if args.rebalance:
+        movidas = FeatureSnapshotter().rebalance(json.loads(args.rebalance))
+        logger.info(f"Rebalance concluído: {movidas} chaves movidas")
+    else:
+        asyncio.run(main())
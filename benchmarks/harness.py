@@ -0,0 +1,177 @@
+"""
+Substitutos locais das dependências externas para os benchmarks: fakeredis no
+lugar do Redis, SQLite no lugar do PostgreSQL (ou um PostgreSQL descartável no
+modo postgres), um shim em memória do Kafka e um modelo treinado em dados
+sintéticos no lugar do MLflow.
+"""
+import os
+import logging
+import tempfile
+from typing import Any, Dict, List
+
+# Configuração mínima exigida por app.core.config antes de qualquer import do app
+os.environ.setdefault("SECRET_KEY", "benchmark")
+os.environ.setdefault("POSTGRES_USER", "benchmark")
+os.environ.setdefault("POSTGRES_PASSWORD", "benchmark")
+os.environ.setdefault("POSTGRES_DB", "benchmark")
+
+import fakeredis
+import joblib
+import redis
+from sqlalchemy import create_engine
+from xgboost import XGBClassifier
+
+from app.core.config import settings
+from app.db import session
+from app.db.base_class import Base
+from app.ml.train_model import generate_synthetic_data
+
+# Features usadas pelo modelo de benchmark (as mesmas do background do SHAP)
+MODEL_FEATURES = [
+    'pix_volume',
+    'avg_transaction_value',
+    'transaction_frequency',
+    'chargeback_rate',
+    'app_connections'
+]
+
+class InMemoryKafkaConsumer:
+    """
+    Shim do KafkaConsumer: entrega uma lista de eventos já desserializados
+    """
+    class _Message:
+        __slots__ = ("value",)
+
+        def __init__(self, value: Dict[str, Any]):
+            self.value = value
+
+    def __init__(self, *topics, **config):
+        self._messages: List["InMemoryKafkaConsumer._Message"] = []
+
+    def feed(self, eventos: List[Dict[str, Any]]):
+        self._messages.extend(self._Message(e) for e in eventos)
+
+    def __iter__(self):
+        while self._messages:
+            yield self._messages.pop(0)
+
+    def close(self):
+        pass
+
+def install_stand_ins(work_dir: str = None, mode: str = "redis", database_url: str = None) -> str:
+    """
+    Aponta Redis, banco e modelos para os substitutos locais e retorna o
+    diretório de trabalho (banco SQLite e modelos). No modo "postgres" as
+    features vivem no banco de database_url, cujas tabelas são recriadas.
+    """
+    work_dir = work_dir or tempfile.mkdtemp(prefix="score_engine_bench_")
+    settings.FEATURE_STORE_MODE = mode
+
+    # Redis: todos os clientes criados via redis.from_url compartilham um servidor fake
+    servidor = fakeredis.FakeServer()
+    redis.from_url = lambda *args, **kwargs: fakeredis.FakeRedis(server=servidor)
+
+    from app.models import score, score_contest, user_feature, user_feature_columns  # noqa: F401
+    if mode == "postgres":
+        # O modo postgres usa jsonb e SELECT ... FOR UPDATE, que o SQLite não tem
+        if not database_url:
+            raise ValueError("O modo postgres precisa de --database-url (um banco descartável)")
+        engine = create_engine(database_url)
+        Base.metadata.drop_all(bind=engine)
+        Base.metadata.create_all(bind=engine)
+    else:
+        # Banco: SQLite em arquivo; o estado vivo das features fica no (fake)Redis
+        # e o banco só é lido na partida a frio
+        engine = create_engine(f"sqlite:///{os.path.join(work_dir, 'bench.db')}")
+        Base.metadata.create_all(bind=engine, tables=[
+            score.Score.__table__,
+            score_contest.ScoreContest.__table__,
+            user_feature.UserFeature.__table__
+        ])
+    session.SessionLocal.configure(bind=engine)
+    session.BatchSessionLocal.configure(bind=engine)
+    session.engine = engine
+
+    # Modelo: classificador treinado em dados sintéticos, salvo como no ModelManager
+    df = generate_synthetic_data(2000)
+    modelo = XGBClassifier(n_estimators=50, max_depth=4, tree_method="hist")
+    modelo.fit(df[MODEL_FEATURES], (df["score"] > df["score"].median()).astype(int))
+    os.makedirs(os.path.join(work_dir, "models"), exist_ok=True)
+    joblib.dump(modelo, os.path.join(work_dir, "models", "model_bench.pkl"))
+    # ModelManager procura os modelos em "models", relativo ao diretório atual
+    os.chdir(work_dir)
+
+    from app.services.score_service import ScoreService
+    ScoreService._load_model = lambda self: modelo
+
+    # Os logs LGPD continuam sendo formatados, mas não poluem a saída
+    from app.core import logger as app_logger
+    configurar_logger = app_logger.setup_logger
+
+    def setup_logger_silencioso(name: str) -> logging.Logger:
+        log = configurar_logger(name)
+        for handler in log.handlers:
+            handler.setStream(open(os.devnull, "w"))
+        # Sem repassar ao logger raiz, que escreve no terminal
+        log.propagate = False
+        return log
+
+    app_logger.setup_logger = setup_logger_silencioso
+    # O logger raiz também formata e descarta: o basicConfig dos workers vira no-op
+    logging.basicConfig(level=logging.INFO, stream=open(os.devnull, "w"))
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    return work_dir
+
+def _add_middleware_stack(app, stack: str):
+    """
+    Aplica a pilha de middlewares: "asgi" (a de app.main) ou "legacy"
+    (PrometheusMiddleware + TraceIDMiddleware baseados em BaseHTTPMiddleware)
+    """
+    from fastapi.middleware.cors import CORSMiddleware
+    from app.core.middleware import ObservabilityMiddleware, PrometheusMiddleware, TraceIDMiddleware
+
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    if stack == "legacy":
+        app.add_middleware(PrometheusMiddleware)
+        app.add_middleware(TraceIDMiddleware)
+    elif stack == "asgi":
+        app.add_middleware(ObservabilityMiddleware)
+
+def build_app(stack: str = "asgi"):
+    """
+    Monta o app com as rotas de score e a pilha de middlewares de app.main
+    """
+    from fastapi import FastAPI
+    from app.api.v1.endpoints import scores
+
+    # O ScoreService carrega o modelo em background; o benchmark não mede a partida
+    if scores.score_service.explainer is None:
+        scores.score_service.refresh_model()
+
+    app = FastAPI()
+    _add_middleware_stack(app, stack)
+    app.include_router(scores.router, prefix="/api/v1/scores", tags=["scores"])
+    return app
+
+def build_ping_app(stack: str):
+    """
+    App mínimo para isolar o custo da pilha de middlewares ("none" = sem nenhum)
+    """
+    from fastapi import FastAPI
+
+    app = FastAPI()
+    if stack != "none":
+        _add_middleware_stack(app, stack)
+
+    @app.post("/ping")
+    async def ping(payload: dict) -> dict:
+        return {"ok": True}
+
+    return app
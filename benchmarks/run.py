@@ -0,0 +1,234 @@
+"""
+Benchmark ponta a ponta do ScoreEngine.
+
+Mede latência (p50/p95/p99), vazão e pico de memória alocada por operação em
+cada etapa: feature store, consumer de eventos, a rota /calculate (via cliente
+ASGI em processo) e a serialização da resposta. Compara com benchmarks/baseline.json e aponta regressões.
+A baseline guarda os resultados de cada modo do feature store separadamente.
+
+    python -m benchmarks.run                    # roda e compara com a baseline
+    python -m benchmarks.run --save-baseline    # grava a nova baseline
+    python -m benchmarks.run --mode postgres --database-url postgresql://.../bench
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import tracemalloc
+from typing import Any, Awaitable, Callable, Dict
+
+import numpy as np
+
+from benchmarks.harness import install_stand_ins, build_app, build_ping_app, InMemoryKafkaConsumer
+from benchmarks.synthetic import generate_user_population, generate_event_stream
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+async def medir(
+    nome: str,
+    operacao: Callable[[int], Awaitable[Any]],
+    n: int,
+    n_alocacao: int = 200
+) -> Dict[str, float]:
+    """
+    Executa operacao(i) n vezes e resume latência e vazão. O pico de memória
+    é medido em uma passada separada e curta, pois o tracemalloc distorce o tempo.
+    """
+    latencias = np.empty(n)
+    inicio = time.perf_counter()
+    for i in range(n):
+        t0 = time.perf_counter()
+        await operacao(i)
+        latencias[i] = time.perf_counter() - t0
+    total = time.perf_counter() - inicio
+
+    tracemalloc.start()
+    picos = []
+    for i in range(min(n, n_alocacao)):
+        base = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        await operacao(i)
+        picos.append(tracemalloc.get_traced_memory()[1] - base)
+    tracemalloc.stop()
+
+    p50, p95, p99 = np.percentile(latencias, [50, 95, 99]) * 1000
+    resultado = {
+        "n": n,
+        "p50_ms": round(float(p50), 4),
+        "p95_ms": round(float(p95), 4),
+        "p99_ms": round(float(p99), 4),
+        "throughput_per_s": round(n / total, 1),
+        "peak_kib_per_op": round(float(np.mean(picos)) / 1024, 2)
+    }
+    print(f"{nome:<32} p50={resultado['p50_ms']:>9.3f}ms p95={resultado['p95_ms']:>9.3f}ms "
+          f"p99={resultado['p99_ms']:>9.3f}ms {resultado['throughput_per_s']:>10.1f}/s "
+          f"{resultado['peak_kib_per_op']:>9.1f}KiB/op")
+    return resultado
+
+async def run(
+    n_users: int,
+    n_events: int,
+    n_requests: int,
+    mode: str = "redis",
+    database_url: str = None
+) -> Dict[str, Dict[str, float]]:
+    install_stand_ins(mode=mode, database_url=database_url)
+
+    import httpx
+    from app.core.security import create_access_token
+    from app.services.feature_service import FeatureService
+    from app.workers import event_consumer
+
+    populacao = generate_user_population(n_users)
+    eventos = generate_event_stream(populacao, n_events)
+    user_ids = populacao["user_id"].tolist()
+    resultados = {}
+
+    # Feature store
+    feature_service = FeatureService()
+    resultados["feature_store.process_event"] = await medir(
+        "feature_store.process_event",
+        lambda i: feature_service.process_event(eventos[i % len(eventos)]),
+        n_events
+    )
+    resultados["feature_store.get_user_features"] = await medir(
+        "feature_store.get_user_features",
+        lambda i: feature_service.get_user_features(user_ids[i % n_users]),
+        n_requests
+    )
+    lote = 1000
+    resultados["feature_store.get_many_user_features_1000"] = await medir(
+        "feature_store.get_many_user_features_1000",
+        lambda i: feature_service.get_many_user_features(
+            [user_ids[(i * lote + j) % n_users] for j in range(lote)]
+        ),
+        max(n_requests // lote, 10)
+    )
+
+    # Consumer de eventos com Kafka em memória
+    event_consumer.KafkaConsumer = InMemoryKafkaConsumer
+    consumer = event_consumer.EventConsumer()
+    resultados["consumer.process_message"] = await medir(
+        "consumer.process_message",
+        lambda i: consumer.process_message(eventos[i % len(eventos)]),
+        n_events
+    )
+    consumer.consumer.feed(eventos)
+    inicio = time.perf_counter()
+    await consumer.start()
+    resultados["consumer.start_drain"] = {
+        "n": len(eventos),
+        "throughput_per_s": round(len(eventos) / (time.perf_counter() - inicio), 1)
+    }
+    print(f"{'consumer.start_drain':<32} {resultados['consumer.start_drain']['throughput_per_s']:>10.1f}/s")
+
+    # API ponta a ponta
+    app = build_app()
+    token = create_access_token({"sub": "benchmark"})
+    headers = {"Authorization": f"Bearer {token}"}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def calcular(i: int):
+            resposta = await client.post(
+                "/api/v1/scores/calculate",
+                json={"user_id": user_ids[i % n_users], "features": {}, "source_app": "benchmark"},
+                headers=headers
+            )
+            resposta.raise_for_status()
+
+        resultados["api.calculate"] = await medir("api.calculate", calcular, n_requests)
+
+    # Serialização da resposta de /calculate: caminho anterior (ScoreResponse
+    # validado pelo response_model, jsonable_encoder e json da stdlib) contra o
+    # ORJSONResponse montado direto, com a explicação completa e com top-K
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse, ORJSONResponse
+    from app.api.v1.endpoints.scores import ScoreResponse
+
+    explicacao = [
+        {"feature": f"feature_{j}", "value": j * 1.5, "impact": (-1) ** j * j / 100,
+         "description": f"O valor de feature_{j} ({j * 1.5:.2f}) aumentou levemente o score"}
+        for j in range(30)
+    ]
+    resposta = {
+        "user_id": "user_0000001", "score": 73.2, "risk": "baixo", "explanation": explicacao,
+        "features_used": [f"feature_{j}" for j in range(30)], "model_version": "bench",
+        "timestamp": "2024-01-01T00:00:00"
+    }
+    resposta_top_k = {**resposta, "explanation": explicacao[:5]}
+
+    async def serializar_pydantic(i: int):
+        JSONResponse(jsonable_encoder(ScoreResponse(**resposta))).body
+
+    async def serializar_orjson(i: int):
+        ORJSONResponse(resposta).body
+
+    async def serializar_orjson_top_k(i: int):
+        ORJSONResponse(resposta_top_k).body
+
+    for nome, operacao in (
+        ("serialization.pydantic_json", serializar_pydantic),
+        ("serialization.orjson", serializar_orjson),
+        ("serialization.orjson_top5", serializar_orjson_top_k),
+    ):
+        resultados[nome] = await medir(nome, operacao, n_requests)
+
+    # Custo isolado da pilha de middlewares, com um payload pequeno de score
+    payload = {"user_id": "user_0000001", "features": {}, "source_app": "benchmark"}
+    for stack in ("none", "legacy", "asgi"):
+        transport = httpx.ASGITransport(app=build_ping_app(stack))
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            async def ping(i: int):
+                (await client.post("/ping", json=payload)).raise_for_status()
+
+            resultados[f"middleware.{stack}"] = await medir(f"middleware.{stack}", ping, n_requests)
+
+    return resultados
+
+def comparar(resultados: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]], tolerancia: float) -> int:
+    """
+    Aponta etapas cujo p95 piorou ou a vazão caiu além da tolerância
+    """
+    regressoes = 0
+    for etapa, atual in resultados.items():
+        anterior = baseline.get(etapa)
+        if not anterior:
+            continue
+        if "p95_ms" in atual and atual["p95_ms"] > anterior["p95_ms"] * (1 + tolerancia):
+            print(f"REGRESSÃO {etapa}: p95 {anterior['p95_ms']}ms -> {atual['p95_ms']}ms")
+            regressoes += 1
+        if atual["throughput_per_s"] < anterior["throughput_per_s"] * (1 - tolerancia):
+            print(f"REGRESSÃO {etapa}: vazão {anterior['throughput_per_s']}/s -> {atual['throughput_per_s']}/s")
+            regressoes += 1
+    return regressoes
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark ponta a ponta do ScoreEngine.")
+    parser.add_argument('--users', type=int, default=10000, help='Usuários na população sintética')
+    parser.add_argument('--events', type=int, default=5000, help='Eventos no fluxo sintético')
+    parser.add_argument('--requests', type=int, default=1000, help='Requisições por etapa de leitura/API')
+    parser.add_argument('--mode', choices=['redis', 'postgres'], default='redis', help='FEATURE_STORE_MODE medido')
+    parser.add_argument('--database-url', type=str, default=os.getenv("BENCHMARK_DATABASE_URL"),
+                        help='PostgreSQL descartável do modo postgres (as tabelas são recriadas)')
+    parser.add_argument('--save-baseline', action='store_true', help='Grava os resultados como nova baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Piora relativa aceita antes de apontar regressão')
+    args = parser.parse_args()
+
+    resultados = asyncio.run(run(args.users, args.events, args.requests, args.mode, args.database_url))
+
+    baseline = {}
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH) as f:
+            baseline = json.load(f)
+
+    if args.save_baseline:
+        baseline[args.mode] = resultados
+        with open(BASELINE_PATH, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f"Baseline do modo {args.mode} gravada em {BASELINE_PATH}")
+    elif args.mode in baseline:
+        sys.exit(1 if comparar(resultados, baseline[args.mode], args.tolerance) else 0)
+    else:
+        print(f"Nenhuma baseline do modo {args.mode}; rode com --save-baseline para criar.")
@@ -0,0 +1,68 @@
+from datetime import datetime, timedelta
+from typing import Dict, Any, List
+import numpy as np
+import pandas as pd
+
+from app.ml.train_model import generate_synthetic_data
+
+# Proporção de cada tipo de evento no fluxo sintético
+EVENT_MIX = {
+    "pix_payment": 0.55,
+    "login": 0.25,
+    "app_connection": 0.12,
+    "refund": 0.05,
+    "chargeback": 0.03
+}
+
+CIDADES = [("São Paulo", "SP"), ("Rio de Janeiro", "RJ"), ("Belo Horizonte", "MG"), ("Recife", "PE"), ("Curitiba", "PR")]
+
+def generate_user_population(n_users: int, seed: int = 42) -> pd.DataFrame:
+    """
+    Gera uma população de usuários a partir de generate_synthetic_data, com
+    user_id e um peso de atividade de cauda longa (poucos usuários concentram
+    a maior parte dos eventos, como em produção)
+    """
+    rng = np.random.default_rng(seed)
+    df = generate_synthetic_data(n_users)
+    df.insert(0, "user_id", [f"user_{i:07d}" for i in range(n_users)])
+    atividade = np.minimum(rng.zipf(1.5, n_users), 1000).astype(np.float64)
+    df["atividade"] = atividade / atividade.sum()
+    return df
+
+def generate_event_stream(
+    population: pd.DataFrame,
+    n_events: int,
+    seed: int = 42,
+    inicio: datetime = None,
+    eventos_por_segundo: float = 200.0
+) -> List[Dict[str, Any]]:
+    """
+    Gera um fluxo de eventos no formato do tópico user_events, com usuários
+    sorteados pelo peso de atividade e timestamps de evento crescentes
+    """
+    rng = np.random.default_rng(seed)
+    inicio = inicio or datetime.utcnow() - timedelta(seconds=n_events / eventos_por_segundo)
+    user_ids = rng.choice(population["user_id"].to_numpy(), size=n_events, p=population["atividade"].to_numpy())
+    tipos = rng.choice(list(EVENT_MIX), size=n_events, p=list(EVENT_MIX.values()))
+    valores = np.round(rng.lognormal(mean=4.0, sigma=1.0, size=n_events), 2)
+    instantes = np.cumsum(rng.exponential(1 / eventos_por_segundo, size=n_events))
+    cidades = rng.integers(0, len(CIDADES), size=n_events)
+    devices = rng.integers(0, 3, size=n_events)
+
+    eventos = []
+    for i in range(n_events):
+        tipo = str(tipos[i])
+        if tipo == "pix_payment":
+            dados = {"amount": float(valores[i]), "categoria": "pix"}
+        elif tipo == "login":
+            cidade, estado = CIDADES[cidades[i]]
+            dados = {"device_id": f"device_{user_ids[i]}_{devices[i]}", "cidade": cidade, "estado": estado}
+        else:
+            dados = {}
+        eventos.append({
+            "user_id": str(user_ids[i]),
+            "type": tipo,
+            "data": dados,
+            "timestamp": (inicio + timedelta(seconds=float(instantes[i]))).isoformat()
+        })
+    return eventos
@@ -0,0 +1,38 @@
+import argparse
+from sqlalchemy import select
+from app.core.config import settings
+from app.db.base_class import Base
+from app.db.session import batch_engine, BatchSessionLocal
+from app.models.user_feature import UserFeature
+from app.models.user_feature_columns import UserFeatureColumns, UserFeatureHistory
+from app.services.feature_service import FeatureService
+
+# Argumentos de linha de comando
+parser = argparse.ArgumentParser(description="Migra user_features.feature_data (JSON) para as tabelas tipadas.")
+parser.add_argument('--batch_size', type=int, default=5000, help='Usuários por lote gravado')
+parser.add_argument('--desde_user_id', type=str, default=None, help='Retoma a partir deste user_id (exclusivo)')
+args = parser.parse_args()
+
+# Cria as tabelas tipadas, se ainda não existirem
+Base.metadata.create_all(bind=batch_engine, tables=[UserFeatureColumns.__table__, UserFeatureHistory.__table__])
+
+feature_service = FeatureService(settings.REDIS_BATCH_SOCKET_TIMEOUT_MS)
+consulta = select(UserFeature.user_id, UserFeature.feature_data).order_by(UserFeature.user_id)
+if args.desde_user_id:
+    consulta = consulta.where(UserFeature.user_id > args.desde_user_id)
+
+total = 0
+# Cursor no servidor para leitura e uma sessão separada para escrita
+with batch_engine.connect() as conn:
+    resultado = conn.execution_options(stream_results=True, yield_per=args.batch_size).execute(consulta)
+    for lote in resultado.partitions():
+        db = BatchSessionLocal()
+        try:
+            feature_service.sync_feature_columns(db, {user_id: feature_data for user_id, feature_data in lote})
+            db.commit()
+        finally:
+            db.close()
+        total += len(lote)
+        print(f"{total} usuários migrados (último user_id: {lote[-1][0]})")
+
+print(f"Backfill concluído: {total} usuários.")
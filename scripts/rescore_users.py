@@ -0,0 +1,217 @@
+import argparse
+import csv
+import io
+import json
+import multiprocessing
+import os
+import random
+import time
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+import numpy as np
+import shap
+from sqlalchemy import select
+
+from app.db.session import batch_engine
+from app.ml.model_manager import ModelManager, model_scores
+from app.models.user_feature import UserFeature
+from app.services.score_service import build_explanations
+
+Faixa = Tuple[Optional[str], Optional[str]]  # (user_id inicial exclusivo, user_id final inclusivo)
+
+COPY_SQL = "COPY scores (user_id, score, features, explanation, timestamp) FROM STDIN WITH (FORMAT csv)"
+
+def planejar_faixas(tamanho_faixa: int) -> List[Faixa]:
+    """
+    Corta a tabela user_features em faixas de user_id com tamanho_faixa
+    usuários, lendo só os ids com cursor no servidor
+    """
+    limites = []
+    consulta = select(UserFeature.user_id).order_by(UserFeature.user_id)
+    with batch_engine.connect() as conn:
+        resultado = conn.execution_options(stream_results=True, yield_per=tamanho_faixa).execute(consulta)
+        for lote in resultado.partitions(tamanho_faixa):
+            if len(lote) == tamanho_faixa:
+                limites.append(lote[-1][0])
+    # A última faixa fica aberta: inclui usuários criados depois do planejamento
+    inicios = [None] + limites
+    return list(zip(inicios, limites + [None]))
+
+def carregar_checkpoint(caminho: str, tamanho_faixa: int) -> dict:
+    """
+    Lê o checkpoint ou cria um novo com as faixas planejadas. As faixas e o
+    timestamp da execução ficam gravados no checkpoint, então uma retomada usa
+    exatamente os mesmos cortes e reconhece as linhas que já gravou.
+    """
+    if os.path.exists(caminho):
+        with open(caminho) as f:
+            checkpoint = json.load(f)
+        checkpoint["faixas"] = [tuple(faixa) for faixa in checkpoint["faixas"]]
+        if "timestamp" not in checkpoint:
+            checkpoint["timestamp"] = datetime.utcnow().isoformat()
+            gravar_checkpoint(caminho, checkpoint)
+        return checkpoint
+    checkpoint = {
+        "faixas": planejar_faixas(tamanho_faixa),
+        "concluidas": [],
+        "timestamp": datetime.utcnow().isoformat()
+    }
+    gravar_checkpoint(caminho, checkpoint)
+    return checkpoint
+
+def gravar_checkpoint(caminho: str, checkpoint: dict):
+    temporario = f"{caminho}.tmp"
+    with open(temporario, "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(temporario, caminho)
+
+# Estado de cada processo, criado uma vez no initializer do pool
+_worker = {}
+
+def _iniciar_worker(model_dir: str, versao: Optional[str], amostra_explicacao: float, top_k: Optional[int], tamanho_lote: int, timestamp: str):
+    model_manager = ModelManager(model_dir=model_dir)
+    if versao:
+        model_manager.load_model_version(versao)
+    explainer = None
+    if amostra_explicacao > 0:
+        explainer = shap.TreeExplainer(model_manager.current_model)
+    _worker.update({
+        "model_manager": model_manager,
+        "feature_names": list(model_manager.current_model.feature_names_in_),
+        "explainer": explainer,
+        "amostra_explicacao": amostra_explicacao,
+        "top_k": top_k,
+        "tamanho_lote": tamanho_lote,
+        "timestamp": timestamp,
+        "rng": random.Random(os.getpid())
+    })
+
+def _explicar(matriz, indices: List[int]) -> dict:
+    """
+    Explicações SHAP só para as linhas sorteadas do lote
+    """
+    if not indices:
+        return {}
+    valores = matriz[indices]
+    shap_values = _worker["explainer"].shap_values(valores)
+    if isinstance(shap_values, list):
+        shap_values = shap_values[-1]
+    explicacoes = build_explanations(_worker["feature_names"], valores, shap_values, top_k=_worker["top_k"])
+    return dict(zip(indices, explicacoes))
+
+def csv_do_lote(user_ids: List[str], scores, matriz, nomes: List[str], explicacoes: dict, timestamp: str) -> io.StringIO:
+    """
+    Monta o CSV do COPY de um lote. Features e explicação vão como JSON;
+    sem explicação, o campo fica vazio e sem aspas, que o COPY lê como NULL.
+    """
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    for i, user_id in enumerate(user_ids):
+        explicacao = explicacoes.get(i)
+        escritor.writerow([
+            user_id,
+            float(scores[i]),
+            json.dumps(dict(zip(nomes, matriz[i].tolist()))),
+            json.dumps(explicacao) if explicacao is not None else None,
+            timestamp
+        ])
+    buffer.seek(0)
+    return buffer
+
+def _apagar_faixa(cursor, faixa: Faixa, timestamp: str):
+    """
+    Remove as linhas desta execução já gravadas na faixa: uma faixa commitada
+    cujo checkpoint não chegou a ser gravado é refeita sem duplicar scores
+    """
+    inicio, fim = faixa
+    condicoes, parametros = ["timestamp = %s"], [timestamp]
+    if inicio is not None:
+        condicoes.append("user_id > %s")
+        parametros.append(inicio)
+    if fim is not None:
+        condicoes.append("user_id <= %s")
+        parametros.append(fim)
+    cursor.execute(f"DELETE FROM scores WHERE {' AND '.join(condicoes)}", parametros)
+
+def rescore_faixa(faixa: Faixa) -> Tuple[Faixa, int]:
+    """
+    Pontua todos os usuários de uma faixa e grava com COPY em uma única
+    transação, que antes apaga o que esta execução já gravou na faixa: ou a
+    faixa inteira entra em scores uma vez, ou nada entra
+    """
+    nomes = _worker["feature_names"]
+    modelo = _worker["model_manager"].current_model
+    inicio, fim = faixa
+    consulta = select(UserFeature.user_id, UserFeature.feature_data).order_by(UserFeature.user_id)
+    if inicio is not None:
+        consulta = consulta.where(UserFeature.user_id > inicio)
+    if fim is not None:
+        consulta = consulta.where(UserFeature.user_id <= fim)
+
+    total = 0
+    escrita = batch_engine.raw_connection()
+    try:
+        cursor_escrita = escrita.cursor()
+        _apagar_faixa(cursor_escrita, faixa, _worker["timestamp"])
+        with batch_engine.connect() as leitura:
+            resultado = leitura.execution_options(stream_results=True, yield_per=_worker["tamanho_lote"]).execute(consulta)
+            for lote in resultado.partitions():
+                matriz = np.array(
+                    [[(dados or {}).get(nome) or 0.0 for nome in nomes] for _, dados in lote],
+                    dtype=np.float64
+                )
+                scores = model_scores(modelo, matriz)
+                sorteados = [i for i in range(len(lote)) if _worker["rng"].random() < _worker["amostra_explicacao"]]
+                explicacoes = _explicar(matriz, sorteados)
+
+                buffer = csv_do_lote(
+                    [user_id for user_id, _ in lote], scores, matriz, nomes, explicacoes, _worker["timestamp"]
+                )
+                cursor_escrita.copy_expert(COPY_SQL, buffer)
+                total += len(lote)
+        escrita.commit()
+    except Exception:
+        escrita.rollback()
+        raise
+    finally:
+        escrita.close()
+    return faixa, total
+
+def main():
+    parser = argparse.ArgumentParser(description="Recalcula o score de toda a população com uma versão do modelo.")
+    parser.add_argument('--model_version', type=str, default=None, help='Versão do modelo (padrão: a mais recente em --model_dir)')
+    parser.add_argument('--model_dir', type=str, default='models', help='Diretório dos modelos do ModelManager')
+    parser.add_argument('--processes', type=int, default=os.cpu_count(), help='Processos de pontuação')
+    parser.add_argument('--batch_size', type=int, default=5000, help='Usuários por lote vetorizado e por COPY')
+    parser.add_argument('--range_size', type=int, default=100000, help='Usuários por faixa (unidade de checkpoint)')
+    parser.add_argument('--explain_sample', type=float, default=0.0, help='Fração dos usuários com explicação SHAP (0 a 1)')
+    parser.add_argument('--top_k', type=int, default=None, help='Features por explicação')
+    parser.add_argument('--checkpoint', type=str, default=None, help='Arquivo de checkpoint (padrão: rescore_<versão>.json)')
+    args = parser.parse_args()
+
+    checkpoint_path = args.checkpoint or f"rescore_{args.model_version or 'latest'}.json"
+    checkpoint = carregar_checkpoint(checkpoint_path, args.range_size)
+    concluidas = {tuple(faixa) for faixa in checkpoint["concluidas"]}
+    pendentes = [faixa for faixa in checkpoint["faixas"] if faixa not in concluidas]
+    print(f"{len(checkpoint['faixas'])} faixas, {len(pendentes)} pendentes (checkpoint: {checkpoint_path})")
+
+    inicio = time.perf_counter()
+    total = 0
+    contexto = multiprocessing.get_context("spawn")
+    with contexto.Pool(
+        args.processes,
+        initializer=_iniciar_worker,
+        initargs=(args.model_dir, args.model_version, args.explain_sample, args.top_k, args.batch_size, checkpoint["timestamp"])
+    ) as pool:
+        for faixa, quantidade in pool.imap_unordered(rescore_faixa, pendentes):
+            checkpoint["concluidas"].append(list(faixa))
+            gravar_checkpoint(checkpoint_path, checkpoint)
+            total += quantidade
+            decorrido = time.perf_counter() - inicio
+            print(f"Faixa {faixa} concluída: {total} usuários em {decorrido:.0f}s ({total / decorrido:.0f}/s)")
+
+    print(f"Re-score concluído: {total} usuários em {time.perf_counter() - inicio:.0f}s.")
+
+if __name__ == "__main__":
+    main()
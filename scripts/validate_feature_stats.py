@@ -1,9 +1,11 @@
 import argparse
 import pandas as pd
 import numpy as np
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
 from app.core.config import settings
 from app.db.session import SessionLocal
+from app.ml.online_stats import StreamingCorrelation
+from app.models.user_feature_columns import FEATURE_COLUMNS
 from scipy.stats import spearmanr, pearsonr
 import mlflow
 import os
@@ -13,55 +15,80 @@ parser = argparse.ArgumentParser(description="Validação estatística das featu
 parser.add_argument('--sample_size', type=int, default=10000, help='Tamanho da amostra')
 parser.add_argument('--out', type=str, default='print', choices=['print', 'csv', 'mlflow', 'all'], help='Destino do resultado')
 parser.add_argument('--days', type=int, default=30, help='Dias retroativos para buscar dados')
+parser.add_argument('--stream', action='store_true', help='Valida toda a população em lotes (memória limitada), a partir de user_feature_columns')
+parser.add_argument('--chunk_size', type=int, default=50000, help='Linhas por lote no modo --stream')
 args = parser.parse_args()
 
 # Conexão com o banco
 engine = create_engine(settings.DATABASE_URL)
 
-# Consulta SQL
-with engine.connect() as conn:
-    # Descobre colunas de features automaticamente
-    result = conn.execute("SELECT * FROM user_features LIMIT 1")
-    columns = result.keys()
-    feature_columns = [c for c in columns if c not in ('id', 'user_id', 'last_updated', 'score') and c != 'feature_data']
-    # Busca dados
+# Último score de cada usuário na janela (evita duplicar usuários no join)
+LATEST_SCORES_SQL = f"""
+    SELECT DISTINCT ON (user_id) user_id, score
+    FROM scores
+    WHERE timestamp > NOW() - interval '{args.days} days'
+    ORDER BY user_id, timestamp DESC
+"""
+
+def validate_streaming():
+    """
+    Lê features tipadas e o último score por usuário com cursor no servidor e
+    acumula as correlações em uma passada, um lote vetorizado por vez
+    """
+    colunas = [c for c in FEATURE_COLUMNS if c != 'last_transaction_date']
     query = f"""
-        SELECT user_id, feature_data, last_updated
-        FROM user_features
-        WHERE last_updated > NOW() - interval '{args.days} days'
-        LIMIT {args.sample_size}
+        SELECT {', '.join('f.' + c for c in colunas)}, s.score
+        FROM user_feature_columns f
+        JOIN ({LATEST_SCORES_SQL}) s ON s.user_id = f.user_id
+        WHERE f.last_updated > NOW() - interval '{args.days} days'
+        ORDER BY f.user_id
     """
-    df = pd.read_sql(query, conn)
+    acumulador = StreamingCorrelation(colunas)
+    with engine.connect() as conn:
+        resultado = conn.execution_options(stream_results=True, yield_per=args.chunk_size).execute(text(query))
+        for lote in resultado.partitions():
+            matriz = np.array(lote, dtype=np.float64)
+            acumulador.update(matriz[:, :-1], matriz[:, -1])
+    return pd.DataFrame(acumulador.results())
 
-# Expande o JSON de features
-features_df = pd.json_normalize(df['feature_data'])
-if 'score' in df.columns:
-    features_df['score'] = df['score']
-else:
-    # Tenta buscar score da tabela de scores
+def validate_in_memory():
+    """
+    Modo original: carrega uma amostra de feature_data (JSON) em memória
+    """
     with engine.connect() as conn:
-        scores = pd.read_sql(f"SELECT user_id, score FROM scores WHERE timestamp > NOW() - interval '{args.days} days'", conn)
+        query = f"""
+            SELECT user_id, feature_data, last_updated
+            FROM user_features
+            WHERE last_updated > NOW() - interval '{args.days} days'
+            LIMIT {args.sample_size}
+        """
+        df = pd.read_sql(text(query), conn)
+        scores = pd.read_sql(text(LATEST_SCORES_SQL), conn)
+
+    # Expande o JSON de features
+    features_df = pd.json_normalize(df['feature_data'])
     features_df = features_df.join(df['user_id'])
-    features_df = features_df.merge(scores, on='user_id', how='left')
+    features_df = features_df.merge(scores, on='user_id', how='inner')
 
-# Remove colunas não numéricas
-num_features = features_df.select_dtypes(include=[np.number]).columns.tolist()
-num_features = [f for f in num_features if f != 'score']
+    # Remove colunas não numéricas
+    num_features = features_df.select_dtypes(include=[np.number]).columns.tolist()
+    num_features = [f for f in num_features if f != 'score']
 
-# Calcula correlação
-results = []
-for feature in num_features:
-    pearson_corr, pearson_p = pearsonr(features_df[feature], features_df['score'])
-    spearman_corr, spearman_p = spearmanr(features_df[feature], features_df['score'])
-    results.append({
-        'feature': feature,
-        'pearson_corr': pearson_corr,
-        'pearson_p': pearson_p,
-        'spearman_corr': spearman_corr,
-        'spearman_p': spearman_p
-    })
+    # Calcula correlação
+    results = []
+    for feature in num_features:
+        pearson_corr, pearson_p = pearsonr(features_df[feature], features_df['score'])
+        spearman_corr, spearman_p = spearmanr(features_df[feature], features_df['score'])
+        results.append({
+            'feature': feature,
+            'pearson_corr': pearson_corr,
+            'pearson_p': pearson_p,
+            'spearman_corr': spearman_corr,
+            'spearman_p': spearman_p
+        })
+    return pd.DataFrame(results)
 
-results_df = pd.DataFrame(results)
+results_df = validate_streaming() if args.stream else validate_in_memory()
 
 # Saídas
 if args.out in ('print', 'all'):
@@ -75,6 +102,6 @@ if args.out in ('mlflow', 'all'):
     mlflow.set_experiment(settings.MLFLOW_EXPERIMENT_NAME)
     with mlflow.start_run(run_name="feature_stats_validation"):
         mlflow.log_artifact('feature_score_correlation.csv')
-        mlflow.log_param('sample_size', args.sample_size)
+        mlflow.log_param('sample_size', 'all' if args.stream else args.sample_size)
         mlflow.log_param('days', args.days)
         print("Resultado logado no MLflow.") 
\ No newline at end of file
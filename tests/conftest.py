@@ -0,0 +1,27 @@
+import os
+
+import pytest
+
+
+@pytest.fixture
+def postgres_engine():
+    """
+    Banco PostgreSQL de teste (TEST_DATABASE_URL) com as tabelas de features
+    e de scores recriadas; pula se não houver
+    """
+    from sqlalchemy import create_engine
+    from app.db.base_class import Base
+    from app.models.score import Score
+    from app.models.user_feature import UserFeature
+    from app.models.user_feature_columns import UserFeatureColumns, UserFeatureHistory
+
+    url = os.environ.get("TEST_DATABASE_URL")
+    if not url:
+        pytest.skip("TEST_DATABASE_URL não definido")
+    engine = create_engine(url)
+    tabelas = [UserFeature.__table__, UserFeatureColumns.__table__, UserFeatureHistory.__table__, Score.__table__]
+    Base.metadata.drop_all(bind=engine, tables=tabelas)
+    Base.metadata.create_all(bind=engine, tables=tabelas)
+    yield engine
+    Base.metadata.drop_all(bind=engine, tables=tabelas)
+    engine.dispose()
@@ -0,0 +1,50 @@
+import os
+import subprocess
+import sys
+
+from sqlalchemy import select
+from sqlalchemy.engine import make_url
+
+from app.models.user_feature import UserFeature
+from app.models.user_feature_columns import UserFeatureColumns, UserFeatureHistory
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _backfill(url, *args):
+    partes = make_url(url)
+    ambiente = {
+        **os.environ,
+        "POSTGRES_HOST": partes.host or "localhost",
+        "POSTGRES_PORT": str(partes.port or 5432),
+        "POSTGRES_USER": partes.username or "",
+        "POSTGRES_PASSWORD": partes.password or "",
+        "POSTGRES_DB": partes.database or "",
+        "PYTHONPATH": RAIZ
+    }
+    return subprocess.run(
+        [sys.executable, "scripts/backfill_feature_columns.py", *args],
+        cwd=RAIZ, env=ambiente, capture_output=True, text=True, check=True
+    ).stdout
+
+
+def test_backfill_migra_em_lotes_e_retoma_pelo_user_id(postgres_engine):
+    with postgres_engine.begin() as conn:
+        conn.execute(UserFeature.__table__.insert(), [
+            {"user_id": f"u{i}", "feature_data": {
+                "pix_volume": float(i),
+                "historico_logins": [{"timestamp": "2024-01-01T09:00:00", "device_id": f"d{i}"}]
+            }}
+            for i in range(5)
+        ])
+
+    saida = _backfill(postgres_engine.url.render_as_string(hide_password=False), "--batch_size", "2", "--desde_user_id", "u0")
+
+    assert "Backfill concluído: 4 usuários." in saida
+    with postgres_engine.connect() as conn:
+        volumes = dict(conn.execute(select(UserFeatureColumns.user_id, UserFeatureColumns.pix_volume)).all())
+        dispositivos = [d for (d,) in conn.execute(
+            select(UserFeatureHistory.device_id).order_by(UserFeatureHistory.user_id)
+        )]
+    assert volumes == {f"u{i}": float(i) for i in range(1, 5)}
+    assert dispositivos == ["d1", "d2", "d3", "d4"]
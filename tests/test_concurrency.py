@@ -0,0 +1,67 @@
+import pytest
+from fastapi import HTTPException
+from app.core.concurrency import AdaptiveConcurrencyLimiter
+
+
+@pytest.mark.asyncio
+async def test_slot_rejeita_na_hora_quando_limite_e_atingido():
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=2, min_limit=1, max_limit=10)
+    limiter.try_acquire("critical")
+    limiter.try_acquire("critical")
+
+    with pytest.raises(HTTPException) as erro:
+        async with limiter.slot("qualquer_app"):
+            pass
+
+    assert erro.value.status_code == 503
+    assert int(erro.value.headers["Retry-After"]) >= 1
+
+
+def test_classes_menos_prioritarias_sao_descartadas_primeiro():
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=10, min_limit=1, max_limit=10)
+    for _ in range(5):
+        assert limiter.try_acquire("critical")
+
+    assert not limiter.try_acquire("batch")
+    assert limiter.try_acquire("normal")
+
+
+def test_limite_cai_quando_latencia_sobe():
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=50, min_limit=1, max_limit=100)
+    for _ in range(50):
+        limiter.inflight += 1
+        limiter.release(0.01)
+    estavel = limiter.limit
+
+    for _ in range(50):
+        limiter.inflight += 1
+        limiter.release(0.2)
+
+    assert limiter.limit < estavel
+
+
+@pytest.mark.asyncio
+async def test_acquire_e_acordado_pelo_release_sem_esperar_o_prazo():
+    import asyncio
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=2, min_limit=1, max_limit=10)
+    limiter.try_acquire("critical")
+
+    espera = asyncio.create_task(limiter.acquire("batch", timeout=5))
+    await asyncio.sleep(0)
+    assert not espera.done()
+
+    limiter.release(None)
+    await asyncio.wait_for(espera, 0.1)
+    assert limiter.inflight == 1
+
+
+@pytest.mark.asyncio
+async def test_acquire_desiste_no_prazo():
+    import asyncio
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=2, min_limit=1, max_limit=10)
+    limiter.try_acquire("critical")
+
+    with pytest.raises(asyncio.TimeoutError):
+        await limiter.acquire("batch", timeout=0.05)
+    assert limiter.inflight == 1
+    assert not limiter._esperando
@@ -0,0 +1,138 @@
+from types import SimpleNamespace
+
+
+def test_supervisor_reinicia_consumer_que_falhou(monkeypatch, tmp_path):
+    monkeypatch.setenv("PROMETHEUS_MULTIPROC_DIR", str(tmp_path))
+    from app.workers import consumer_fleet
+
+    monkeypatch.setattr(consumer_fleet, "mark_process_dead", lambda pid: None)
+    fleet = consumer_fleet.ConsumerFleet(n_processos=1)
+    iniciados = []
+    fleet._iniciar = iniciados.append
+    fleet._processos[0] = SimpleNamespace(is_alive=lambda: False, exitcode=1, pid=123)
+    fleet._iniciado_em[0] = 0.0
+
+    fleet._verificar()
+    assert 0 in fleet._reiniciar_em and iniciados == []
+
+    fleet._reiniciar_em[0] = 0.0
+    fleet._verificar()
+    assert iniciados == [0]
+
+
+class _ConsumerFalso:
+    """
+    Entrega os lotes programados e registra commits e seeks
+    """
+    def __init__(self, worker, lotes):
+        self.worker = worker
+        self.lotes = list(lotes)
+        self.commits = []
+        self.seeks = []
+
+    def poll(self, timeout_ms, max_records):
+        if not self.lotes:
+            self.worker.stop()
+            return {}
+        return self.lotes.pop(0)
+
+    def commit_async(self, offsets):
+        self.commits.append({tp.partition: o.offset for tp, o in offsets.items()})
+
+    def commit(self, offsets):
+        self.commits.append({tp.partition: o.offset for tp, o in offsets.items()})
+
+    def seek(self, tp, offset):
+        self.seeks.append((tp.partition, offset))
+
+    def assignment(self):
+        return set()
+
+    def close(self, autocommit=True):
+        pass
+
+
+def _worker(monkeypatch, tmp_path, falhas):
+    """
+    PartitionedEventConsumer sem Kafka: falhas[offset] é quantas vezes o
+    evento desse offset falha antes de ser aplicado
+    """
+    monkeypatch.setenv("PROMETHEUS_MULTIPROC_DIR", str(tmp_path))
+    from app.workers import consumer_fleet
+
+    monkeypatch.setattr(consumer_fleet.settings, "CONSUMER_RETRY_BACKOFF_MS", 0)
+    aplicados = []
+
+    class _FeatureServiceFalso:
+        async def process_event(self, evento):
+            if falhas.get(evento["offset"], 0):
+                falhas[evento["offset"]] -= 1
+                raise RuntimeError("banco indisponível")
+            aplicados.append(evento["offset"])
+
+    worker = object.__new__(consumer_fleet.PartitionedEventConsumer)
+    worker.indice = 0
+    worker.feature_service = _FeatureServiceFalso()
+    worker._processados, worker._novos, worker._contagem, worker._tentativas = {}, {}, {}, {}
+    worker._produtor = None
+    worker._parar = False
+    worker.aplicados = aplicados
+    return worker, consumer_fleet
+
+
+def _mensagens(offsets):
+    return [SimpleNamespace(offset=o, value={"offset": o}) for o in offsets]
+
+
+def test_commit_nao_passa_do_evento_que_falhou(monkeypatch, tmp_path):
+    import asyncio
+    from kafka import TopicPartition
+
+    worker, _ = _worker(monkeypatch, tmp_path, falhas={1: 1})
+    tp = TopicPartition("user_events", 0)
+    worker.consumer = _ConsumerFalso(worker, [{tp: _mensagens([0, 1, 2])}, {tp: _mensagens([1, 2])}])
+
+    asyncio.run(worker.start())
+
+    assert worker.consumer.seeks == [(0, 1)]
+    # Commits assíncronos a cada poll e o síncrono do encerramento
+    assert worker.consumer.commits == [{0: 1}, {0: 3}, {0: 3}]
+    assert worker.aplicados == [0, 1, 2]
+
+
+def test_evento_que_sempre_falha_vai_para_o_dead_letter(monkeypatch, tmp_path):
+    import asyncio
+    from kafka import TopicPartition
+
+    worker, consumer_fleet = _worker(monkeypatch, tmp_path, falhas={0: 99})
+    monkeypatch.setattr(consumer_fleet.settings, "CONSUMER_MAX_ATTEMPTS", 2)
+    enviados = []
+    worker._dead_letter = lambda tp, mensagem: enviados.append(mensagem.offset)
+    tp = TopicPartition("user_events", 0)
+    worker.consumer = _ConsumerFalso(worker, [{tp: _mensagens([0, 1])}, {tp: _mensagens([0, 1])}])
+
+    asyncio.run(worker.start())
+
+    assert enviados == [0]
+    assert worker.aplicados == [1]
+    assert worker.consumer.commits == [{0: 2}, {0: 2}]
+
+
+def test_particoes_revogadas_tem_o_offset_processado_commitado(monkeypatch, tmp_path):
+    import asyncio
+    from kafka import TopicPartition
+
+    worker, consumer_fleet = _worker(monkeypatch, tmp_path, falhas={})
+    tp0, tp1 = TopicPartition("user_events", 0), TopicPartition("user_events", 1)
+
+    class _ConsumerComRebalanceamento(_ConsumerFalso):
+        def commit_async(self, offsets):
+            # O commit assíncrono não chega a ser confirmado antes do rebalanceamento
+            consumer_fleet._RebalanceListener(worker).on_partitions_revoked([tp1])
+
+    worker.consumer = _ConsumerComRebalanceamento(worker, [{tp0: _mensagens([0]), tp1: _mensagens([5, 6])}])
+    asyncio.run(worker.start())
+
+    assert worker.consumer.commits[0] == {1: 7}
+    assert tp1 not in worker._processados
+    assert worker.consumer.commits[-1] == {0: 1}
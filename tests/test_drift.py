@@ -0,0 +1,90 @@
+import json
+import fakeredis
+import numpy as np
+from app.ml.drift import DriftMonitor, DriftProfile, FeatureSketch, SCORE, reference_edges
+
+AGORA = 1_700_000_000.0
+
+
+def _referencia(tmp_path, rng):
+    X = rng.normal(size=(5000, 2))
+    perfil = DriftProfile(reference_edges(X, ["a", "b"]))
+    perfil.update(X)
+    perfil.sketches[SCORE].update(rng.uniform(0, 100, 5000))
+    (tmp_path / "reference_profile.json").write_text(json.dumps(perfil.to_dict()))
+
+
+def _observar(monitor, rng, n, deslocamento=0.0):
+    for a, b in rng.normal(size=(n, 2)):
+        monitor.observe("v1", {"a": a + deslocamento, "b": b, "outra": "x"}, rng.uniform(0, 100))
+
+
+def test_sketches_combinados_iguais_a_um_unico_sketch():
+    rng = np.random.default_rng(0)
+    valores = rng.normal(size=1000)
+    bordas = np.quantile(valores, [0.25, 0.5, 0.75])
+
+    unico = FeatureSketch(bordas)
+    unico.update(valores)
+    parte_1, parte_2 = FeatureSketch(bordas), FeatureSketch(bordas)
+    parte_1.update(valores[:300])
+    parte_2.update(valores[300:])
+    parte_1.merge(parte_2)
+
+    assert (parte_1.counts == unico.counts).all()
+    assert np.isclose(parte_1.mean, valores.mean())
+    assert np.isclose(parte_1.std, valores.std())
+
+
+def test_monitor_detecta_drift_so_na_feature_deslocada(tmp_path):
+    rng = np.random.default_rng(1)
+    _referencia(tmp_path, rng)
+    monitor = DriftMonitor(reference_dir=str(tmp_path), window_seconds=3600, n_buckets=12)
+    monitor.enabled = True
+
+    _observar(monitor, rng, 3000, deslocamento=1.0)
+    resultado = monitor.run_once(agora=AGORA)["v1"]
+
+    assert resultado["a"]["psi"] > 0.25
+    assert resultado["a"]["mean_shift"] > 0.8
+    assert resultado["b"]["psi"] < 0.05
+    assert resultado[SCORE]["ks"] < 0.05
+    assert resultado["a"]["n"] == 3000
+
+
+def test_buckets_antigos_saem_da_janela(tmp_path):
+    rng = np.random.default_rng(2)
+    _referencia(tmp_path, rng)
+    monitor = DriftMonitor(reference_dir=str(tmp_path), window_seconds=3600, n_buckets=12)
+    monitor.enabled = True
+
+    _observar(monitor, rng, 100)
+    monitor.run_once(agora=AGORA)
+    _observar(monitor, rng, 50)
+    resultado = monitor.run_once(agora=AGORA + 3600)
+
+    assert resultado["v1"]["a"]["n"] == 50
+
+
+def test_versao_sem_referencia_e_ignorada(tmp_path):
+    monitor = DriftMonitor(reference_dir=str(tmp_path))
+    monitor.enabled = True
+    monitor.observe("v1", {"a": 1.0}, 50.0)
+
+    assert monitor.run_once(agora=AGORA) == {}
+
+
+def test_janelas_de_processos_sao_combinadas_pelo_redis(tmp_path):
+    rng = np.random.default_rng(3)
+    _referencia(tmp_path, rng)
+    redis_client = fakeredis.FakeRedis()
+    monitores = [DriftMonitor(redis_client, reference_dir=str(tmp_path)) for _ in range(2)]
+    for i, monitor in enumerate(monitores):
+        monitor.enabled = True
+        monitor._id = f"processo-{i}"
+        _observar(monitor, rng, 100)
+
+    monitores[0].run_once(agora=AGORA)
+    resultado = monitores[1].run_once(agora=AGORA)
+
+    assert resultado["v1"]["a"]["n"] == 200
@@ -1,9 +1,555 @@
 import pytest
-from app.services.feature_service import FeatureService
+import numpy as np
+from datetime import datetime
+from app.models.user_feature import UserFeature
+from app.services.feature_service import (
+    FeatureService, DIRTY_SET_KEY, COLUMNS_DIRTY_SET_KEY,
+    RELEASE_LOCK_SCRIPT, APPLY_OPERATIONS_SCRIPT, WRITE_DERIVED_SCRIPT, HYDRATE_SCRIPT, REBUILD_SCRIPT
+)
 
 
 def test_feature_service_instancia():
     try:
         service = FeatureService()
     except Exception as e:
-        pytest.fail(f"Falha ao instanciar FeatureService: {e}") 
\ No newline at end of file
+        pytest.fail(f"Falha ao instanciar FeatureService: {e}") 
+
+
+def test_workers_usam_o_timeout_de_lote_do_redis():
+    from app.core.config import settings
+
+    api = FeatureService().redis_client.connection_pool.connection_kwargs
+    lote = FeatureService(settings.REDIS_BATCH_SOCKET_TIMEOUT_MS).redis_client.connection_pool.connection_kwargs
+
+    assert api["socket_timeout"] == settings.REDIS_SOCKET_TIMEOUT_MS / 1000
+    assert lote["socket_timeout"] == settings.REDIS_BATCH_SOCKET_TIMEOUT_MS / 1000
+
+
+@pytest.mark.asyncio
+async def test_get_many_user_features_mantem_ordem_e_repopula_cache():
+    service = _service_com_fakeredis()
+    service.janelas = None
+    service._update_cache("a", {"pix_volume": 1.0, "historico_transacoes": [{"valor": 1}]})
+    consultados = []
+
+    async def _get_many_from_db(user_ids):
+        consultados.append(list(user_ids))
+        return {user_id: {"pix_volume": 2.0} for user_id in user_ids}
+
+    service._get_many_from_db = _get_many_from_db
+
+    resultado = await service.get_many_user_features(["b", "a", "b"])
+
+    assert [f["pix_volume"] for f in resultado] == [2.0, 1.0, 2.0]
+    assert resultado[1]["historico_transacoes"] == [{"valor": 1}]
+    assert consultados == [["b"]]
+    assert service.redis_client.exists("user_features:{b}")
+
+
+def test_event_operations_chargeback_incrementa_e_marca_transacao():
+    from datetime import datetime
+
+    service = FeatureService()
+    operacoes = service._event_operations("chargeback", {}, datetime.utcnow())
+
+    assert operacoes["incr"] == {"total_chargebacks": 1}
+    assert operacoes["marcar_ultima_transacao"] == "chargeback"
+    assert service._event_operations("desconhecido", {}, datetime.utcnow()) is None
+
+
+def _service_com_fakeredis():
+    import fakeredis
+    from app.services.window_store import WindowStore
+    service = FeatureService()
+    service.redis_client = fakeredis.FakeRedis()
+    service._release_lock_script = service.redis_client.register_script(RELEASE_LOCK_SCRIPT)
+    service._apply_operations_script = service.redis_client.register_script(APPLY_OPERATIONS_SCRIPT)
+    service._write_derived_script = service.redis_client.register_script(WRITE_DERIVED_SCRIPT)
+    service._hydrate_script = service.redis_client.register_script(HYDRATE_SCRIPT)
+    service._rebuild_script = service.redis_client.register_script(REBUILD_SCRIPT)
+    service.janelas = WindowStore(service.redis_client)
+    return service
+
+
+def test_vetor_do_modelo_e_materializado_na_escrita():
+    service = _service_com_fakeredis()
+    nomes = ["pix_volume", "chargeback_rate", "last_transaction_date", "transacoes_1h"]
+    service.register_vector_schema("esquema1", nomes)
+
+    service._update_cache("u1", {"pix_volume": 150.0, "chargeback_rate": 0.5, "last_transaction_date": "2024-01-01"})
+    service.janelas.record("u1", "pix_payment", {"amount": 10}, datetime.utcnow())
+
+    vetor = service.get_feature_vector("u1", "esquema1", nomes)
+    assert vetor.dtype == np.float32
+    assert vetor.tolist() == [150.0, 0.5, 0.0, 1.0]
+
+
+def test_vetor_de_esquema_novo_e_reconstruido_sob_demanda():
+    service = _service_com_fakeredis()
+    service.register_vector_schema("esquema1", ["pix_volume"])
+    service._update_cache("u1", {"pix_volume": 150.0, "account_age_days": 30})
+
+    assert service.get_feature_vector("u1", "esquema2", ["account_age_days", "pix_volume"]) is None
+
+    service.store_feature_vector("u1", "esquema2", ["account_age_days", "pix_volume"], {"pix_volume": 150.0, "account_age_days": 30})
+    assert service.get_feature_vector("u1", "esquema2", ["account_age_days", "pix_volume"]).tolist() == [30.0, 150.0]
+
+
+def test_reconstrucao_do_vetor_nao_sobrescreve_o_do_caminho_de_escrita():
+    service = _service_com_fakeredis()
+    service.janelas = None
+    nomes = ["pix_volume"]
+    service.register_vector_schema("esquema1", nomes)
+    # Evento aplicado depois da leitura que alimenta a reconstrução
+    service._update_cache("u1", {"pix_volume": 200.0})
+
+    service.store_feature_vector("u1", "esquema1", nomes, {"pix_volume": 100.0})
+
+    assert service.get_feature_vector("u1", "esquema1", nomes).tolist() == [200.0]
+
+
+def test_esquemas_sem_uso_deixam_de_ser_materializados(monkeypatch):
+    import time
+    from app.core.config import settings
+    from app.services.feature_service import VECTOR_SCHEMAS_KEY, VECTOR_SCHEMAS_SEEN_KEY
+
+    service = _service_com_fakeredis()
+    service.janelas = None
+    service.register_vector_schema("antigo", ["pix_volume"])
+    service.register_vector_schema("atual", ["pix_volume"])
+    service.redis_client.hset(VECTOR_SCHEMAS_KEY, "legado", '["pix_volume"]')
+    service.redis_client.hset(VECTOR_SCHEMAS_SEEN_KEY, "antigo", time.time() - 2 * settings.FEATURE_VECTOR_SCHEMA_IDLE_SECONDS)
+    service._esquemas_validos_ate = 0.0
+
+    service._update_cache("u1", {"pix_volume": 10.0})
+
+    assert set(service._vector_schemas()) == {"atual", "legado"}
+    assert service.redis_client.hkeys(VECTOR_SCHEMAS_KEY) and b"antigo" not in service.redis_client.hkeys(VECTOR_SCHEMAS_KEY)
+    assert service.redis_client.hexists(VECTOR_SCHEMAS_SEEN_KEY, "legado")
+    assert service.redis_client.get(service._vector_key("u1", "antigo")) is None
+    assert service.redis_client.get(service._vector_key("u1", "atual")) is not None
+
+
+@pytest.mark.asyncio
+async def test_sem_orcamento_para_o_banco_serve_a_entrada_expirada(monkeypatch):
+    import json
+    import time
+    from app.core.config import settings
+    from app.core.resilience import DeadlineExceeded
+
+    service = _service_com_fakeredis()
+    service.janelas = None
+    service._update_cache("u1", {"pix_volume": 150.0})
+    service.redis_client.hset("user_features:{u1}", "_expires_at", json.dumps(time.time() - 1))
+    monkeypatch.setattr(settings, "FEATURE_CACHE_STALE_SECONDS", 0)
+
+    async def _sem_orcamento(user_id):
+        raise DeadlineExceeded("sem orçamento")
+
+    service._rebuild = _sem_orcamento
+    features, resultado = await service.get_user_features_with_status("u1")
+
+    assert resultado == "stale"
+    assert features["pix_volume"] == 150.0
+
+
+@pytest.mark.asyncio
+async def test_leitura_em_massa_exige_a_escrita_mais_nova_de_cada_lote(monkeypatch):
+    from app.services import feature_service as modulo
+    service = _service_com_fakeredis()
+    service.TAMANHO_LOTE = 2
+    service.redis_client.set(service._escrita_key("a"), 100.0)
+    service.redis_client.set(service._escrita_key("b"), 105.5)
+    service.redis_client.set(service._escrita_key("d"), 90.0)
+    chamadas = []
+
+    class _RouterFalso:
+        enabled = True
+
+        def run(self, consulta, user_ids=(), escrita_em=0.0, primary=False):
+            chamadas.append((list(user_ids), escrita_em, primary))
+            return []
+
+    monkeypatch.setattr(modulo, "read_router", _RouterFalso())
+    resultado = await service._get_many_from_db(["a", "b", "c", "d", "e"])
+
+    assert chamadas == [(["a", "b"], 105.5, False), (["c", "d"], 90.0, False), (["e"], 0.0, False)]
+    assert set(resultado) == {"a", "b", "c", "d", "e"}
+
+
+@pytest.mark.asyncio
+async def test_janelas_so_contam_o_evento_depois_de_aplicado():
+    service = _service_com_fakeredis()
+    service.redis_primario = True
+    evento = {"user_id": "u1", "type": "pix_payment", "data": {"amount": 10.0}, "timestamp": "não é data"}
+
+    async def _falha(user_id, operacoes):
+        raise RuntimeError("falha ao aplicar")
+
+    aplicar = service._process_event_redis
+    service._process_event_redis = _falha
+    with pytest.raises(RuntimeError):
+        await service.process_event(evento)
+    assert service.janelas.features("u1")["transacoes_1h"] == 0
+
+    # Reentrega depois da falha: conta uma vez só
+    service._process_event_redis = aplicar
+    service._update_cache("u1", service._get_default_features())
+    await service.process_event(evento)
+    assert service.janelas.features("u1")["transacoes_1h"] == 1
+
+
+def _eventos_de_teste():
+    agora = datetime(2024, 1, 1, 12, 0)
+    eventos = [("pix_payment", {"amount": 10.0 * i}) for i in range(1, 25)]
+    eventos += [("chargeback", {}), ("refund", {}), ("app_connection", {})]
+    eventos += [("login", {"device_id": f"d{i}", "cidade": "SP"}) for i in range(12)]
+    return [(tipo, dados, agora) for tipo, dados in eventos]
+
+
+def test_operacoes_no_python_e_no_lua_chegam_ao_mesmo_estado():
+    service = _service_com_fakeredis()
+    service.janelas = None
+    service._update_cache("u1", service._get_default_features())
+    features = service._get_default_features()
+
+    for tipo, dados, quando in _eventos_de_teste():
+        operacoes = service._event_operations(tipo, dados, quando)
+        features = service._apply_operations(features, operacoes)
+        service._apply_operations_cache("u1", operacoes)
+
+    no_redis = service._get_from_cache("u1")["data"]
+    assert no_redis == features
+    assert len(features["historico_transacoes"]) == service.HISTORICO_TRANSACOES
+    assert features["historico_transacoes"][-1]["chargeback"] is True
+    assert features["historico_transacoes"][-1]["reembolsada"] is True
+    assert len(features["historico_logins"]) == service.HISTORICO_LOGINS
+    assert features["pix_volume"] == sum(10.0 * i for i in range(1, 25))
+
+
+@pytest.mark.asyncio
+async def test_modo_redis_marca_o_sujo_no_script_e_preserva_derivadas_mais_novas():
+    import json
+
+    service = _service_com_fakeredis()
+    service.janelas = None
+    service.redis_primario = True
+    service._update_cache("u1", service._get_default_features())
+
+    await service.process_event({"user_id": "u1", "type": "pix_payment", "data": {"amount": 10.0}})
+    assert service.redis_client.smembers(DIRTY_SET_KEY) == {b"u1"}
+    assert service._get_from_cache("u1")["data"]["avg_transaction_value"] == 10.0
+
+    # Outro evento entre a leitura do estado e a gravação das derivadas
+    seq_lido = service.redis_client.hget("user_features:{u1}", "_seq")
+    operacoes = service._event_operations("pix_payment", {"amount": 30.0}, datetime.utcnow())
+    service._apply_operations_cache("u1", operacoes, marcar_sujo=True)
+    atrasada = service._write_derived_script(
+        keys=["user_features:{u1}"],
+        args=[seq_lido, json.dumps({"avg_transaction_value": json.dumps(999.0)}), 60]
+    )
+
+    assert atrasada == 0
+    features = service._get_from_cache("u1")["data"]
+    assert features["avg_transaction_value"] == 10.0
+    assert "_seq" not in features
+
+
+def test_incrementos_concorrentes_no_lua_nao_se_perdem():
+    from concurrent.futures import ThreadPoolExecutor
+
+    service = _service_com_fakeredis()
+    service.janelas = None
+    service._update_cache("u1", service._get_default_features())
+    operacoes = service._event_operations("pix_payment", {"amount": 1.5}, datetime.utcnow())
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(lambda _: service._apply_operations_cache("u1", operacoes), range(200)))
+
+    features = service._get_from_cache("u1")["data"]
+    assert features["total_transactions"] == 200
+    assert features["pix_volume"] == 300.0
+
+
+def test_eventos_concorrentes_no_postgres_gravam_uma_vez_e_somam_tudo(postgres_engine, monkeypatch):
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+    from sqlalchemy.orm import sessionmaker
+    from app.services import feature_service
+
+    sessoes = sessionmaker(bind=postgres_engine)
+    monkeypatch.setattr(feature_service, "get_db", lambda: iter([sessoes()]))
+    service = _service_com_fakeredis()
+    service.janelas = None
+    evento = {"user_id": "u1", "type": "pix_payment", "data": {"amount": 2.0}}
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(lambda _: asyncio.run(service.process_event(evento)), range(50)))
+
+    with postgres_engine.connect() as conn:
+        no_banco = conn.execute(
+            UserFeature.__table__.select().where(UserFeature.user_id == "u1")
+        ).one().feature_data
+    assert no_banco["total_transactions"] == 50
+    assert no_banco["pix_volume"] == 100.0
+    assert no_banco["avg_transaction_value"] == 2.0
+    assert service._get_from_cache("u1")["data"] == no_banco
+    # As tabelas tipadas ficam para o snapshotter
+    assert service.redis_client.smembers(COLUMNS_DIRTY_SET_KEY) == {b"u1"}
+
+
+def _linhas_tipadas(engine, user_id):
+    from app.models.user_feature_columns import UserFeatureColumns, UserFeatureHistory
+
+    with engine.connect() as conn:
+        colunas = conn.execute(
+            UserFeatureColumns.__table__.select().where(UserFeatureColumns.user_id == user_id)
+        ).one()
+        historico = conn.execute(
+            UserFeatureHistory.__table__.select()
+            .where(UserFeatureHistory.user_id == user_id)
+            .order_by(UserFeatureHistory.tipo, UserFeatureHistory.posicao)
+        ).all()
+    return colunas, historico
+
+
+def test_sync_feature_columns_substitui_os_historicos_do_usuario(postgres_engine):
+    from sqlalchemy.orm import Session
+
+    service = FeatureService()
+    transacao = {"timestamp": "2024-01-01T10:00:00", "valor": 10.0, "categoria": "pix", "reembolsada": False, "chargeback": False}
+    login = {"timestamp": "2024-01-01T09:00:00", "device_id": "d1", "cidade": "SP", "estado": "SP"}
+    with Session(postgres_engine) as db:
+        service.sync_feature_columns(db, {"u1": {
+            "pix_volume": 10.0, "total_transactions": 1, "last_transaction_date": "2024-01-01T10:00:00",
+            "historico_transacoes": [transacao], "historico_logins": [login]
+        }})
+        db.commit()
+        service.sync_feature_columns(db, {"u1": {
+            "pix_volume": 30.0, "total_transactions": 2,
+            "historico_transacoes": [transacao, {**transacao, "valor": 20.0, "chargeback": True}]
+        }})
+        db.commit()
+
+    colunas, historico = _linhas_tipadas(postgres_engine, "u1")
+    assert colunas.pix_volume == 30.0
+    assert colunas.total_transactions == 2
+    assert colunas.last_transaction_date is None
+    assert [(h.tipo, h.posicao, h.valor, h.chargeback) for h in historico] == [
+        ("transacao", 0, 10.0, False), ("transacao", 1, 20.0, True)
+    ]
+
+
+def test_iter_feature_matrix_entrega_lotes_ordenados_com_nan(postgres_engine, monkeypatch):
+    from sqlalchemy.orm import Session
+    from app.services import feature_service
+
+    monkeypatch.setattr(feature_service, "batch_engine", postgres_engine)
+    service = FeatureService()
+    with Session(postgres_engine) as db:
+        service.sync_feature_columns(db, {
+            f"u{i}": {"pix_volume": float(i), "total_transactions": i if i % 2 else None}
+            for i in range(5)
+        })
+        db.commit()
+
+    lotes = list(service.iter_feature_matrix(["pix_volume", "total_transactions"], tamanho_lote=2))
+
+    assert [len(user_ids) for user_ids, _ in lotes] == [2, 2, 1]
+    user_ids = [u for ids, _ in lotes for u in ids]
+    matriz = np.vstack([m for _, m in lotes])
+    assert user_ids == [f"u{i}" for i in range(5)]
+    assert matriz.dtype == np.float64
+    assert matriz[:, 0].tolist() == [0.0, 1.0, 2.0, 3.0, 4.0]
+    assert np.isnan(matriz[[0, 2, 4], 1]).all()
+    assert matriz[[1, 3], 1].tolist() == [1.0, 3.0]
+
+
+def _contagens_do_cache():
+    from app.services.feature_service import FEATURE_CACHE_EVENTS
+    return {
+        resultado: FEATURE_CACHE_EVENTS.labels(result=resultado)._value.get()
+        for resultado in ("hit", "stale", "miss", "rebuild", "lock_wait")
+    }
+
+
+def _diferenca(antes, depois):
+    return {resultado: depois[resultado] - antes[resultado] for resultado in antes if depois[resultado] != antes[resultado]}
+
+
+def _service_com_banco_lento(valor=150.0, demora=0.05):
+    import asyncio
+
+    service = _service_com_fakeredis()
+    service.janelas = None
+    leituras = []
+
+    async def _get_from_db(user_id):
+        leituras.append(user_id)
+        await asyncio.sleep(demora)
+        return {"pix_volume": valor}
+
+    service._get_from_db = _get_from_db
+    return service, leituras
+
+
+@pytest.mark.asyncio
+async def test_misses_concorrentes_vao_ao_banco_uma_vez_so():
+    import asyncio
+
+    service, leituras = _service_com_banco_lento()
+    antes = _contagens_do_cache()
+
+    resultados = await asyncio.gather(*[service.get_user_features_with_status("u1") for _ in range(10)])
+
+    assert leituras == ["u1"]
+    assert all(features["pix_volume"] == 150.0 and status == "miss" for features, status in resultados)
+    assert _diferenca(antes, _contagens_do_cache()) == {"miss": 10, "rebuild": 1, "lock_wait": 9}
+    assert service.redis_client.get("user_features_lock:{u1}") is None
+
+
+@pytest.mark.asyncio
+async def test_entrada_expirada_e_servida_stale_enquanto_uma_chamada_reconstroi(monkeypatch):
+    import asyncio
+    import json
+    import time
+    from app.core.config import settings
+
+    monkeypatch.setattr(settings, "FEATURE_CACHE_STALE_SECONDS", 300)
+    service, leituras = _service_com_banco_lento(valor=200.0)
+    service._update_cache("u1", {"pix_volume": 150.0})
+    service.redis_client.hset("user_features:{u1}", "_expires_at", json.dumps(time.time() - 1))
+    antes = _contagens_do_cache()
+
+    resultados = await asyncio.gather(*[service.get_user_features_with_status("u1") for _ in range(5)])
+
+    assert all(features["pix_volume"] == 150.0 and status == "stale" for features, status in resultados)
+    await asyncio.gather(*service._refresh_tasks)
+    assert leituras == ["u1"]
+    assert _diferenca(antes, _contagens_do_cache()) == {"stale": 5, "rebuild": 1}
+
+    features, status = await service.get_user_features_with_status("u1")
+    assert (features["pix_volume"], status) == (200.0, "hit")
+    assert service.redis_client.get("user_features_lock:{u1}") is None
+
+
+def test_xfetch_antecipa_a_expiracao_conforme_o_custo_da_reconstrucao(monkeypatch):
+    import random
+    import time
+
+    service = FeatureService()
+    longe = {"expires_at": time.time() + 60, "delta": 0.0}
+    caro = {"expires_at": time.time() + 60, "delta": 10.0}
+
+    # -log(1 - 0.999) ≈ 6.9: antecipa até ~69s com reconstrução de 10s
+    monkeypatch.setattr(random, "random", lambda: 0.999)
+    assert not service._deve_reconstruir(longe)
+    assert service._deve_reconstruir(caro)
+
+    monkeypatch.setattr(random, "random", lambda: 0.0)
+    assert not service._deve_reconstruir(caro)
+    assert service._deve_reconstruir({"expires_at": time.time() - 1, "delta": 0.0})
+
+
+@pytest.mark.asyncio
+async def test_expiracao_antecipada_serve_hit_e_reconstroi_em_background(monkeypatch):
+    import asyncio
+    import random
+
+    service, leituras = _service_com_banco_lento(valor=200.0)
+    service._update_cache("u1", {"pix_volume": 150.0}, delta=1e6)
+    monkeypatch.setattr(random, "random", lambda: 0.5)
+    antes = _contagens_do_cache()
+
+    features, status = await service.get_user_features_with_status("u1")
+
+    assert (features["pix_volume"], status) == (150.0, "hit")
+    await asyncio.gather(*service._refresh_tasks)
+    assert leituras == ["u1"]
+    assert _diferenca(antes, _contagens_do_cache()) == {"hit": 1, "rebuild": 1}
+    assert service._get_from_cache("u1")["data"]["pix_volume"] == 200.0
+
+
+@pytest.mark.asyncio
+async def test_commit_que_falha_remove_tambem_os_vetores(monkeypatch):
+    from app.services import feature_service as modulo
+
+    service = _service_com_fakeredis()
+    service.janelas = None
+    service.register_vector_schema("esquema1", ["pix_volume"])
+
+    class _SessaoQueFalha:
+        def commit(self):
+            raise RuntimeError("commit falhou")
+
+        def rollback(self):
+            pass
+
+        def close(self):
+            pass
+
+    monkeypatch.setattr(modulo, "get_db", lambda: iter([_SessaoQueFalha()]))
+    service._apply_operations_db = lambda db, user_id, operacoes: {"pix_volume": 999.0}
+
+    with pytest.raises(RuntimeError):
+        await service.process_event({"user_id": "u1", "type": "pix_payment", "data": {"amount": 999.0}})
+
+    assert service._get_from_cache("u1") is None
+    assert service.get_feature_vector("u1", "esquema1", ["pix_volume"]) is None
+
+
+@pytest.mark.asyncio
+async def test_reconstrucao_nao_sobrescreve_escrita_feita_durante_a_leitura_do_banco():
+    import asyncio
+    import json
+    import time
+
+    service = _service_com_fakeredis()
+    service.janelas = None
+    service.register_vector_schema("esquema1", ["pix_volume"])
+    service._update_cache("u1", {"pix_volume": 100.0})
+    service.redis_client.hset("user_features:{u1}", "_expires_at", json.dumps(time.time() - 1))
+    lendo, escrito = asyncio.Event(), asyncio.Event()
+
+    async def _get_from_db(user_id):
+        # Snapshot anterior ao evento, que trava a linha e commita em seguida
+        lendo.set()
+        await escrito.wait()
+        return {"pix_volume": 100.0}
+
+    service._get_from_db = _get_from_db
+    features, status = await service.get_user_features_with_status("u1")
+    assert status == "stale"
+    await lendo.wait()
+    service._atualizar_cache_da_escrita("u1", {"pix_volume": 200.0})
+    service._registrar_escrita("u1", service.redis_client)
+    escrito.set()
+    await asyncio.gather(*service._refresh_tasks)
+
+    assert service._get_from_cache("u1")["data"]["pix_volume"] == 200.0
+    assert service.get_feature_vector("u1", "esquema1", ["pix_volume"]).tolist() == [200.0]
+
+
+@pytest.mark.asyncio
+async def test_reconstrucao_que_leu_o_banco_antes_do_commit_e_descartada():
+    import asyncio
+    import json
+    import time
+
+    service = _service_com_fakeredis()
+    service.janelas = None
+    service._update_cache("u1", {"pix_volume": 100.0})
+    service.redis_client.hset("user_features:{u1}", "_expires_at", json.dumps(time.time() - 1))
+
+    async def _get_from_db(user_id):
+        # A leitura não vê a escrita ainda não commitada; o commit vem logo depois
+        service._registrar_escrita(user_id, service.redis_client)
+        return {"pix_volume": 100.0}
+
+    service._get_from_db = _get_from_db
+    await service.get_user_features_with_status("u1")
+    # A escrita regrava o cache antes do commit, com a reconstrução já agendada
+    service._atualizar_cache_da_escrita("u1", {"pix_volume": 200.0})
+    await asyncio.gather(*service._refresh_tasks)
+
+    assert service._get_from_cache("u1")["data"]["pix_volume"] == 200.0
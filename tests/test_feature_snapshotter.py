@@ -0,0 +1,120 @@
+import fakeredis
+import pytest
+from app.services.feature_service import DIRTY_SET_KEY
+from app.workers.feature_snapshotter import FeatureSnapshotter
+
+
+class _FeatureServiceFalso:
+    def __init__(self, redis_client):
+        self.redis_client = redis_client
+
+
+def _redis_com_sujos(sujos):
+    redis_client = fakeredis.FakeRedis(decode_responses=True)
+    redis_client.sadd(DIRTY_SET_KEY, *sujos)
+    return redis_client
+
+
+def test_flush_devolve_usuarios_sujos_quando_snapshot_falha():
+    redis_client = _redis_com_sujos(["a", "b"])
+    snapshotter = FeatureSnapshotter(_FeatureServiceFalso(redis_client))
+
+    def _falha(user_ids):
+        raise RuntimeError("banco indisponível")
+
+    snapshotter._snapshot = _falha
+
+    with pytest.raises(RuntimeError):
+        snapshotter.flush()
+    assert redis_client.smembers(DIRTY_SET_KEY) == {"a", "b"}
+    assert not redis_client.exists(f"{DIRTY_SET_KEY}:processando")
+
+
+def test_lote_de_um_snapshotter_que_caiu_volta_no_proximo_flush():
+    redis_client = _redis_com_sujos(["a", "b", "c"])
+    snapshotter = FeatureSnapshotter(_FeatureServiceFalso(redis_client))
+    snapshotter.tamanho_lote = 2
+
+    def _queda(user_ids):
+        # Simula a morte do processo: nada é devolvido nem removido
+        raise SystemExit()
+
+    snapshotter._snapshot = _queda
+    with pytest.raises(SystemExit):
+        snapshotter._flush_shard(redis_client, DIRTY_SET_KEY, snapshotter._snapshot)
+    assert redis_client.scard(f"{DIRTY_SET_KEY}:processando") == 2
+
+    gravados = []
+    snapshotter._snapshot = gravados.extend
+    assert snapshotter.flush() == 3
+    assert sorted(gravados) == ["a", "b", "c"]
+    assert redis_client.scard(DIRTY_SET_KEY) == 0
+    assert not redis_client.exists(f"{DIRTY_SET_KEY}:processando")
+
+
+def test_snapshotter_sincroniza_as_tabelas_tipadas_no_modo_postgres(postgres_engine, monkeypatch):
+    import asyncio
+    import fakeredis
+    from sqlalchemy import func, select
+    from sqlalchemy.orm import sessionmaker
+    from app.models.user_feature_columns import UserFeatureColumns, UserFeatureHistory
+    from app.services import feature_service
+    from app.services.feature_service import FeatureService, COLUMNS_DIRTY_SET_KEY, APPLY_OPERATIONS_SCRIPT
+    from app.workers import feature_snapshotter
+
+    sessoes = sessionmaker(bind=postgres_engine)
+    monkeypatch.setattr(feature_service, "get_db", lambda: iter([sessoes()]))
+    monkeypatch.setattr(feature_snapshotter, "BatchSessionLocal", sessoes)
+    service = FeatureService()
+    service.redis_client = fakeredis.FakeRedis()
+    service._apply_operations_script = service.redis_client.register_script(APPLY_OPERATIONS_SCRIPT)
+    service.janelas = None
+    for user_id in ("a", "b"):
+        asyncio.run(service.process_event({"user_id": user_id, "type": "pix_payment", "data": {"amount": 5.0}}))
+
+    with postgres_engine.connect() as conn:
+        assert conn.execute(select(func.count()).select_from(UserFeatureColumns.__table__)).scalar() == 0
+
+    assert FeatureSnapshotter(service).flush() == 2
+    with postgres_engine.connect() as conn:
+        volumes = dict(conn.execute(select(UserFeatureColumns.user_id, UserFeatureColumns.pix_volume)).all())
+        historicos = conn.execute(select(func.count()).select_from(UserFeatureHistory.__table__)).scalar()
+    assert volumes == {"a": 5.0, "b": 5.0}
+    assert historicos == 2
+    assert service.redis_client.scard(COLUMNS_DIRTY_SET_KEY) == 0
+
+
+def test_sujo_sem_estado_no_redis_nao_e_descartado():
+    redis_client = _redis_com_sujos(["a", "perdido"])
+    snapshotter = FeatureSnapshotter(_FeatureServiceFalso(redis_client))
+    gravados = []
+
+    def _snapshot(user_ids):
+        gravados.extend(u for u in user_ids if u != "perdido")
+        return ["perdido"] if "perdido" in user_ids else []
+
+    snapshotter._snapshot = _snapshot
+    assert snapshotter.flush() == 1
+    assert gravados == ["a"]
+    assert redis_client.smembers(f"{DIRTY_SET_KEY}:processando") == {"perdido"}
+
+    # No próximo flush volta a ser tentado
+    gravados.clear()
+    snapshotter._snapshot = gravados.extend
+    assert snapshotter.flush() == 1
+    assert gravados == ["perdido"]
+    assert not redis_client.exists(f"{DIRTY_SET_KEY}:processando")
+
+
+def test_snapshot_conta_e_devolve_os_usuarios_sem_estado():
+    from app.workers.feature_snapshotter import SNAPSHOT_MISSING
+
+    class _Service(_FeatureServiceFalso):
+        def _get_many_from_cache(self, user_ids):
+            return {}
+
+    snapshotter = FeatureSnapshotter(_Service(fakeredis.FakeRedis()))
+    antes = SNAPSHOT_MISSING._value.get()
+
+    assert snapshotter._snapshot(["a", "b"]) == ["a", "b"]
+    assert SNAPSHOT_MISSING._value.get() - antes == 2
@@ -0,0 +1,50 @@
+import pytest
+from types import SimpleNamespace
+from app.core.middleware import route_template, ObservabilityMiddleware
+
+
+def test_route_template_usa_template_e_nao_path_bruto():
+    scope = {
+        "path": "/api/v1/scores/history/123",
+        "route": SimpleNamespace(path="/api/v1/scores/history/{user_id}")
+    }
+    assert route_template(scope) == "/api/v1/scores/history/{user_id}"
+    assert route_template({"path": "/nao-existe"}) == "<unmatched>"
+
+
+@pytest.mark.asyncio
+async def test_observability_middleware_propaga_trace_id():
+    async def app(scope, receive, send):
+        assert scope["state"]["trace_id"] == "abc"
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    enviados = []
+
+    async def send(message):
+        enviados.append(message)
+
+    scope = {"type": "http", "method": "GET", "path": "/x", "headers": [(b"x-trace-id", b"abc")]}
+    await ObservabilityMiddleware(app)(scope, None, send)
+
+    assert (b"x-trace-id", b"abc") in enviados[0]["headers"]
+
+
+@pytest.mark.asyncio
+async def test_observability_middleware_abre_deadline_reduzido_pelo_cliente():
+    from app.core.resilience import remaining
+    restantes = []
+
+    async def app(scope, receive, send):
+        restantes.append(remaining())
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    async def send(message):
+        pass
+
+    scope = {"type": "http", "method": "GET", "path": "/x", "headers": [(b"x-request-timeout-ms", b"50")]}
+    await ObservabilityMiddleware(app)(scope, None, send)
+
+    assert 0 < restantes[0] <= 0.05
+    assert remaining() is None
@@ -0,0 +1,63 @@
+import numpy as np
+from app.ml.model_manager import ModelManager
+
+
+class _ModeloFalso:
+    feature_names_in_ = np.array(["a", "b"])
+
+    def predict_proba(self, X):
+        X = np.asarray(X, dtype=float)
+        positivo = X[:, 0] / 10
+        return np.column_stack([1 - positivo, positivo])
+
+
+def test_predict_many_pontua_lote_na_ordem_das_features(tmp_path):
+    manager = ModelManager(model_dir=str(tmp_path))
+    manager.current_model = _ModeloFalso()
+    manager.current_version = "v1"
+
+    predicoes = manager.predict_many([{"b": 9, "a": 2}, {"a": 5}])
+
+    assert [p["score"] for p in predicoes] == [20.0, 50.0]
+    assert {p["version"] for p in predicoes} == {"v1"}
+
+
+def test_modelo_candidato_nao_substitui_o_de_producao(tmp_path):
+    manager = ModelManager(model_dir=str(tmp_path))
+    manager.current_model = _ModeloFalso()
+    manager.current_version = "v1"
+    manager.shadow_model = _ModeloFalso()
+    manager.shadow_version = "v2"
+
+    assert manager.predict_shadow({"a": 3}) == 30.0
+    assert manager.predict({"a": 1})["version"] == "v1"
+
+
+def test_predict_vector_igual_ao_predict_e_esquema_por_modelo(tmp_path):
+    manager = ModelManager(model_dir=str(tmp_path))
+    manager.current_model = _ModeloFalso()
+    manager.current_version = "v1"
+
+    assert manager.predict_vector(np.array([4, 1], dtype=np.float32))["score"] == manager.predict({"a": 4, "b": 1})["score"]
+    esquema = manager.schema_version
+    assert manager.feature_names == ["a", "b"]
+
+    outro = _ModeloFalso()
+    outro.feature_names_in_ = np.array(["b", "a"])
+    manager.current_model = outro
+    assert manager.schema_version != esquema
+
+
+def test_regressor_pontua_com_predict_na_escala_do_score(tmp_path):
+    class _Regressor:
+        feature_names_in_ = np.array(["a", "b"])
+
+        def predict(self, X):
+            return np.asarray(X, dtype=float)[:, 0] * 10
+
+    manager = ModelManager(model_dir=str(tmp_path))
+    manager.current_model = _Regressor()
+    manager.current_version = "v1"
+
+    assert [p["score"] for p in manager.predict_many([{"a": 4.5}, {"a": 12}, {"a": -1}])] == [45.0, 100.0, 0.0]
+    assert manager.predict_vector(np.array([3, 0], dtype=np.float32))["score"] == manager.predict({"a": 3})["score"] == 30.0
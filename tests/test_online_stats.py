@@ -0,0 +1,43 @@
+import numpy as np
+from scipy.stats import spearmanr
+from app.ml.online_stats import StreamingCorrelation
+
+
+def test_streaming_correlation_igual_ao_calculo_em_memoria():
+    rng = np.random.default_rng(42)
+    X = rng.normal(size=(20000, 3))
+    y = 2 * X[:, 0] - X[:, 1] + rng.normal(size=20000)
+    X[::7, 2] = np.nan
+
+    acumulador = StreamingCorrelation(["a", "b", "c"])
+    for inicio in range(0, len(y), 3000):
+        acumulador.update(X[inicio:inicio + 3000], y[inicio:inicio + 3000])
+
+    pearson = acumulador.pearson()
+    spearman = acumulador.spearman()
+    for j in range(3):
+        validos = ~np.isnan(X[:, j])
+        assert np.isclose(pearson[j], np.corrcoef(X[validos, j], y[validos])[0, 1])
+        assert abs(spearman[j] - spearmanr(X[validos, j], y[validos])[0]) < 0.01
+    assert acumulador.n[2] == np.count_nonzero(~np.isnan(X[:, 2]))
+
+
+def test_tabela_igual_a_contagem_por_coluna():
+    rng = np.random.default_rng(7)
+    escalas = np.array([1e-9, 1.0, 1e9, 3.0])
+    X = rng.normal(size=(5000, 4)) * escalas
+    X[:, 3] = np.round(X[:, 3])
+    X[::11, 1] = np.nan
+    y = X[:, 3] + rng.normal(size=5000)
+
+    acumulador = StreamingCorrelation(["a", "b", "c", "d"], n_bins=32)
+    acumulador.update(X[:2500], y[:2500])
+    acumulador.update(X[2500:], y[2500:])
+
+    esperada = np.zeros_like(acumulador.tabela)
+    bins_y = np.searchsorted(acumulador.bordas_y, y, side="right")
+    for j in range(4):
+        linhas = ~np.isnan(X[:, j])
+        bins_x = np.searchsorted(acumulador.bordas_x[:, j], X[linhas, j], side="right")
+        np.add.at(esperada[j], (bins_x, bins_y[linhas]), 1)
+    assert np.array_equal(acumulador.tabela, esperada)
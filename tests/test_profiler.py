@@ -0,0 +1,55 @@
+import threading
+import time
+from app.core.profiler import SamplingProfiler
+
+
+def test_to_collapsed_conta_pilhas_iguais():
+    profiler = SamplingProfiler()
+    amostras = [("main", "calcular"), ("main", "calcular"), ("main", "shap")]
+
+    linhas = profiler.to_collapsed(amostras).splitlines()
+
+    assert linhas == ["main;calcular 2", "main;shap 1"]
+
+
+def test_to_speedscope_indexa_frames_compartilhados():
+    profiler = SamplingProfiler()
+    perfil = profiler.to_speedscope([("main", "calcular"), ("main", "shap")])
+
+    nomes = [f["name"] for f in perfil["shared"]["frames"]]
+    assert nomes == ["main", "calcular", "shap"]
+    assert perfil["profiles"][0]["samples"] == [[0, 1], [0, 2]]
+
+
+def test_record_request_guarda_apenas_requisicoes_lentas():
+    profiler = SamplingProfiler()
+    profiler.enable_slow_requests(50)
+    try:
+        inicio = time.perf_counter()
+        while time.perf_counter() - inicio < 0.1:
+            pass
+        fim = time.perf_counter()
+        profiler.record_request(inicio, fim, {"endpoint": "/lenta"})
+        profiler.record_request(fim, fim + 0.001, {"endpoint": "/rapida"})
+    finally:
+        profiler.disable_slow_requests()
+
+    assert [p["endpoint"] for p in profiler.slow_profiles] == ["/lenta"]
+    assert profiler.slow_profiles[0]["samples"]
+    assert not profiler.running
+
+
+def test_religar_logo_apos_desligar_nao_deixa_duas_threads():
+    profiler = SamplingProfiler()
+    profiler.enable("a")
+    primeira = profiler._thread
+    profiler.disable("a")
+    profiler.enable("b")
+    try:
+        primeira.join(timeout=1)
+        assert not primeira.is_alive()
+        assert profiler.running
+        assert [t for t in threading.enumerate() if t.name == "sampling-profiler"] == [profiler._thread]
+    finally:
+        profiler.disable("b")
+    assert not profiler.running
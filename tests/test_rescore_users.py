@@ -0,0 +1,86 @@
+import csv
+import json
+import random
+
+import numpy as np
+from sqlalchemy import select
+
+from app.models.score import Score
+from app.models.user_feature import UserFeature
+from scripts import rescore_users
+
+
+class _ModeloFalso:
+    def predict_proba(self, matriz):
+        positivo = np.clip(matriz[:, 0] / 100, 0, 1)
+        return np.column_stack([1 - positivo, positivo])
+
+
+class _ModelManagerFalso:
+    current_model = _ModeloFalso()
+
+
+def _popular(engine, n):
+    with engine.begin() as conn:
+        conn.execute(UserFeature.__table__.insert(), [
+            {"user_id": f"u{i}", "feature_data": {"pix_volume": float(i * 10)}} for i in range(n)
+        ])
+
+
+def test_csv_do_lote_codifica_json_e_explicacao_ausente_como_null():
+    matriz = np.array([[1.5, 0.0], [2.0, 3.0]])
+    explicacoes = {1: [{"feature": "pix_volume", "description": 'valor "alto", acima da média'}]}
+
+    buffer = rescore_users.csv_do_lote(["u1", "u2"], [10.0, 20.0], matriz, ["pix_volume", "chargeback_rate"], explicacoes, "2024-01-01T00:00:00")
+
+    texto = buffer.getvalue()
+    linhas = list(csv.reader(texto.splitlines()))
+    assert json.loads(linhas[0][2]) == {"pix_volume": 1.5, "chargeback_rate": 0.0}
+    assert linhas[0][3] == ""
+    assert ',,2024-01-01T00:00:00' in texto.splitlines()[0]  # Campo vazio sem aspas: NULL no COPY
+    assert json.loads(linhas[1][3]) == explicacoes[1]
+
+
+def test_planejar_faixas_corta_pelo_user_id_e_deixa_a_ultima_aberta(postgres_engine, monkeypatch):
+    monkeypatch.setattr(rescore_users, "batch_engine", postgres_engine)
+    _popular(postgres_engine, 5)
+
+    assert rescore_users.planejar_faixas(2) == [(None, "u1"), ("u1", "u3"), ("u3", None)]
+
+
+def test_checkpoint_guarda_faixas_e_timestamp_para_a_retomada(tmp_path, monkeypatch):
+    caminho = str(tmp_path / "rescore.json")
+    monkeypatch.setattr(rescore_users, "planejar_faixas", lambda tamanho: [(None, "u1"), ("u1", None)])
+
+    checkpoint = rescore_users.carregar_checkpoint(caminho, 2)
+    checkpoint["concluidas"].append([None, "u1"])
+    rescore_users.gravar_checkpoint(caminho, checkpoint)
+
+    monkeypatch.setattr(rescore_users, "planejar_faixas", lambda tamanho: [(None, "outro")])
+    retomado = rescore_users.carregar_checkpoint(caminho, 2)
+    assert retomado["faixas"] == [(None, "u1"), ("u1", None)]
+    assert retomado["concluidas"] == [[None, "u1"]]
+    assert retomado["timestamp"] == checkpoint["timestamp"]
+
+
+def test_faixa_refeita_apos_o_commit_nao_duplica_scores(postgres_engine, monkeypatch):
+    monkeypatch.setattr(rescore_users, "batch_engine", postgres_engine)
+    _popular(postgres_engine, 6)
+    monkeypatch.setattr(rescore_users, "_worker", {
+        "model_manager": _ModelManagerFalso(),
+        "feature_names": ["pix_volume"],
+        "explainer": None,
+        "amostra_explicacao": 0.0,
+        "top_k": None,
+        "tamanho_lote": 2,
+        "timestamp": "2024-01-01T00:00:00",
+        "rng": random.Random(0)
+    })
+
+    # Commit da faixa sem checkpoint gravado (queda do processo), seguido da retomada
+    assert rescore_users.rescore_faixa(("u1", "u4")) == (("u1", "u4"), 3)
+    assert rescore_users.rescore_faixa(("u1", "u4")) == (("u1", "u4"), 3)
+
+    with postgres_engine.connect() as conn:
+        linhas = conn.execute(select(Score.user_id, Score.score, Score.explanation).order_by(Score.user_id)).all()
+    assert [(u, s, e) for u, s, e in linhas] == [("u2", 20.0, None), ("u3", 30.0, None), ("u4", 40.0, None)]
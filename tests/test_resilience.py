@@ -0,0 +1,89 @@
+import time
+import pytest
+from app.core.resilience import (
+    CircuitBreaker,
+    CircuitOpenError,
+    DeadlineExceeded,
+    ABERTO,
+    FECHADO,
+    MEIO_ABERTO,
+    remaining,
+    reset_deadline,
+    start_deadline,
+    timeout_for
+)
+
+
+class _Indisponivel(Exception):
+    pass
+
+
+def _falhar(breaker):
+    with pytest.raises(_Indisponivel):
+        with breaker.guard():
+            raise _Indisponivel()
+
+
+def test_circuito_abre_apos_falhas_seguidas_e_falha_na_hora():
+    breaker = CircuitBreaker("teste", falhas=(_Indisponivel,), failure_threshold=3, reset_timeout=60)
+    for _ in range(3):
+        _falhar(breaker)
+
+    assert breaker.estado == ABERTO
+    with pytest.raises(CircuitOpenError):
+        with breaker.guard():
+            pytest.fail("A chamada não deveria ser tentada")
+
+
+def test_erros_de_aplicacao_nao_abrem_o_circuito():
+    breaker = CircuitBreaker("teste", falhas=(_Indisponivel,), failure_threshold=1, reset_timeout=60)
+    with pytest.raises(ValueError):
+        with breaker.guard():
+            raise ValueError()
+
+    assert breaker.estado == FECHADO
+
+
+def test_meio_aberto_deixa_passar_uma_chamada_de_teste():
+    breaker = CircuitBreaker("teste", falhas=(_Indisponivel,), failure_threshold=1, reset_timeout=0.01)
+    _falhar(breaker)
+    time.sleep(0.02)
+
+    assert breaker.allow()
+    assert breaker.estado == MEIO_ABERTO
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.estado == FECHADO
+
+
+def test_falha_no_meio_aberto_reabre_o_circuito():
+    breaker = CircuitBreaker("teste", falhas=(_Indisponivel,), failure_threshold=5, reset_timeout=0.01)
+    for _ in range(5):
+        _falhar(breaker)
+    time.sleep(0.02)
+
+    _falhar(breaker)
+    assert breaker.estado == ABERTO
+
+
+def test_deadline_esgotado_nao_chama_a_dependencia():
+    breaker = CircuitBreaker("teste", falhas=(_Indisponivel,))
+    token = start_deadline(0)
+    try:
+        with pytest.raises(DeadlineExceeded):
+            with breaker.guard():
+                pytest.fail("A chamada não deveria ser tentada")
+    finally:
+        reset_deadline(token)
+    assert breaker.estado == FECHADO
+
+
+def test_timeout_e_limitado_pelo_orcamento_restante():
+    assert remaining() is None
+    assert timeout_for(0.5) == 0.5
+    token = start_deadline(0.1)
+    try:
+        assert timeout_for(0.5) <= 0.1
+        assert timeout_for(0.05) == 0.05
+    finally:
+        reset_deadline(token)
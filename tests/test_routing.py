@@ -0,0 +1,97 @@
+import os
+import time
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from app.db import routing
+from app.db.routing import ReadRouter, Replica, parse_lsn
+
+
+@pytest.fixture
+def router(monkeypatch):
+    primario = create_engine("sqlite://")
+    monkeypatch.setattr(routing, "SessionLocal", sessionmaker(bind=primario))
+    replica = Replica("replica-1", create_engine("sqlite://"))
+    replica.lsn, replica.lag = 100, 0.0
+    router = ReadRouter(primario, [replica], max_lag=2.0, sticky_seconds=30, max_clock_skew=0)
+    router._medidor_pid = os.getpid()  # Sem a thread de medição: o estado é montado pelos testes
+
+    def _sem_consulta_ao_primario():
+        raise AssertionError("run() e mark_write() não devem consultar o LSN do primário")
+
+    router._lsn_atual = _sem_consulta_ao_primario
+    return router
+
+
+def _destino(db):
+    return db.get_bind()
+
+
+def test_parse_lsn_compara_como_inteiro():
+    assert parse_lsn("0/16B3748") == 0x16B3748
+    assert parse_lsn("1/0") > parse_lsn("0/FFFFFFFF")
+
+
+def test_leitura_vai_para_replica_em_dia(router):
+    assert router.run(_destino) is router.replicas[0].engine
+
+
+def test_replica_atrasada_cai_para_o_primario(router):
+    router.replicas[0].lag = 5.0
+
+    assert router.run(_destino) is router.primary
+
+
+def test_read_your_writes_exige_replica_com_o_lsn_medido_depois_da_escrita(router):
+    router._medicoes.append((time.time() - 1, 120))
+    escrita = router.mark_write(["u1"])
+
+    # Nenhuma medição começou depois da escrita: só o primário garante tê-la
+    assert router.run(_destino, user_ids=["u1"]) is router.primary
+    assert router.run(_destino, user_ids=["u2"]) is router.replicas[0].engine
+    assert router.run(_destino, escrita_em=escrita) is router.primary
+
+    router._medicoes.append((escrita + 0.001, 200))
+    assert router.run(_destino, user_ids=["u1"]) is router.primary
+
+    router.replicas[0].lsn = 250
+    assert router.run(_destino, user_ids=["u1"]) is router.replicas[0].engine
+    assert router.run(_destino, escrita_em=escrita) is router.replicas[0].engine
+
+
+def test_refresh_guarda_o_lsn_do_primario_e_zera_o_atraso_de_replica_em_dia(router):
+    router._lsn_atual = lambda: 90
+    inicio = time.time()
+
+    class _Conexao:
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *args):
+            return False
+
+        def exec_driver_sql(self, sql):
+            class _Resultado:
+                def one(self):
+                    return "0/64", 12.0
+            return _Resultado()
+
+    router.replicas[0].engine = type("EngineFalso", (), {"connect": lambda self: _Conexao()})()
+    router.refresh()
+
+    assert router.replicas[0].lsn == 100 and router.replicas[0].lag == 0.0
+    assert router._medicoes[-1][0] >= inicio and router._medicoes[-1][1] == 90
+
+
+def test_falha_na_replica_cai_para_o_primario(router):
+    replica = router.replicas[0].engine
+
+    def _consulta(db):
+        if db.get_bind() is replica:
+            raise OperationalError("SELECT 1", {}, Exception("réplica fora do ar"))
+        return "primario"
+
+    assert router.run(_consulta) == "primario"
@@ -1,9 +1,57 @@
 import pytest
-from app.services.score_service import ScoreService
+from app.services.score_service import ScoreService, build_explanations
 
 
 def test_score_service_instancia():
     try:
         service = ScoreService()
     except Exception as e:
-        pytest.fail(f"Falha ao instanciar ScoreService: {e}") 
\ No newline at end of file
+        pytest.fail(f"Falha ao instanciar ScoreService: {e}")
+
+
+def test_build_explanations_seleciona_top_k_por_impacto():
+    explicacoes = build_explanations(
+        ["a", "b", "c"],
+        [[1.0, 2.0, 3.0], [1.0, 2.0, 3.0]],
+        [[0.05, -0.5, 0.2], [0.3, 0.0, -0.01]],
+        top_k=2
+    )
+
+    assert [e["feature"] for e in explicacoes[0]] == ["b", "c"]
+    assert [e["feature"] for e in explicacoes[1]] == ["a", "c"]
+    assert explicacoes[0][0]["description"] == "O valor de b (2.00) diminuiu significativamente o score"
+    assert explicacoes[0][1]["description"] == "O valor de c (3.00) aumentou significativamente o score"
+
+
+def test_build_explanations_sem_top_k_mantem_ordem_das_colunas():
+    explicacao = build_explanations(["a", "b"], [[1.0, 2.0]], [[0.01, -0.02]])[0]
+
+    assert [e["feature"] for e in explicacao] == ["a", "b"]
+    assert explicacao[0]["description"] == "O valor de a (1.00) aumentou levemente o score"
+
+
+def test_falha_do_mlflow_mantem_o_ultimo_modelo_carregado(monkeypatch):
+    from app.core.resilience import CircuitBreaker, CircuitOpenError
+    from app.services import score_service
+
+    monkeypatch.setattr(score_service, "mlflow_breaker", CircuitBreaker("mlflow_teste"))
+    monkeypatch.setattr(ScoreService, "_create_explainer", lambda self, model: f"explainer_{model}")
+    modelos = iter([ConnectionError("mlflow fora do ar"), "v1", ConnectionError("mlflow fora do ar")])
+
+    def _load_model(self):
+        modelo = next(modelos)
+        if isinstance(modelo, Exception):
+            raise modelo
+        return modelo
+
+    monkeypatch.setattr(ScoreService, "_load_model", _load_model)
+    monkeypatch.setattr(ScoreService, "_carregar_em_segundo_plano", lambda self: None)
+    service = ScoreService()
+
+    assert not service.refresh_model()
+    with pytest.raises(CircuitOpenError):
+        service._explainer_carregado()
+    assert service.refresh_model()
+    assert not service.refresh_model()
+    assert service.model == "v1"
+    assert service._explainer_carregado() == "explainer_v1"
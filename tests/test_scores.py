@@ -0,0 +1,109 @@
+import httpx
+import orjson
+import pytest
+from fastapi import FastAPI
+
+from app.api.v1.endpoints import scores
+from app.core.security import get_current_user
+
+
+@pytest.fixture
+def app_stream(monkeypatch):
+    pontuados = []
+
+    async def _score_chunk(registros, trace_id, top_k):
+        pontuados.append([numero for numero, _ in registros])
+        return [{"user_id": r.user_id, "score": 50.0} for _, r in registros]
+
+    monkeypatch.setattr(scores, "_score_chunk", _score_chunk)
+    monkeypatch.setattr(scores.settings, "SCORE_STREAM_CHUNK_SIZE", 2)
+    app = FastAPI()
+    app.include_router(scores.router, prefix="/api/v1/scores")
+    app.dependency_overrides[get_current_user] = lambda: {"sub": "teste"}
+    app.pontuados = pontuados
+    return app
+
+
+def _linha(user_id):
+    return orjson.dumps({"user_id": user_id, "features": {}, "source_app": "teste"})
+
+
+async def _pedacos(*pedacos):
+    for pedaco in pedacos:
+        yield pedaco
+
+
+async def _linhas_do_corpo(corpo):
+    class _RequestFalso:
+        def stream(self):
+            return _pedacos(*corpo)
+
+    return [(numero, linha) async for numero, linha in scores._ndjson_lines(_RequestFalso())]
+
+
+@pytest.mark.asyncio
+async def test_ndjson_lines_junta_linhas_partidas_entre_pedacos_e_pula_vazias():
+    linhas = await _linhas_do_corpo([b'{"a": 1}\n{"b"', b': 2}\n\n', b'{"c": 3}'])
+
+    assert linhas == [(1, b'{"a": 1}'), (2, b'{"b": 2}'), (4, b'{"c": 3}')]
+
+
+@pytest.mark.asyncio
+async def test_ndjson_lines_recusa_linha_acima_do_limite(monkeypatch):
+    monkeypatch.setattr(scores.settings, "SCORE_STREAM_MAX_LINE_BYTES", 10)
+
+    with pytest.raises(ValueError, match="Linha 2 excede 10 bytes"):
+        await _linhas_do_corpo([b'{"a": 1}\n', b'x' * 11])
+
+
+@pytest.mark.asyncio
+async def test_stream_responde_linhas_invalidas_sem_interromper_o_lote(app_stream):
+    corpo = b"\n".join([_linha("u1"), b"{quebrado", b'{"user_id": "u2"}', _linha("u3"), _linha("u4")])
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app_stream), base_url="http://teste") as client:
+        resposta = await client.post("/api/v1/scores/calculate/stream", content=corpo)
+
+    linhas = [orjson.loads(l) for l in resposta.content.splitlines()]
+    erros = [l["line"] for l in linhas if "error" in l]
+    assert erros == [2, 3]
+    assert [l["user_id"] for l in linhas if "score" in l] == ["u1", "u3", "u4"]
+    assert app_stream.pontuados == [[1, 4], [5]]
+
+
+@pytest.mark.asyncio
+async def test_stream_linha_acima_do_limite_encerra_com_erro(app_stream, monkeypatch):
+    monkeypatch.setattr(scores.settings, "SCORE_STREAM_MAX_LINE_BYTES", 100)
+    corpo = _linha("u1") + b"\n" + b'{"user_id": "' + b"x" * 200
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app_stream), base_url="http://teste") as client:
+        resposta = await client.post("/api/v1/scores/calculate/stream", content=corpo)
+
+    linhas = [orjson.loads(l) for l in resposta.content.splitlines()]
+    assert linhas == [{"error": "Linha 2 excede 100 bytes"}]
+    assert app_stream.pontuados == []
+
+
+@pytest.mark.asyncio
+async def test_desconexao_do_cliente_interrompe_o_processamento(app_stream):
+    mensagens = [
+        {"type": "http.request", "body": _linha("u1") + b"\n", "more_body": True},
+        {"type": "http.disconnect"},
+    ]
+    enviados = []
+
+    async def receive():
+        return mensagens.pop(0)
+
+    async def send(mensagem):
+        enviados.append(mensagem)
+
+    scope = {
+        "type": "http", "http_version": "1.1", "method": "POST", "scheme": "http",
+        "path": "/api/v1/scores/calculate/stream", "raw_path": b"/api/v1/scores/calculate/stream",
+        "root_path": "", "query_string": b"", "headers": [], "server": ("teste", 80), "client": ("teste", 1)
+    }
+    await app_stream(scope, receive, send)
+
+    assert app_stream.pontuados == []
+    corpo = b"".join(m.get("body", b"") for m in enviados if m["type"] == "http.response.body")
+    assert corpo == b""
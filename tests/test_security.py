@@ -0,0 +1,59 @@
+import hashlib
+import time
+import pytest
+from datetime import timedelta
+from fastapi import HTTPException
+from app.core import security
+from app.core.security import TokenCache, create_access_token, get_current_user
+
+
+@pytest.mark.asyncio
+async def test_get_current_user_verifica_token_uma_vez(monkeypatch):
+    security.token_cache.clear()
+    chamadas = []
+    decode_original = security._decode_token
+
+    def decode_contando(token):
+        chamadas.append(token)
+        return decode_original(token)
+
+    monkeypatch.setattr(security, "_decode_token", decode_contando)
+    token = create_access_token({"sub": "user_1"}, timedelta(minutes=5))
+
+    primeiro = await get_current_user(token)
+    segundo = await get_current_user(token)
+
+    assert primeiro == segundo == {"user_id": "user_1", "roles": []}
+    assert len(chamadas) == 1
+
+
+@pytest.mark.asyncio
+async def test_get_current_user_rejeita_token_expirado():
+    security.token_cache.clear()
+    token = create_access_token({"sub": "user_1"}, timedelta(seconds=-1))
+
+    with pytest.raises(HTTPException) as erro:
+        await get_current_user(token)
+    assert erro.value.status_code == 401
+
+
+def test_token_cache_respeita_exp_e_tamanho():
+    cache = TokenCache(max_size=2, max_ttl=300)
+    cache.set(b"expirado", {"user_id": "a"}, exp=time.time() - 1)
+    cache.set(b"b", {"user_id": "b"}, exp=None)
+    cache.set(b"c", {"user_id": "c"}, exp=None)
+    cache.set(b"d", {"user_id": "d"}, exp=None)
+
+    assert cache.get(b"expirado") is None
+    assert cache.get(b"b") is None  # Removido pelo LRU
+    assert cache.get(b"d") == {"user_id": "d"}
+
+
+@pytest.mark.asyncio
+async def test_get_current_user_aceita_token_de_servico(monkeypatch):
+    digest = hashlib.sha256(b"token-interno").digest()
+    monkeypatch.setattr(security, "service_tokens", {digest: {"user_id": "service:bff", "roles": ["service"]}})
+
+    usuario = await get_current_user("token-interno")
+
+    assert usuario == {"user_id": "service:bff", "roles": ["service"]}
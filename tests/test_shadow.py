@@ -0,0 +1,62 @@
+import threading
+import fakeredis
+from app.core.concurrency import AdaptiveConcurrencyLimiter
+from app.ml.shadow import ShadowScorer
+
+
+class _ManagerFalso:
+    shadow_version = "v2"
+
+    def __init__(self, liberar=None):
+        self.shadow_model = object()
+        self.liberar = liberar
+
+    def predict_shadow(self, features):
+        if self.liberar is not None:
+            self.liberar.wait(5)
+        return features["score_candidato"]
+
+
+def _esperar(scorer):
+    scorer._executor.shutdown(wait=True)
+
+
+def test_deltas_sao_agregados_por_par_de_versoes():
+    scorer = ShadowScorer(_ManagerFalso(), fakeredis.FakeRedis(), sample_rate=1.0, max_concurrency=1, max_pending=10)
+
+    assert scorer.submit({"score_candidato": 60.0}, 50.0, "v1")
+    assert scorer.submit({"score_candidato": 40.0}, 50.0, "v1")
+    _esperar(scorer)
+
+    resumo, = scorer.summary()
+    assert resumo["model_version"] == "v1" and resumo["shadow_version"] == "v2"
+    assert resumo["n"] == 2
+    assert resumo["mean_delta"] == 0.0
+    assert resumo["mean_abs_delta"] == 10.0
+    assert resumo["std_delta"] == 10.0
+
+
+def test_trabalho_e_descartado_com_executor_cheio():
+    liberar = threading.Event()
+    scorer = ShadowScorer(_ManagerFalso(liberar), sample_rate=1.0, max_concurrency=1, max_pending=1)
+
+    assert scorer.submit({"score_candidato": 1.0}, 0.0, "v1")
+    assert not scorer.submit({"score_candidato": 1.0}, 0.0, "v1")
+    liberar.set()
+    _esperar(scorer)
+
+
+def test_trabalho_e_descartado_sob_carga():
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=2, min_limit=1, max_limit=10)
+    limiter.try_acquire("critical")
+    scorer = ShadowScorer(_ManagerFalso(), limiter=limiter, sample_rate=1.0, max_concurrency=1, max_pending=10)
+
+    assert not scorer.submit({"score_candidato": 1.0}, 0.0, "v1")
+
+
+def test_sem_candidato_nada_e_agendado():
+    manager = _ManagerFalso()
+    manager.shadow_model = None
+    scorer = ShadowScorer(manager, sample_rate=1.0, max_concurrency=1, max_pending=10)
+
+    assert not scorer.submit({"score_candidato": 1.0}, 0.0, "v1")
@@ -0,0 +1,225 @@
+import shutil
+import socket
+import subprocess
+import time
+from datetime import datetime
+
+import fakeredis
+import pytest
+import redis
+
+from app.core.sharding import (
+    HashRing, ShardedRedis, TopologyError, check_topology, hash_tag, rebalance, shards
+)
+from app.services.feature_service import (
+    FeatureService, DIRTY_SET_KEY, RELEASE_LOCK_SCRIPT, APPLY_OPERATIONS_SCRIPT, WRITE_DERIVED_SCRIPT, HYDRATE_SCRIPT, REBUILD_SCRIPT
+)
+from app.services.window_store import WindowStore
+from app.workers.feature_snapshotter import FeatureSnapshotter
+
+
+def _sharded(n=3):
+    clientes = {f"no{i}": fakeredis.FakeRedis(server=fakeredis.FakeServer()) for i in range(n)}
+    return ShardedRedis(clientes, local_keys=(DIRTY_SET_KEY,))
+
+
+def _service(redis_client):
+    service = FeatureService()
+    service.redis_client = redis_client
+    service._release_lock_script = redis_client.register_script(RELEASE_LOCK_SCRIPT)
+    service._apply_operations_script = redis_client.register_script(APPLY_OPERATIONS_SCRIPT)
+    service._write_derived_script = redis_client.register_script(WRITE_DERIVED_SCRIPT)
+    service._hydrate_script = redis_client.register_script(HYDRATE_SCRIPT)
+    service._rebuild_script = redis_client.register_script(REBUILD_SCRIPT)
+    service.janelas = WindowStore(redis_client)
+    return service
+
+
+def test_hash_tag_usa_o_conteudo_das_chaves():
+    assert hash_tag("user_features:{u1}:transacoes") == "u1"
+    assert hash_tag("user_windows:{u1}:1h") == "u1"
+    assert hash_tag("sem_tag") == "sem_tag"
+    assert hash_tag("vazia:{}") == "vazia:{}"
+
+
+def test_incluir_no_move_apenas_as_chaves_que_ele_assume():
+    anel = HashRing(["a", "b", "c"], vnodes=160)
+    chaves = [f"user_features:{{u{i}}}" for i in range(5000)]
+    antes = {chave: anel.node_for(chave) for chave in chaves}
+
+    anel.add_node("d")
+    depois = {chave: anel.node_for(chave) for chave in chaves}
+
+    movidas = [chave for chave in chaves if antes[chave] != depois[chave]]
+    assert all(depois[chave] == "d" for chave in movidas)
+    assert 0.15 < len(movidas) / len(chaves) < 0.35
+
+
+def test_pipeline_devolve_respostas_na_ordem_entre_nos():
+    sharded = _sharded()
+    for i in range(20):
+        sharded.set(f"k:{{u{i}}}", i)
+
+    pipe = sharded.pipeline(transaction=False)
+    for i in reversed(range(20)):
+        pipe.get(f"k:{{u{i}}}")
+
+    assert [int(v) for v in pipe.execute()] == list(reversed(range(20)))
+    assert sum(c.dbsize() for c in shards(sharded)) == 20
+    assert all(c.dbsize() > 0 for c in shards(sharded))
+
+
+def test_transacao_recusa_chaves_em_nos_diferentes():
+    sharded = _sharded()
+    nos = {}
+    i = 0
+    while len(nos) < 2:
+        nos.setdefault(sharded.ring.node_for(f"u{i}"), f"u{i}")
+        i += 1
+    a, b = nos.values()
+
+    pipe = sharded.pipeline(transaction=True)
+    pipe.set(f"x:{{{a}}}", 1)
+    with pytest.raises(ValueError):
+        pipe.set(f"x:{{{b}}}", 1)
+
+
+def test_features_de_um_usuario_ficam_no_mesmo_no():
+    sharded = _sharded()
+    service = _service(sharded)
+    service._update_cache("u1", {"pix_volume": 10.0, "historico_transacoes": [{"valor": 1}]})
+    service.janelas.record("u1", "pix_payment", {"amount": 10}, datetime.utcnow())
+
+    com_dados = [c for c in shards(sharded) if c.dbsize()]
+    assert len(com_dados) == 1
+    assert com_dados[0] is sharded.client_for("user_features:{u1}")
+
+
+@pytest.mark.asyncio
+async def test_leitura_em_massa_entre_nos_mantem_a_ordem():
+    sharded = _sharded()
+    service = _service(sharded)
+    service.janelas = None
+    user_ids = [f"u{i}" for i in range(30)]
+    for i, user_id in enumerate(user_ids):
+        service._update_cache(user_id, {"pix_volume": float(i)})
+
+    async def _sem_banco(ids):
+        raise AssertionError(f"miss inesperado: {ids}")
+
+    service._get_many_from_db = _sem_banco
+    resultado = await service.get_many_user_features(list(reversed(user_ids)))
+
+    assert [f["pix_volume"] for f in resultado] == [float(i) for i in reversed(range(30))]
+
+
+def test_snapshotter_esvazia_o_conjunto_de_sujos_de_cada_no():
+    sharded = _sharded()
+    sujos = [f"u{i}" for i in range(12)]
+    for user_id in sujos:
+        pipe = sharded.pipeline(transaction=True)
+        pipe.set(f"user_features:{{{user_id}}}", 1)
+        pipe.sadd(DIRTY_SET_KEY, user_id)
+        pipe.execute()
+
+    class _FeatureServiceFalso:
+        redis_client = sharded
+
+    snapshotter = FeatureSnapshotter(_FeatureServiceFalso())
+    gravados = []
+    snapshotter._snapshot = gravados.extend
+
+    assert snapshotter.flush() == len(sujos)
+    assert sorted(gravados) == sorted(sujos)
+    for cliente in shards(sharded):
+        assert cliente.scard(DIRTY_SET_KEY) == 0
+
+
+def test_lista_de_nos_diferente_da_registrada_impede_a_partida():
+    servidores = {f"no{i}": fakeredis.FakeServer() for i in range(3)}
+    antigo = ShardedRedis({n: fakeredis.FakeRedis(server=servidores[n]) for n in ("no0", "no1")})
+    check_topology(antigo)
+    check_topology(antigo)
+
+    novo = ShardedRedis({n: fakeredis.FakeRedis(server=s) for n, s in servidores.items()})
+    with pytest.raises(TopologyError):
+        check_topology(novo)
+    with pytest.raises(TopologyError):
+        antigo.add_node("no2", fakeredis.FakeRedis(server=servidores["no2"]))
+
+
+def test_rebalance_move_as_chaves_para_o_novo_dono_com_o_ttl():
+    servidores = {f"no{i}": fakeredis.FakeServer() for i in range(3)}
+    antigo = ShardedRedis(
+        {n: fakeredis.FakeRedis(server=servidores[n]) for n in ("no0", "no1")}, local_keys=(DIRTY_SET_KEY,)
+    )
+    service = _service(antigo)
+    for i in range(40):
+        service._update_cache(f"u{i}", {"pix_volume": float(i)})
+        service.janelas.record(f"u{i}", "login", {}, datetime.utcnow())
+    check_topology(antigo)
+
+    novo = ShardedRedis(
+        {n: fakeredis.FakeRedis(server=s) for n, s in servidores.items()}, local_keys=(DIRTY_SET_KEY,)
+    )
+    movidas = rebalance(antigo, novo)
+
+    assert movidas > 0
+    for nome, cliente in novo.clients.items():
+        for chave in cliente.scan_iter():
+            if chave != b"redis_topology":
+                assert novo.ring.node_for(chave.decode()) == nome
+                assert cliente.ttl(chave) > 0
+    check_topology(novo)
+    lido = _service(novo)
+    encontrados = lido._get_many_from_cache([f"u{i}" for i in range(40)])
+    assert {u: f["pix_volume"] for u, f in encontrados.items()} == {f"u{i}": float(i) for i in range(40)}
+    assert all(lido.janelas.features(f"u{i}")["logins_1h"] == 1 for i in range(40))
+
+
+def _porta_livre():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def servidores_redis():
+    """
+    Sobe alguns redis-server locais (pula se o binário não estiver instalado)
+    """
+    if shutil.which("redis-server") is None:
+        pytest.skip("redis-server não instalado")
+    portas = [_porta_livre() for _ in range(3)]
+    processos = [
+        subprocess.Popen(
+            ["redis-server", "--port", str(porta), "--save", "", "--appendonly", "no"],
+            stdout=subprocess.DEVNULL
+        )
+        for porta in portas
+    ]
+    urls = [f"redis://127.0.0.1:{porta}/0" for porta in portas]
+    for url in urls:
+        for _ in range(50):
+            try:
+                redis.from_url(url).ping()
+                break
+            except redis.exceptions.ConnectionError:
+                time.sleep(0.1)
+    yield urls
+    for processo in processos:
+        processo.terminate()
+        processo.wait()
+
+
+def test_cache_distribuido_em_redis_server_locais(servidores_redis):
+    sharded = ShardedRedis.from_urls(servidores_redis, local_keys=(DIRTY_SET_KEY,))
+    service = _service(sharded)
+    service.janelas = None
+    for i in range(50):
+        service._update_cache(f"u{i}", {"pix_volume": float(i)})
+
+    encontrados = service._get_many_from_cache([f"u{i}" for i in range(50)])
+
+    assert {u: f["pix_volume"] for u, f in encontrados.items()} == {f"u{i}": float(i) for i in range(50)}
+    assert all(c.dbsize() > 0 for c in shards(sharded))
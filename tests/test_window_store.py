@@ -0,0 +1,59 @@
+import fakeredis
+from datetime import datetime, timedelta
+from app.services.window_store import WindowStore, event_time
+
+AGORA = datetime(2024, 1, 31, 12, 0, 0)
+AGORA_S = (AGORA - datetime(1970, 1, 1)).total_seconds()
+
+
+def _store():
+    return WindowStore(fakeredis.FakeRedis())
+
+
+def test_eventos_fora_de_ordem_caem_nas_janelas_do_seu_instante():
+    store = _store()
+    store.record("u1", "pix_payment", {"amount": 100}, AGORA - timedelta(minutes=10), agora=AGORA_S)
+    store.record("u1", "pix_payment", {"amount": 50}, AGORA - timedelta(days=3), agora=AGORA_S)
+    store.record("u1", "pix_payment", {"amount": 30}, AGORA - timedelta(hours=5), agora=AGORA_S)
+    store.record("u1", "chargeback", {}, AGORA - timedelta(days=2), agora=AGORA_S)
+
+    features = store.features("u1", agora=AGORA_S)
+
+    assert features["transacoes_1h"] == 1
+    assert features["valor_transacoes_24h"] == 130
+    assert features["transacoes_30d"] == 3
+    assert features["dias_ativos_30d"] == 2
+    assert features["chargeback_rate_30d"] == 1 / 3
+
+
+def test_buckets_vencidos_saem_da_janela_sem_varredura():
+    store = _store()
+    store.record("u1", "login", {}, AGORA, agora=AGORA_S)
+
+    depois = AGORA_S + timedelta(days=2).total_seconds()
+    features = store.features("u1", agora=depois)
+
+    assert features["logins_24h"] == 0
+    assert features["logins_30d"] == 1
+
+
+def test_evento_mais_antigo_que_todas_as_janelas_e_ignorado():
+    store = _store()
+
+    aplicados = store.record("u1", "pix_payment", {"amount": 10}, AGORA - timedelta(days=45), agora=AGORA_S)
+
+    assert aplicados == 0
+    assert store.features("u1", agora=AGORA_S)["transacoes_30d"] == 0
+
+
+def test_event_time_aceita_iso_e_segundos():
+    assert event_time({"timestamp": "2024-01-31T12:00:00Z"}) == AGORA
+    assert event_time({"timestamp": AGORA_S}) == AGORA
+    assert event_time({}) is None
+
+
+def test_event_time_malformado_retorna_none():
+    assert event_time({"timestamp": "ontem à tarde"}) is None
+    assert event_time({"timestamp": "2024-13-45T00:00:00"}) is None
+    assert event_time({"timestamp": 1e20}) is None
+    assert event_time({}) is None